@@ -1,227 +1,706 @@
 import os
+import re
+import argparse
 import json
 import time
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import src.helpers as goeshelp
+import src.resample as resample
+import src.basemap as basemap
+import src.render as render
+import src.calibration as calibration
+import src.animation as animation
+import src.navigation as navigation
+import src.regions as regions
+from src.archive import ScanArchive
+from src.pool import ProcessingPool
+from src.processed import ProcessedIndex, ScanTimeFromName
 import numpy as np
-from netCDF4 import Dataset
 from datetime import datetime
-import matplotlib
 import logging
 import glob
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from PIL import Image
+from src.helpers import AddTemperatureLegend, AddLogo, AddImageFoot, GetPlotObject, AddColorbar
 
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
-from src.helpers import AddTemperatureLegend, AddLogo, AddImageFoot, GetPlotObject
+# netCDF4, matplotlib y cartopy se importan en generar_imagen: importar este módulo (por ejemplo
+# desde el orquestador, los procesos del pool o las pruebas) no lee la configuración ni crea directorios
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Configura rutas y leer archivo de configuración
 json_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data/conf/SMN_dict.conf")
-confData = goeshelp.LoadDictionary(json_file_path)
-workdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), confData['workdir'])
-inboxdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), confData['inbox'])
-gif_path = os.path.join(workdir, 'conae.gif')
 
-# Crea directorios si no existen
-if not os.path.exists(workdir):
-    os.makedirs(workdir)
-if not os.path.exists(inboxdir):
-    os.makedirs(inboxdir)
+# Configuración y estado del procesador; se inicializan en configurar()
+confData = None
+workdir = None
+inboxdir = None
+gif_path = None
+animaciones = {}
+
+# Registro de archivos procesados (se abre al primer uso)
+indice = None
+
+# Archivo histórico de recortes calibrados (se abre al primer uso si `archive_enabled` está activo)
+archivo = None
 
-logging.info(f"Directorio de trabajo: {workdir}")
-logging.info(f"Directorio de entrada: {inboxdir}")
+_config_lock = threading.Lock()
+_animation_lock = threading.Lock()
+_indice_lock = threading.Lock()
+_archivo_lock = threading.Lock()
 
-def actualizar_gif(imagenes, gif_path):
+def configurar():
     """
-    Actualiza el GIF con una lista de imágenes y una duración específica entre cuadros usando Pillow.
+    Lee el archivo de configuración y crea los directorios, una única vez.
+
+    Returns:
+        dict: Diccionario de configuración.
+    """
+    global confData, workdir, inboxdir, gif_path
+    with _config_lock:
+        if confData is not None:
+            return confData
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+        # Configura rutas y leer archivo de configuración
+        data = goeshelp.LoadDictionary(json_file_path)
+        workdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), data['workdir'])
+        inboxdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), data['inbox'])
+        gif_path = os.path.join(workdir, 'conae.gif')
+
+        # Crea directorios si no existen
+        if not os.path.exists(workdir):
+            os.makedirs(workdir)
+        if not os.path.exists(inboxdir):
+            os.makedirs(inboxdir)
+
+        logging.info(f"Directorio de trabajo: {workdir}")
+        logging.info(f"Directorio de entrada: {inboxdir}")
+        confData = data
+        return confData
+
+def satelites_configurados():
+    """
+    Devuelve los satélites que procesa esta instalación (`satellites` o `satellite` en la configuración).
+
+    Returns:
+        list: Identificadores de los satélites ('G16', 'G19', ...); el primero es el principal.
+    """
+    configurar()
+    return confData.get('satellites') or [confData.get('satellite', 'G16')]
+
+def obtener_animacion(satelite, region):
+    """
+    Devuelve la animación de un satélite y una región, creándola la primera vez.
+
+    Cada par tiene su propia ventana móvil: la del satélite y la región principales (los primeros
+    configurados) se escribe en `conae.gif` y las demás en `conae[_<satélite>][_<región>].gif`.
 
     Args:
-        imagenes (list): Lista de rutas a las imágenes.
-        gif_path (str): Ruta del archivo GIF de salida.
+        satelite (str): Identificador del satélite ('G16', 'G19', ...).
+        region (str): Nombre de la región (ver `regions.GetRegions`).
 
     Returns:
-        None
+        AnimationBuilder: La animación del satélite y la región.
+    """
+    configurar()
+    with _animation_lock:
+        animacion = animaciones.get((satelite, region))
+        if animacion is None:
+            sufijo = ('' if satelite == satelites_configurados()[0] else f'_{satelite}') + \
+                     ('' if region == regions.GetRegions(confData)[0]['name'] else f'_{region}')
+            path = os.path.join(workdir, f'conae{sufijo}.gif') if sufijo else gif_path
+            # Animación con ventana móvil, codificada en segundo plano
+            animacion = animation.AnimationBuilder(path,
+                                                   frame_duration=confData.get('gif_frame_duration', 1.0),  # Valor predeterminado: 1 segundo
+                                                   max_frames=confData.get('animation_max_frames', 36),
+                                                   max_hours=confData.get('animation_max_hours', None),
+                                                   formats=confData.get('animation_formats', ['gif']))
+            animaciones[(satelite, region)] = animacion
+    return animacion
+
+def obtener_indice():
     """
-    # Leer la duración desde el archivo de configuración
-    frame_duration = confData.get('gif_frame_duration', 1.0)  # Valor predeterminado: 1 segundo
-    frame_duration_ms = int(frame_duration * 1000)  # Convertir segundos a milisegundos
-    logging.info(f"Configurando duración por cuadro en {frame_duration} segundos.")
+    Devuelve el registro persistente de archivos procesados, abriéndolo la primera vez.
 
-    try:
-        # Cargar todas las imágenes
-        frames = [Image.open(imagen) for imagen in imagenes]
-
-        # Crear el GIF con la duración deseada
-        if frames:
-            frames[0].save(
-                gif_path,
-                save_all=True,
-                append_images=frames[1:],
-                duration=frame_duration_ms,  # Duración en milisegundos
-                loop=0  # Repetir infinitamente
-            )
-            logging.info(f"GIF generado correctamente: {gif_path}")
-        else:
-            logging.warning("No se encontraron imágenes para generar el GIF.")
-    except Exception as e:
-        logging.error(f"Error al generar el GIF: {e}")
+    Returns:
+        ProcessedIndex: El registro de archivos procesados.
+    """
+    global indice
+    configurar()
+    # Lo usan a la vez el hilo de recuperación, el consumidor de entregas y el de resultados del pool
+    if indice is None:
+        with _indice_lock:
+            if indice is None:
+                indice = ProcessedIndex(os.path.join(workdir, confData.get('processed_db', 'processed.sqlite')))
+    return indice
+
+def obtener_archivo():
+    """
+    Devuelve el archivo histórico de recortes calibrados, abriéndolo la primera vez.
 
-def procesar_archivo(image_path):
+    Returns:
+        ScanArchive: El archivo histórico, o None si `archive_enabled` no está activo.
     """
-    Procesa un archivo NetCDF para generar imágenes y actualiza el GIF.
+    global archivo
+    configurar()
+    if archivo is None and confData.get('archive_enabled', False):
+        with _archivo_lock:
+            if archivo is None:
+                archivo = ScanArchive(os.path.join(os.path.dirname(os.path.abspath(__file__)), confData.get('archive_dir', 'archive')),
+                                      chunk_time=confData.get('archive_chunk_time', 6),
+                                      chunk_space=confData.get('archive_chunk_space', 256),
+                                      complevel=confData.get('archive_complevel', 4))
+    return archivo
+
+def generar_imagen(image_path, memory=None):
+    """
+    Procesa un archivo NetCDF para generar las imágenes de todas las regiones, sin actualizar la animación.
+
+    El recorte que cubre todas las regiones se lee y clasifica una única vez; cada región se dibuja
+    a partir de una vista de esa clasificación. Con `archive_enabled` se devuelven además la
+    temperatura de brillo y las clases del recorte, que el proceso principal agrega al archivo histórico.
 
     Args:
-        image_path (str): Ruta del archivo NetCDF.
+        image_path (str): Ruta del archivo NetCDF, o su nombre si se entrega en memoria.
+        memory (bytes, optional): Contenido del NetCDF ya descargado; evita leerlo desde disco.
 
     Returns:
-        None
+        dict: `imagenes`, con la ruta de la imagen generada, su fecha, el satélite y la región de cada región, y
+        `escaneo`, con el recorte a archivar (o None); None si no se pudo leer el archivo.
     """
+    from netCDF4 import Dataset
+
+    configurar()
     try:
         logging.info(f'Procesando archivo {image_path}')
-        netCDFread = Dataset(image_path, 'r')
+        netCDFread = Dataset(image_path, 'r', memory=memory)
     except Exception as e:
         logging.error(f"Error al leer el archivo NetCDF {image_path}: {e}")
-        return
+        return None
 
-    # Extraer metadatos
-    logging.info('Extrayendo metadatos.')
-    YY, MM, DD = netCDFread.__dict__['time_coverage_start'].split('T')[0].split('-')
-    HH, mm, s_ms = netCDFread.__dict__['time_coverage_start'].split('T')[1].split('Z')[0].split(':')
-    ss, mls = s_ms.split('.')
+    try:
+        # Extraer metadatos
+        logging.info('Extrayendo metadatos.')
+        YY, MM, DD = netCDFread.__dict__['time_coverage_start'].split('T')[0].split('-')
+        HH, mm, s_ms = netCDFread.__dict__['time_coverage_start'].split('T')[1].split('Z')[0].split(':')
+        ss, mls = s_ms.split('.')
+        fecha = datetime(int(YY), int(MM), int(DD), int(HH), int(mm), int(ss))
+
+        metaCDF = netCDFread.variables
+        satelite = navigation.GetSatellite(netCDFread)
+
+        # Verificar y obtener la proyección
+        if 'geospatial_lat_lon_extent' in metaCDF:
+            lon_0 = metaCDF['geospatial_lat_lon_extent'].getncattr('geospatial_lon_center')
+        else:
+            lon_0 = 0  # Valor predeterminado si no se encuentra
 
-    metaCDF = netCDFread.variables
+        sat_h = metaCDF['goes_imager_projection'].perspective_point_height
 
-    # Verificar y obtener la proyección
-    if 'geospatial_lat_lon_extent' in metaCDF:
-        lon_0 = metaCDF['geospatial_lat_lon_extent'].getncattr('geospatial_lon_center')
-    else:
-        lon_0 = 0  # Valor predeterminado si no se encuentra
+        # Verificar y obtener el canal
+        if 'band_id' in metaCDF:
+            icanal = int(metaCDF['band_id'][:])
+        else:
+            icanal = 0  # Valor predeterminado si no existe
+
+        # Regiones a generar (declaradas en `regions`) y unión de sus grillas de datos
+        regiones = regions.GetRegions(confData)
+        union = regions.UnionExtent([region['grid_extent'] for region in regiones])
+
+        logging.info(f'Comienza el procesamiento de los productos IROL para {", ".join(region["name"] for region in regiones)}.')
+        start = time.time()
+
+        # Levanta una única vez el recorte que cubre todas las regiones
+        logging.info('Lectura de la imagen recortada.')
+        _, union_indexes = goeshelp.GetCroppedImage(netCDFread, *union)
+
+        # Define los umbrales de temperatura
+        thr_1 = -53  # Rango entre -53 y -63 grados
+        thr_2 = -63  # Rango entre -63 y -73 grados
+        thr_3 = -73  # Rango entre -73 y -90 grados
+        thr_min = -90  # Rango mínimo aceptado
+
+        # Lectura, calibración y clasificación por bloques de filas, dentro de `memory_budget_mb` (resultados incluidos)
+        union_class, union_bt = calibration.ClassifyWindow(netCDFread, union_indexes, (thr_1, thr_2, thr_3, thr_min),
+                                                           use_lut=confData.get('calibration_engine', 'lut') == 'lut' and icanal >= 7,
+                                                           with_temperature=confData.get('archive_enabled', False),
+                                                           # Un buffer en memoria no tiene archivo que abrir con h5py
+                                                           engine=confData.get('read_engine', 'netcdf4') if memory is None else 'netcdf4',
+                                                           threads=confData.get('read_threads', 4),
+                                                           memory_budget_mb=confData.get('memory_budget_mb', None))
+
+        # Recorte calibrado para el archivo histórico (se escribe en el proceso principal)
+        escaneo = None
+        if confData.get('archive_enabled', False):
+            # La ventana se archiva respecto del disco completo: los archivos recortados en la descarga traen su desplazamiento
+            attrs = netCDFread.ncattrs()
+            offset_x = int(netCDFread.getncattr('crop_offset_x')) if 'crop_offset_x' in attrs else 0
+            offset_y = int(netCDFread.getncattr('crop_offset_y')) if 'crop_offset_y' in attrs else 0
+            ventana = [union_indexes[0] + offset_x, union_indexes[1] + offset_x, union_indexes[2] + offset_y, union_indexes[3] + offset_y]
+            escaneo = {'satelite': satelite['id'], 'fecha': fecha, 'ventana': ventana,
+                       'proyeccion': navigation.GetProjectionParameters(netCDFread),
+                       'x': np.asarray(metaCDF['x'][union_indexes[0]:union_indexes[1]], dtype=np.float64),
+                       'y': np.asarray(metaCDF['y'][union_indexes[2]:union_indexes[3]], dtype=np.float64),
+                       'temperatura': union_bt, 'clases': union_class}
+
+        canal = ('%02d' % icanal)
+        Title = f'{satelite["name"]} ABI Canal {canal} - Mapa de Topes Nubosos {YY}/{MM}/{DD} {HH}:{mm}:{ss} UTC'
+        nombre_base = f'CONAE_PRD_{satelite["label"]}_ABI_IROL_{YY}{MM}{DD}_{HH}{mm}{ss}{mls}00_'
+
+        # Cada región es una vista (sin copia) de la clasificación de la unión
+        vistas = []
+        for region in regiones:
+            img_extent, img_indexes = goeshelp.GetCroppedImage(netCDFread, *region['grid_extent'])
+            image_class, img_indexes = regions.SliceWindow(union_class, union_indexes, img_indexes)
+            png_dir = os.path.join(workdir, nombre_base + f'gC{region["name"]}_v001.png')
+            vistas.append((region, img_extent, img_indexes, image_class, png_dir))
+
+        if confData.get('render_backend', 'matplotlib') == 'numpy':
+            # Motor sin matplotlib: capas estáticas en caché y composición directa en índices de paleta.
+            # Los motores se preparan en este hilo (el mapa base usa matplotlib la primera vez) y las
+            # regiones se dibujan en paralelo: NumPy y la codificación PNG liberan el GIL.
+            tareas = []
+            for region, img_extent, img_indexes, image_class, png_dir in vistas:
+                base = basemap.GetBasemap(confData, region['extent'])
+                index_map = resample.GetIndexMap(netCDFread, img_indexes, region['grid_extent'], confData.get('resample_resolution_deg', 0.02))
+                tareas.append((render.GetRenderer(base, region['grid_extent'], index_map), image_class, png_dir))
+            with ThreadPoolExecutor(max_workers=max(min(len(tareas), confData.get('render_workers', 4)), 1)) as executor:
+                list(executor.map(lambda tarea: tarea[0].Render(tarea[1], Title, tarea[2],
+                                                                compress_level=confData.get('png_compress_level', 6)), tareas))
+            for _, _, png_dir in tareas:
+                logging.info(f"Imagen guardada en {png_dir}")
+            logging.info(f'{len(tareas)} imágenes dibujadas en {time.time() - start:.2f} s.')
+            return {'imagenes': [(png_dir, fecha, satelite['id'], region['name']) for region, _, _, _, png_dir in vistas],
+                    'escaneo': escaneo}
+
+        # Motor matplotlib: se importa solo si se usa (no es seguro entre hilos, las regiones se dibujan en serie)
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        import cartopy.crs as ccrs
+
+        # Crear un mapa de colores donde el valor NaN es el fondo blanco
+        colors = ['white', 'yellow', 'orange', 'red']
+        cmap = matplotlib.colors.ListedColormap(colors)
+        cmap.set_bad(color='white')  # Asignar color blanco a los valores NaN
+
+        crs = ccrs.Geostationary(central_longitude=lon_0, satellite_height=sat_h)
+        resultados = []
+        for region, img_extent, img_indexes, image_class, png_dir in vistas:
+            extent = region['extent']
+            grid_extent = region['grid_extent']
+
+            # Armando las figuras y ejes
+            base = None
+            if confData.get('basemap_cache', True):
+                # Capas estáticas pre-renderizadas una única vez por extent, tamaño de figura y dpi
+                base = basemap.GetBasemap(confData, extent)
+                fig, ax = base.NewFrame()
+            else:
+                fig = plt.figure(clear='True')
+                fig.set_size_inches(confData['figure_length_inches'], confData['figure_high_inches'])
+                ax = GetPlotObject(confData, extent)
+                AddColorbar(fig, ax)
+
+            if confData.get('resample_engine', 'index') == 'index':
+                # Reproyección con el mapa de índices precalculado: un único gather por imagen
+                index_map = resample.GetIndexMap(netCDFread, img_indexes, grid_extent, confData.get('resample_resolution_deg', 0.02))
+                image_grid = resample.Reproject(image_class, index_map, 0)
+                plt.imshow(image_grid, transform=ccrs.PlateCarree(), extent=grid_extent, origin='upper', cmap=cmap,
+                           vmin=-0.5, vmax=3.5, aspect='auto', interpolation='nearest')
+            else:
+                # Reproyección de los datos con cartopy
+                plt.imshow(image_class, transform=crs, extent=img_extent, origin='upper', cmap=cmap, vmin=-0.5, vmax=3.5, aspect='auto')
+            AddTemperatureLegend(ax)
+
+            # Creando las imágenes
+            if base is not None:
+                base.AddTitle(fig, Title, size=8.0)
+            else:
+                AddImageFoot(ax, Title, size=8.0)
+                AddLogo(ax)
+            plt.savefig(png_dir, dpi=confData['figure_resolution_dpi'])
+            logging.info(f"Imagen guardada en {png_dir}")
+            plt.close(fig)
+            resultados.append((png_dir, fecha, satelite['id'], region['name']))
+        logging.info(f'{len(resultados)} imágenes dibujadas en {time.time() - start:.2f} s.')
+        return {'imagenes': resultados, 'escaneo': escaneo}
+    finally:
+        # Con el pool de procesos cada worker procesa muchos archivos: no dejar descriptores abiertos
+        netCDFread.close()
+
+def agregar_cuadro(image_path, resultado, animar=True):
+    """
+    Agrega a la animación de su satélite y región cada imagen generada a partir de un archivo y
+    archiva el recorte calibrado.
 
-    sat_h = metaCDF['goes_imager_projection'].perspective_point_height
+    Args:
+        image_path (str): Ruta del archivo NetCDF procesado.
+        resultado (dict): Valor devuelto por `generar_imagen`.
+        animar (bool, optional): Si es False solo se registra y archiva el escaneo (reprocesamiento por lotes).
 
-    # Verificar y obtener el canal
-    if 'band_id' in metaCDF:
-        icanal = int(metaCDF['band_id'][:])
-    else:
-        icanal = 0  # Valor predeterminado si no existe
-
-    # Definir el extent a generar
-    region = 'ARG'
-    if region == 'SuA_ARG':
-        extent = [confData['sudamerica_lon_W'], confData['sudamerica_lon_E'], confData['sudamerica_lat_S'], confData['sudamerica_lat_N']]
-    elif region == 'SuA':
-        extent = [confData['sudamerica_lon_W'], confData['sudamerica_lon_E'], confData['sudamerica_lat_S'], confData['sudamerica_lat_N']]
-    elif region == 'ARG':
-        extent = [confData['argentina_lon_W'], confData['argentina_lon_E'], confData['argentina_lat_S'], confData['argentina_lat_N']]
-    elif region == 'test':
-        extent = [-68.0, -52.0, -42.0, -31.0]
-    else:
-        logging.error('Debe seleccionar una de las siguientes áreas: SuA_ARG, SuA, ARG, custom!')
-        return
+    Returns:
+        None
+    """
+    if resultado is not None:
+        imagenes = resultado['imagenes']
+        if os.path.exists(image_path):
+            obtener_indice().Add(image_path, imagenes[0][0] if imagenes else None)
+        if animar:
+            for png_dir, fecha, satelite, region in imagenes:
+                obtener_animacion(satelite, region).AddFrame(png_dir, fecha)
+        if resultado['escaneo'] is not None:
+            archivar_escaneo(image_path, resultado['escaneo'])
+
+def archivar_escaneo(image_path, escaneo):
+    """
+    Agrega el recorte calibrado de un escaneo al archivo histórico y, con `archive_delete_source`,
+    borra el NetCDF de disco completo del inbox.
 
-    logging.info('Comienza el procesamiento de los productos IROL para Argentina y Sudamérica.')
-    start = time.time()
+    Args:
+        image_path (str): Ruta del archivo NetCDF procesado.
+        escaneo (dict): Recorte devuelto por `generar_imagen`.
 
-    # Levanta la imagen recortada y obtener el extent
-    logging.info('Lectura de la imagen recortada.')
-    img_extent, img_indexes = goeshelp.GetCroppedImage(netCDFread, 
-                                extent[0] + confData['delta_lon_W_for_graph'],
-                                extent[1],
-                                extent[2] + confData['delta_lat_S_for_graph'],
-                                extent[3] + confData['delta_lat_N_for_graph'])
-
-    imagedata = netCDFread.variables['Rad'][img_indexes[2]:img_indexes[3],
-                                                img_indexes[0]:img_indexes[1]][::1,::1]
-
-    # Calibración de los datos
-    image_cal, _ = goeshelp.GetCalibratedImage(netCDFread, imagedata)
-    del imagedata
-
-    # Define los umbrales de temperatura
-    thr_1 = -53  # Rango entre -53 y -63 grados
-    thr_2 = -63  # Rango entre -63 y -73 grados
-    thr_3 = -73  # Rango entre -73 y -90 grados
-    thr_min = -90  # Rango mínimo aceptado
-
-    # Asignar NaN a los valores fuera de los rangos establecidos
-    image_cal = np.where((image_cal < thr_min) | (image_cal > thr_1), np.nan, image_cal)
-
-    # Clasificación de valores en rangos
-    image_class = np.full(image_cal.shape, np.nan)
-    image_class = np.where((image_cal >= thr_1), 0, image_class)
-    image_class = np.where((image_cal < thr_1) & (image_cal >= thr_2), 1, image_class)
-    image_class = np.where((image_cal < thr_2) & (image_cal >= thr_3), 2, image_class)
-    image_class = np.where(image_cal < thr_3, 3, image_class)
-
-    # Crear un mapa de colores donde el valor NaN es el fondo blanco
-    colors = ['white', 'yellow', 'orange', 'red']
-    cmap = matplotlib.colors.ListedColormap(colors)
-    cmap.set_bad(color='white')  # Asignar color blanco a los valores NaN
-
-    # Armando las figuras y ejes
-    crs = ccrs.Geostationary(central_longitude=lon_0, satellite_height=sat_h)
-    fig = plt.figure(clear='True')
-    fig.set_size_inches(confData['figure_length_inches'], confData['figure_high_inches'])
-    ax = GetPlotObject(confData, extent)
-
-    # Define los colores y los límites de la barra lateral
-    colors = ["red", "orange", "yellow"]
-    bounds = [-90 , -73, -63, -53]
-    norm = matplotlib.colors.BoundaryNorm(bounds, len(colors))
-
-    # Agrega la barra lateral con título y etiquetas personalizadas
-    sm = plt.cm.ScalarMappable(cmap=matplotlib.colors.ListedColormap(colors), norm=norm)
-    sm.set_array([])
-    cbar = fig.colorbar(sm, boundaries=bounds, ticks=bounds, ax=ax)
-    cbar.ax.set_title('T°C', fontsize=8)
-    cbar.ax.tick_params(labelsize=6)
-    cbar.ax.set_yticklabels([f'{int(tick)}°C' for tick in bounds], fontsize=6)
-
-    # Reproyección de los datos con cartopy
-    plt.imshow(image_class, transform=crs, extent=img_extent, origin='upper', cmap=cmap, vmin=-0.5, vmax=3.5, aspect='auto')
-    AddTemperatureLegend(ax)
-
-    # Creando las imágenes
-    canal = ('%02d' % icanal)
-    if region == 'ARG':
-        Title = f'GOES-16 ABI Canal {canal} - Mapa de Topes Nubosos {YY}/{MM}/{DD} {HH}:{mm}:{ss} UTC'
-        nombre_base = f'CONAE_PRD_GOES16_ABI_IROL_{YY}{MM}{DD}_{HH}{mm}{ss}{mls}00_'
-        AddImageFoot(ax, Title, size=8.0)
-        AddLogo(ax)
-        nombre_completo = nombre_base + 'gCArgentina_v001'
-        png_dir = os.path.join(workdir, nombre_completo + '.png')
-        plt.savefig(png_dir, dpi=confData['figure_resolution_dpi'])
-        logging.info(f"Imagen guardada en {png_dir}")
-        
-        # Actualizar el GIF con la nueva imagen
-        imagenes_existentes = sorted(glob.glob(os.path.join(workdir, 'CONAE_PRD_GOES16_ABI_IROL_*.png')))
-        actualizar_gif(imagenes_existentes, gif_path)
+    Returns:
+        bool: True si el escaneo se archivó.
+    """
+    try:
+        cubo = obtener_archivo().Append(escaneo['satelite'], escaneo['fecha'], escaneo['ventana'], escaneo['proyeccion'],
+                                        escaneo['x'], escaneo['y'], escaneo['temperatura'], escaneo['clases'])
+    except (OSError, RuntimeError, ValueError) as e:
+        logging.error(f"No se pudo archivar el escaneo de {image_path}: {e}")
+        return False
+    logging.info(f"Escaneo archivado en {cubo}")
+    # Solo se borran archivos del inbox ya registrados como procesados
+    if confData.get('archive_delete_source', False) and os.path.dirname(os.path.abspath(image_path)) == os.path.abspath(inboxdir) \
+            and obtener_indice().IsProcessed(image_path):
+        os.remove(image_path)
+        logging.info(f"Archivo de disco completo eliminado: {image_path}")
+    return True
+
+def procesar_archivo(image_path, memory=None):
+    """
+    Procesa un archivo NetCDF para generar imágenes y actualiza la animación.
+
+    Args:
+        image_path (str): Ruta del archivo NetCDF, o su nombre si se entrega en memoria.
+        memory (bytes, optional): Contenido del NetCDF ya descargado; evita leerlo desde disco.
+
+    Returns:
+        bool: True si se generaron las imágenes; False si no se pudo leer el archivo.
+    """
+    resultado = generar_imagen(image_path, memory=memory)
+    agregar_cuadro(image_path, resultado)
+    return resultado is not None
 
 # Monitoreo de la carpeta inbox usando watchdog
 class MyHandler(FileSystemEventHandler):
+    def __init__(self, pool):
+        """
+        Args:
+            pool (ProcessingPool): Pool que procesa los archivos detectados.
+        """
+        super().__init__()
+        self.pool = pool
+
+    def encolar(self, path):
+        if path.endswith('.nc') and not obtener_indice().IsProcessed(path):
+            # Bloquea el hilo del observador si la cola está llena (contrapresión)
+            self.pool.Submit(path, timeout=confData.get('processing_queue_timeout', None))
+
     def on_created(self, event):
         if event.is_directory:
             return
-        if event.src_path.endswith('.nc'):
-            procesar_archivo(event.src_path)
+        self.encolar(event.src_path)
 
-if __name__ == "__main__":
-    event_handler = MyHandler()
-    observer = Observer()
-    observer.schedule(event_handler, inboxdir, recursive=False)
-    observer.start()
+    def on_moved(self, event):
+        if event.is_directory:
+            return
+        self.encolar(event.dest_path)
+
+def recuperar_pendientes(pool):
+    """
+    Encola los archivos del inbox que todavía no se procesaron (por ejemplo, los que llegaron
+    con el procesador detenido), del más reciente al más antiguo.
+
+    Args:
+        pool (ProcessingPool): Pool que procesa los archivos.
+
+    Returns:
+        int: Cantidad de archivos encolados.
+    """
+    pendientes = obtener_indice().Pending(glob.glob(os.path.join(inboxdir, '*.nc')))
+    logging.info(f"Archivos pendientes en el inbox: {len(pendientes)}")
+    return sum(pool.Submit(path) for path in pendientes)
+
+# Archivos de los que se generan los productos IROL: banda 13 del disco completo, de cualquier satélite
+PATRON_IROL = re.compile(r'OR_ABI-L1b-RadF-M\dC13_G\d{2}_')
+
+def es_archivo_irol(path):
+    """
+    Indica si un archivo es de la banda 13 del disco completo, la única que procesa este módulo.
+
+    Args:
+        path (str): Ruta o nombre del archivo.
+
+    Returns:
+        bool: True si el nombre sigue la convención de los archivos ABI-L1b-RadF de la banda 13.
+    """
+    return PATRON_IROL.search(os.path.basename(path)) is not None
+
+def consumir_entregas(hand_off_queue, pool, detener):
+    """
+    Encola en el pool los archivos que entrega el descargador, hasta que se activa `detener`.
+
+    Args:
+        hand_off_queue (queue.Queue): Cola con las rutas de los archivos descargados.
+        pool (ProcessingPool): Pool que procesa los archivos.
+        detener (threading.Event): Evento para dejar de consumir la cola.
+
+    Returns:
+        None
+    """
+    while not detener.is_set():
+        try:
+            path = hand_off_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+        if not es_archivo_irol(path):
+            # Otras bandas y productos se descargan a sus propios directorios y no se dibujan
+            logging.warning(f'Se ignora el archivo entregado que no es de la banda 13: {path}')
+        elif not obtener_indice().IsProcessed(path):
+            pool.Submit(path)
+
+def run(hand_off_queue=None, stop_event=None):
+    """
+    Ejecuta el procesador hasta que se interrumpe o se activa `stop_event`.
+
+    Sin cola de entrega se vigila el inbox con watchdog; con cola (orquestador de `run_all.py`)
+    los archivos llegan directamente desde el descargador, sin sondear el sistema de archivos.
+
+    Args:
+        hand_off_queue (queue.Queue, optional): Cola con las rutas de los archivos descargados.
+        stop_event (threading.Event, optional): Evento para detener el procesador.
+
+    Returns:
+        None
+    """
+    global indice
+    configurar()
+    stop_event = stop_event or threading.Event()
+
+    # Pool de procesos: matplotlib y cartopy no son seguros entre hilos
+    pool = ProcessingPool(generar_imagen,
+                          workers=confData.get('processing_workers', min(4, os.cpu_count() or 1)),
+                          queue_size=confData.get('processing_queue_size', 64),
+                          on_result=agregar_cuadro)
+    observer = None
+    consumidor = None
+    detener = threading.Event()
+    if hand_off_queue is None:
+        event_handler = MyHandler(pool)
+        observer = Observer()
+        observer.schedule(event_handler, inboxdir, recursive=False)
+        observer.start()
+    else:
+        consumidor = threading.Thread(target=consumir_entregas, args=(hand_off_queue, pool, detener), name='hand-off', daemon=True)
+        consumidor.start()
+
+    # Recupera la ventana de la animación de cada satélite y región con las imágenes ya generadas
+    for satelite in satelites_configurados():
+        etiqueta = navigation.SATELLITES.get(satelite, {'label': 'GOES' + satelite[1:]})['label']
+        for region in regions.GetRegions(confData):
+            obtener_animacion(satelite, region['name']).Seed(
+                glob.glob(os.path.join(workdir, f'CONAE_PRD_{etiqueta}_ABI_IROL_*_gC{region["name"]}_v001.png')))
+
+    # Procesa lo que llegó mientras el procesador estaba detenido, sin demorar al observador
+    threading.Thread(target=recuperar_pendientes, args=(pool,), name='catch-up', daemon=True).start()
 
     logging.info("Monitor de archivos iniciado.")
     try:
-        while True:
-            time.sleep(1)
+        while not stop_event.wait(1):
+            pass
     except KeyboardInterrupt:
-        observer.stop()
-    observer.join()
+        pass
+    finally:
+        detener.set()
+        if observer is not None:
+            observer.stop()
+            observer.join()
+        if consumidor is not None:
+            consumidor.join()
+        pool.Close()
+        for animacion in list(animaciones.values()):
+            animacion.Close()
+        obtener_indice().Close()
+        indice = None
+        if archivo is not None:
+            archivo.Close()
+
+# Satélite e inicio del escaneo (con décimas de segundo) en los nombres GOES: ..._G16_sYYYYJJJHHMMSSs_...
+NOMBRE_GOES = re.compile(r'_(G\d{2})_s(\d{4})(\d{3})(\d{2})(\d{2})(\d{2})(\d)')
+
+def salidas_esperadas(image_path):
+    """
+    Arma las rutas de las imágenes que genera un archivo, a partir de su nombre y sin abrirlo.
 
+    Args:
+        image_path (str): Ruta del archivo NetCDF.
 
+    Returns:
+        list: Rutas de las imágenes de cada región, o None si el nombre no sigue la convención GOES.
+    """
+    configurar()
+    match = NOMBRE_GOES.search(os.path.basename(image_path))
+    if match is None:
+        return None
+    satelite, año, dia, hora, minuto, segundo, decimas = match.groups()
+    etiqueta = navigation.SATELLITES.get(satelite, {'label': 'GOES' + satelite[1:]})['label']
+    fecha = datetime.strptime(año + dia, '%Y%j')
+    nombre_base = f'CONAE_PRD_{etiqueta}_ABI_IROL_{fecha:%Y%m%d}_{hora}{minuto}{segundo}{decimas}00_'
+    return [os.path.join(workdir, nombre_base + f'gC{region["name"]}_v001.png') for region in regions.GetRegions(confData)]
+
+def esta_al_dia(image_path):
+    """
+    Indica si las imágenes de un archivo ya existen y son posteriores al archivo y a la configuración.
+
+    Args:
+        image_path (str): Ruta del archivo NetCDF.
+
+    Returns:
+        bool: True si no hace falta volver a generar sus imágenes.
+    """
+    salidas = salidas_esperadas(image_path)
+    if not salidas:
+        return False
+    try:
+        referencia = max(os.path.getmtime(image_path), os.path.getmtime(json_file_path))
+        return all(os.path.getmtime(salida) >= referencia for salida in salidas)
+    except OSError:
+        return False
 
+def buscar_archivos(patrones=None, desde=None, hasta=None, directorio=None):
+    """
+    Busca los NetCDF a reprocesar por patrón y/o por rango de fechas de escaneo.
+
+    Args:
+        patrones (list, optional): Patrones glob; por defecto todos los `.nc` de `directorio`.
+        desde (datetime, optional): Inicio del rango (inclusive).
+        hasta (datetime, optional): Fin del rango (inclusive).
+        directorio (str, optional): Directorio donde buscar; por defecto el inbox.
+
+    Returns:
+        list: Rutas sin repetir, ordenadas por inicio de escaneo.
+    """
+    configurar()
+    patrones = patrones or [os.path.join(directorio or inboxdir, '*.nc')]
+    archivos = sorted(set(path for patron in patrones for path in glob.glob(patron) if path.endswith('.nc')))
+    if desde is not None or hasta is not None:
+        archivos = [path for path in archivos if ScanTimeFromName(path) is not None
+                    and (desde is None or ScanTimeFromName(path) >= desde) and (hasta is None or ScanTimeFromName(path) <= hasta)]
+    return sorted(archivos, key=lambda path: (ScanTimeFromName(path) or datetime.min, path))
+
+def generar_animaciones():
+    """
+    Arma una única vez la animación de cada satélite y región con las imágenes del directorio de trabajo.
+
+    Returns:
+        None
+    """
+    for satelite in satelites_configurados():
+        etiqueta = navigation.SATELLITES.get(satelite, {'label': 'GOES' + satelite[1:]})['label']
+        for region in regions.GetRegions(confData):
+            animacion = obtener_animacion(satelite, region['name'])
+            animacion.Seed(glob.glob(os.path.join(workdir, f'CONAE_PRD_{etiqueta}_ABI_IROL_*_gC{region["name"]}_v001.png')))
+            animacion.Close()
+
+def reprocesar(archivos, forzar=False, workers=None):
+    """
+    Vuelve a generar las imágenes de un lote de archivos con el pool de procesos.
+
+    Los archivos con imágenes al día se omiten (salvo `forzar`). El primero se procesa en este
+    proceso para dejar en el caché en disco la navegación, los mapas de índices y el mapa base, de
+    modo que los workers los cargan en lugar de calcularlos a la vez; cada worker mantiene luego sus
+    cachés en memoria durante todo el lote. La animación se arma una única vez al final.
+
+    Args:
+        archivos (list): Rutas de los NetCDF.
+        forzar (bool, optional): Si es True se regeneran también las imágenes al día.
+        workers (int, optional): Cantidad de procesos; por defecto `processing_workers` o los núcleos disponibles.
+
+    Returns:
+        dict: Cantidad de archivos procesados, omitidos y con error.
+    """
+    global indice
+    configurar()
+    pendientes = [path for path in archivos if forzar or not esta_al_dia(path)]
+    resumen = {'procesados': 0, 'omitidos': len(archivos) - len(pendientes), 'errores': 0}
+    logging.info(f"Reprocesamiento: {len(pendientes)} archivos a procesar, {resumen['omitidos']} al día")
+    start = time.time()
+    lock = threading.Lock()
+
+    def registrar(path, resultado):
+        agregar_cuadro(path, resultado, animar=False)
+        with lock:
+            resumen['procesados' if resultado else 'errores'] += 1
+            hechos = resumen['procesados'] + resumen['errores']
+            if hechos % confData.get('reprocess_report_every', 50) == 0:
+                logging.info(f"Reprocesamiento: {hechos}/{len(pendientes)} archivos en {time.time() - start:.0f} s")
+
+    try:
+        if pendientes:
+            registrar(pendientes[0], generar_imagen(pendientes[0]))
+        if len(pendientes) > 1:
+            pool = ProcessingPool(generar_imagen,
+                                  workers=workers or confData.get('processing_workers', os.cpu_count() or 1),
+                                  queue_size=confData.get('processing_queue_size', 64),
+                                  on_result=registrar, initializer=configurar)
+            for path in pendientes[1:]:
+                pool.Submit(path)
+            pool.Close()
+            # Los archivos que fallaron en el pool no llegan a `registrar`
+            resumen['errores'] = len(pendientes) - resumen['procesados']
+        generar_animaciones()
+    finally:
+        obtener_indice().Close()
+        indice = None
+        if archivo is not None:
+            archivo.Close()
+    logging.info(f"Reprocesamiento completado en {time.time() - start:.0f} s: {resumen}")
+    return resumen
+
+def main(argv=None):
+    """
+    Punto de entrada de la línea de comandos.
+
+    Sin argumentos se ejecuta el monitor del inbox. `reprocess` vuelve a generar las imágenes de un
+    rango de fechas y/o de los archivos que coinciden con los patrones indicados, por ejemplo
+    `python main.py reprocess --start 2024-11-01 --end 2024-11-30 --dir /datos/goes`.
+
+    Args:
+        argv (list, optional): Argumentos; por defecto los de la línea de comandos.
+
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(description='Procesador de imágenes GOES (productos IROL).')
+    comandos = parser.add_subparsers(dest='comando')
+    comandos.add_parser('run', help='Vigila el inbox y procesa los archivos nuevos (por defecto).')
+    reprocess = comandos.add_parser('reprocess', help='Vuelve a generar las imágenes de archivos existentes.')
+    reprocess.add_argument('patrones', nargs='*', help='Patrones glob de los NetCDF; por defecto los `.nc` de --dir.')
+    reprocess.add_argument('--start', type=datetime.fromisoformat, help='Inicio del rango de escaneos (AAAA-MM-DD[THH:MM]).')
+    reprocess.add_argument('--end', type=datetime.fromisoformat, help='Fin del rango de escaneos (AAAA-MM-DD[THH:MM]), inclusive.')
+    reprocess.add_argument('--dir', help='Directorio de los NetCDF; por defecto el inbox.')
+    reprocess.add_argument('--force', action='store_true', help='Regenera también las imágenes al día.')
+    reprocess.add_argument('--workers', type=int, help='Cantidad de procesos.')
+    args = parser.parse_args(argv)
+
+    if args.comando == 'reprocess':
+        # Un fin sin hora incluye el día completo
+        hasta = args.end.replace(hour=23, minute=59, second=59) if args.end and args.end.time() == datetime.min.time() else args.end
+        reprocesar(buscar_archivos(args.patrones, args.start, hasta, args.dir), forzar=args.force, workers=args.workers)
+    else:
+        run()
+
+if __name__ == "__main__":
+    main()
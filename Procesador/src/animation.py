@@ -0,0 +1,289 @@
+import bisect
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+
+# Fecha y hora en los nombres de los productos: ..._IROL_YYYYMMDD_HHMMSS...
+FRAME_TIME_PATTERN = re.compile(r'_(\d{8})_(\d{6})')
+
+# Formato de Pillow para cada salida soportada; 'mp4' se escribe con imageio (requiere imageio-ffmpeg)
+ANIMATION_FORMATS = {'gif': 'GIF', 'webp': 'WEBP', 'apng': 'PNG', 'mp4': None}
+
+def FrameTimeFromName(path):
+    """
+    Obtiene la fecha y hora de un cuadro a partir del nombre del archivo.
+
+    Args:
+        path (str): Ruta de la imagen.
+
+    Returns:
+        datetime: Fecha y hora del cuadro, o None si el nombre no la contiene.
+    """
+    match = FRAME_TIME_PATTERN.search(os.path.basename(path))
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1) + match.group(2), '%Y%m%d%H%M%S')
+
+class AnimationBuilder:
+    """
+    Animación con una ventana móvil de cuadros, actualizada de forma incremental.
+
+    Los cuadros se decodifican y cuantizan a paleta una única vez al agregarlos y se guardan en
+    un buffer ordenado por fecha, recortado a los últimos `max_frames` cuadros y/o `max_hours`
+    horas. La codificación corre en un hilo aparte: si llegan varios cuadros mientras se codifica,
+    se agrupan en una sola actualización, por lo que una codificación lenta nunca demora el
+    procesamiento del siguiente archivo.
+    """
+
+    def __init__(self, output_path, frame_duration=1.0, max_frames=None, max_hours=None, formats=('gif',)):
+        """
+        Args:
+            output_path (str): Ruta de la animación GIF; las demás salidas cambian solo la extensión.
+            frame_duration (float, optional): Duración de cada cuadro en segundos.
+            max_frames (int, optional): Cantidad máxima de cuadros de la ventana.
+            max_hours (float, optional): Antigüedad máxima de los cuadros respecto del más reciente, en horas.
+            formats (list, optional): Salidas a generar entre 'gif', 'webp', 'apng' y 'mp4'.
+
+        Raises:
+            ValueError: Si se solicita un formato no soportado.
+        """
+        unknown = [fmt for fmt in formats if fmt not in ANIMATION_FORMATS]
+        if unknown:
+            raise ValueError(f'Formatos de animación no soportados: {unknown}')
+        self.output_path = output_path
+        self.frame_duration_ms = int(frame_duration * 1000)
+        self.max_frames = max_frames
+        self.max_hours = max_hours
+        self.formats = list(formats)
+        self._times = []
+        self._frames = []
+        self._version = 0
+        self._written = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._worker = None
+
+    def __len__(self):
+        with self._condition:
+            return len(self._frames)
+
+    def _Trim(self):
+        """
+        Recorta el buffer a la ventana configurada (se llama con el lock tomado).
+
+        Returns:
+            None
+        """
+        if self.max_hours is not None and self._times:
+            oldest = self._times[-1] - timedelta(hours=self.max_hours)
+            start = bisect.bisect_left(self._times, oldest)
+            del self._times[:start], self._frames[:start]
+        if self.max_frames is not None and len(self._frames) > self.max_frames:
+            start = len(self._frames) - self.max_frames
+            del self._times[:start], self._frames[:start]
+
+    def _Insert(self, frame_time, frame):
+        """
+        Inserta un cuadro en orden cronológico, reemplazando uno existente con la misma fecha.
+
+        Returns:
+            bool: True si el cuadro quedó dentro de la ventana.
+        """
+        pos = bisect.bisect_left(self._times, frame_time)
+        if pos < len(self._times) and self._times[pos] == frame_time:
+            self._frames[pos] = frame
+        else:
+            self._times.insert(pos, frame_time)
+            self._frames.insert(pos, frame)
+        self._Trim()
+        return frame_time in self._times
+
+    @staticmethod
+    def LoadFrame(png_path):
+        """
+        Decodifica una imagen y la deja en modo paleta, sin mantener el archivo abierto.
+
+        Args:
+            png_path (str): Ruta de la imagen.
+
+        Returns:
+            Image: Cuadro en modo 'P'.
+        """
+        # Pillow se importa al usarlo: importar el procesador no lo carga
+        from PIL import Image
+
+        with Image.open(png_path) as img:
+            if img.mode == 'P':
+                return img.copy()
+            return img.convert('RGB').quantize(colors=256, dither=Image.Dither.NONE)
+
+    def AddFrame(self, png_path, frame_time=None):
+        """
+        Agrega un cuadro nuevo y programa la actualización de la animación.
+
+        Args:
+            png_path (str): Ruta de la imagen generada.
+            frame_time (datetime, optional): Fecha del cuadro; por defecto se toma del nombre del archivo.
+
+        Returns:
+            bool: True si el cuadro quedó dentro de la ventana.
+        """
+        frame_time = frame_time or FrameTimeFromName(png_path) or datetime.fromtimestamp(os.path.getmtime(png_path))
+        frame = self.LoadFrame(png_path)
+        with self._condition:
+            added = self._Insert(frame_time, frame)
+            if added:
+                self._version += 1
+                self._condition.notify_all()
+        if added:
+            self._StartWorker()
+        return added
+
+    def Seed(self, png_paths):
+        """
+        Carga los cuadros existentes (por ejemplo al iniciar) sin decodificar los que quedan fuera de la ventana.
+
+        Args:
+            png_paths (list): Rutas de imágenes previas.
+
+        Returns:
+            int: Cantidad de cuadros cargados.
+        """
+        dated = sorted((FrameTimeFromName(path), path) for path in png_paths if FrameTimeFromName(path) is not None)
+        if self.max_hours is not None and dated:
+            oldest = dated[-1][0] - timedelta(hours=self.max_hours)
+            dated = [item for item in dated if item[0] >= oldest]
+        if self.max_frames is not None:
+            dated = dated[-self.max_frames:] if self.max_frames > 0 else []
+        loaded = 0
+        for frame_time, path in dated:
+            try:
+                frame = self.LoadFrame(path)
+            except OSError as e:
+                logging.warning(f"No se pudo leer el cuadro {path}: {e}")
+                continue
+            with self._condition:
+                self._Insert(frame_time, frame)
+            loaded += 1
+        if loaded:
+            with self._condition:
+                self._version += 1
+                self._condition.notify_all()
+            self._StartWorker()
+        return loaded
+
+    def _StartWorker(self):
+        """
+        Inicia (una sola vez) el hilo que codifica la animación.
+
+        Returns:
+            None
+        """
+        with self._condition:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._Run, name='animation', daemon=True)
+                self._worker.start()
+
+    def _Run(self):
+        """
+        Bucle del hilo de codificación: espera cambios y escribe la última versión de la ventana.
+
+        Returns:
+            None
+        """
+        while True:
+            with self._condition:
+                while self._written == self._version and not self._closed:
+                    self._condition.wait()
+                if self._written == self._version and self._closed:
+                    return
+                version = self._version
+                frames = list(self._frames)
+            try:
+                self.Write(frames)
+            except Exception as e:
+                logging.error(f"Error al generar la animación: {e}")
+            with self._condition:
+                self._written = version
+                self._condition.notify_all()
+
+    def OutputPath(self, fmt):
+        """
+        Devuelve la ruta de salida de un formato.
+
+        Args:
+            fmt (str): Formato ('gif', 'webp', 'apng' o 'mp4').
+
+        Returns:
+            str: Ruta del archivo.
+        """
+        return os.path.splitext(self.output_path)[0] + '.' + fmt
+
+    def Write(self, frames):
+        """
+        Codifica los cuadros en todos los formatos configurados, reemplazando cada salida de forma atómica.
+
+        Args:
+            frames (list): Cuadros en modo 'P', en orden cronológico.
+
+        Returns:
+            None
+        """
+        if not frames:
+            logging.warning("No se encontraron imágenes para generar la animación.")
+            return
+        for fmt in self.formats:
+            path = self.OutputPath(fmt)
+            tmp_path = path + '.tmp'
+            if fmt == 'mp4':
+                try:
+                    import imageio.v2 as imageio
+                    with imageio.get_writer(tmp_path, format='FFMPEG', fps=1000.0 / self.frame_duration_ms) as writer:
+                        for frame in frames:
+                            writer.append_data(np.asarray(frame.convert('RGB')))
+                except (ImportError, ValueError, RuntimeError) as e:
+                    logging.warning(f"No se pudo generar el video MP4 (se requiere imageio-ffmpeg): {e}")
+                    continue
+            else:
+                frames[0].save(tmp_path, format=ANIMATION_FORMATS[fmt], save_all=True, append_images=frames[1:],
+                               duration=self.frame_duration_ms, loop=0)
+            os.replace(tmp_path, path)
+            logging.info(f"Animación generada correctamente: {path}")
+
+    def Flush(self, timeout=None):
+        """
+        Espera a que la animación refleje todos los cuadros agregados.
+
+        Args:
+            timeout (float, optional): Tiempo máximo de espera en segundos.
+
+        Returns:
+            bool: True si la animación está al día.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._written == self._version, timeout)
+
+    def Close(self, timeout=None):
+        """
+        Escribe las actualizaciones pendientes y detiene el hilo de codificación.
+
+        Args:
+            timeout (float, optional): Tiempo máximo de espera en segundos.
+
+        Returns:
+            None
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
+        with self._condition:
+            # Permite volver a usar la animación (por ejemplo, si el orquestador reinicia el procesador)
+            if self._worker is worker and not (worker and worker.is_alive()):
+                self._worker = None
+                self._closed = False
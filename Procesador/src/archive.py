@@ -0,0 +1,250 @@
+import glob
+import logging
+import os
+import threading
+from datetime import datetime
+import numpy as np
+
+# Unidades del eje temporal de los cubos diarios
+TIME_UNITS = 'seconds since 1970-01-01 00:00:00'
+
+def ArchivePath(directory, satellite, scan_time, window=None):
+    """
+    Arma la ruta del cubo diario de un satélite.
+
+    Args:
+        directory (str): Directorio del archivo histórico.
+        satellite (str): Identificador del satélite ('G16', 'G19', ...).
+        scan_time (datetime): Fecha del escaneo.
+        window (list, optional): Ventana de recorte; solo se indica para los escaneos cuya ventana
+            difiere de la del cubo del día (por ejemplo, si cambiaron las regiones a mitad del día).
+
+    Returns:
+        str: Ruta `<directory>/<satélite>/<año>/IROL_<satélite>_<AAAAMMDD>.nc`, o
+        `IROL_<satélite>_<AAAAMMDD>_w<x0>-<x1>-<y0>-<y1>.nc` con una ventana.
+    """
+    suffix = '_w' + '-'.join(str(int(v)) for v in window) if window is not None else ''
+    return os.path.join(directory, satellite, scan_time.strftime('%Y'), f'IROL_{satellite}_{scan_time:%Y%m%d}{suffix}.nc')
+
+def ArchiveDay(path):
+    """
+    Obtiene el día de un cubo a partir de su nombre.
+
+    Args:
+        path (str): Ruta del cubo (ver `ArchivePath`).
+
+    Returns:
+        datetime: El día del cubo.
+    """
+    return datetime.strptime(os.path.basename(path).split('_')[2][:8], '%Y%m%d')
+
+class ScanArchive:
+    """
+    Archivo histórico del recorte calibrado de cada escaneo, en cubos NetCDF4 diarios.
+
+    Cada día y satélite se guarda en un archivo con una dimensión `time` ilimitada y las variables
+    `BT` (temperatura de brillo en °C empaquetada en int16) y `class` (clases de topes nubosos),
+    con chunks (tiempo, filas, columnas) comprimidos con zlib y shuffle. Los archivos usan el modelo
+    NETCDF4_CLASSIC para que varios días se lean como un único arreglo con `netCDF4.MFDataset`
+    (ver `OpenArchive`). El archivo del día se mantiene abierto mientras llegan escaneos y se
+    sincroniza después de cada uno. Si la ventana de recorte cambia a mitad del día, los escaneos
+    con la ventana nueva van a un segundo cubo del mismo día, con la ventana en el nombre. Se usa
+    desde un único proceso (el principal del procesador).
+    """
+
+    def __init__(self, directory, chunk_time=6, chunk_space=256, complevel=4):
+        """
+        Args:
+            directory (str): Directorio del archivo histórico.
+            chunk_time (int, optional): Escaneos por chunk (6 = una hora de disco completo en el modo 6).
+            chunk_space (int, optional): Filas y columnas por chunk.
+            complevel (int, optional): Nivel de compresión zlib (1 a 9).
+        """
+        self.directory = directory
+        self.chunk_time = int(chunk_time)
+        self.chunk_space = int(chunk_space)
+        self.complevel = int(complevel)
+        self._open = {}  # Ruta -> (satélite, Dataset) de los cubos abiertos del día en curso
+        self._lock = threading.Lock()
+
+    def _Create(self, path, window, projection, x, y):
+        """
+        Crea el cubo de un día para una ventana de recorte.
+
+        Returns:
+            Dataset: El archivo abierto en modo escritura.
+        """
+        from netCDF4 import Dataset
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        nc = Dataset(path, 'w', format='NETCDF4_CLASSIC')
+        nc.title = 'Recortes calibrados de topes nubosos (IROL)'
+        nc.crop_window = np.asarray(window, dtype=np.int32)
+        for name, value in projection.items():
+            nc.setncattr(name, value)
+        nc.createDimension('time', None)
+        nc.createDimension('y', len(y))
+        nc.createDimension('x', len(x))
+        time_var = nc.createVariable('time', 'f8', ('time',))
+        time_var.units = TIME_UNITS
+        time_var.standard_name = 'time'
+        for name, values in (('x', x), ('y', y)):
+            var = nc.createVariable(name, 'f8', (name,))
+            var.units = 'rad'
+            var[:] = values
+        chunks = (self.chunk_time, min(self.chunk_space, len(y)), min(self.chunk_space, len(x)))
+        bt = nc.createVariable('BT', 'i2', ('time', 'y', 'x'), zlib=True, complevel=self.complevel, shuffle=True,
+                               chunksizes=chunks, fill_value=np.int16(-32768))
+        bt.scale_factor = 0.01
+        bt.add_offset = 0.0
+        bt.units = 'degC'
+        bt.long_name = 'Temperatura de brillo'
+        classes = nc.createVariable('class', 'i1', ('time', 'y', 'x'), zlib=True, complevel=self.complevel, shuffle=True,
+                                    chunksizes=chunks)
+        classes.long_name = 'Clase de tope nuboso (0 sin clase, 1 a 3 de más cálido a más frío)'
+        return nc
+
+    def _Open(self, satellite, path, window, projection, x, y):
+        """
+        Devuelve un cubo abierto, abriéndolo o creándolo si todavía no lo está.
+
+        Returns:
+            Dataset: El archivo abierto en modo escritura.
+        """
+        from netCDF4 import Dataset
+
+        current = self._open.get(path)
+        if current is None:
+            nc = Dataset(path, 'a') if os.path.exists(path) else self._Create(path, window, projection, x, y)
+            current = self._open[path] = (satellite, nc)
+        return current[1]
+
+    def _Get(self, satellite, scan_time, window, projection, x, y):
+        """
+        Devuelve el cubo del día del escaneo para su ventana, cerrando los de otros días del satélite.
+
+        Returns:
+            tuple: Ruta y archivo abierto en modo escritura.
+        """
+        path = ArchivePath(self.directory, satellite, scan_time)
+        for other in [other for other, (sat, _) in self._open.items() if sat == satellite and ArchiveDay(other) != ArchiveDay(path)]:
+            self._open.pop(other)[1].close()
+        nc = self._Open(satellite, path, window, projection, x, y)
+        if list(np.ravel(nc.crop_window)) != list(window):
+            path = ArchivePath(self.directory, satellite, scan_time, window)
+            if path not in self._open:
+                logging.warning(f'La ventana de recorte {list(window)} difiere de la del cubo del día '
+                                f'{list(np.ravel(nc.crop_window))}: los escaneos se archivan en {path}')
+            nc = self._Open(satellite, path, window, projection, x, y)
+        return path, nc
+
+    def Append(self, satellite, scan_time, window, projection, x, y, temperature, classes):
+        """
+        Agrega un escaneo al cubo de su día; si el escaneo ya estaba archivado se reemplaza.
+
+        El eje `time` se mantiene en orden cronológico aunque los escaneos lleguen desordenados (pool
+        de procesos, reprocesamiento): un escaneo anterior a los ya archivados se inserta en su lugar
+        corriendo un lugar a los posteriores.
+
+        Args:
+            satellite (str): Identificador del satélite.
+            scan_time (datetime): Fecha del escaneo.
+            window (list): Índices [min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx] del recorte en el disco completo.
+            projection (dict): Parámetros de `navigation.GetProjectionParameters`.
+            x (ndarray): Ángulos de escaneo de las columnas del recorte, en radianes.
+            y (ndarray): Ángulos de escaneo de las filas del recorte, en radianes.
+            temperature (ndarray): Temperatura de brillo en °C (NaN sin dato).
+            classes (ndarray): Clases (uint8) del recorte.
+
+        Returns:
+            str: Ruta del cubo diario.
+        """
+        seconds = (scan_time - datetime(1970, 1, 1)).total_seconds()
+        with self._lock:
+            path, nc = self._Get(satellite, scan_time, [int(v) for v in window], projection, x, y)
+            times = np.asarray(nc.variables['time'][:])
+            found = np.nonzero(times == seconds)[0]
+            if len(found):
+                index = int(found[0])
+            else:
+                index = int(np.searchsorted(times, seconds))
+                if index < len(times):
+                    self._Shift(nc, index, len(times))
+            nc.variables['time'][index] = seconds
+            missing = np.isnan(temperature)
+            nc.variables['BT'][index] = np.ma.masked_array(np.where(missing, 0.0, temperature), mask=missing)
+            nc.variables['class'][index] = classes.astype(np.int8)
+            nc.sync()
+            return path
+
+    @staticmethod
+    def _Shift(nc, start, end):
+        """
+        Corre un lugar sobre `time` los escaneos [start, end) del cubo, copiando los valores empaquetados.
+
+        Returns:
+            None
+        """
+        for name in ('time', 'BT', 'class'):
+            var = nc.variables[name]
+            mask, scale = var.mask, var.scale
+            var.set_auto_maskandscale(False)
+            try:
+                var[start + 1:end + 1] = var[start:end]
+            finally:
+                var.set_auto_mask(mask)
+                var.set_auto_scale(scale)
+
+    def Close(self):
+        """
+        Cierra los cubos abiertos.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            for _, nc in self._open.values():
+                try:
+                    nc.close()
+                except RuntimeError as e:
+                    logging.warning(f"No se pudo cerrar el archivo histórico: {e}")
+            self._open.clear()
+
+def OpenArchive(directory, satellite, start=None, end=None, window=None):
+    """
+    Abre los cubos diarios de un satélite como un único conjunto de datos.
+
+    Solo se concatenan cubos con la misma ventana de recorte: los de otras ventanas (por un cambio
+    de regiones) se omiten con un aviso.
+
+    Args:
+        directory (str): Directorio del archivo histórico.
+        satellite (str): Identificador del satélite.
+        start (datetime, optional): Primer día a incluir.
+        end (datetime, optional): Último día a incluir.
+        window (list, optional): Ventana de recorte de los cubos a abrir; por defecto la del último cubo del rango.
+
+    Returns:
+        MFDataset: Los cubos concatenados sobre `time`; por ejemplo `ds['BT'][:, 100:200, 300:400]`
+        lee toda la serie de una zona de una sola vez.
+
+    Raises:
+        OSError: Si no hay cubos en el rango.
+    """
+    from netCDF4 import Dataset, MFDataset
+
+    windows = {}
+    for path in sorted(glob.glob(os.path.join(directory, satellite, '*', f'IROL_{satellite}_*.nc'))):
+        day = ArchiveDay(path)
+        if (start is None or day >= start.replace(hour=0, minute=0, second=0, microsecond=0)) and (end is None or day <= end):
+            with Dataset(path) as nc:
+                windows[path] = [int(v) for v in np.ravel(nc.crop_window)]
+    if not windows:
+        raise OSError(f'No hay cubos archivados de {satellite} en el rango pedido')
+    window = [int(v) for v in window] if window is not None else list(windows.values())[-1]
+    paths = [path for path, other in windows.items() if other == window]
+    if len(paths) < len(windows):
+        logging.warning(f'Se omiten {len(windows) - len(paths)} cubos de {satellite} con una ventana distinta de {window}')
+    if not paths:
+        raise OSError(f'No hay cubos archivados de {satellite} con la ventana {window} en el rango pedido')
+    return MFDataset(paths, aggdim='time')
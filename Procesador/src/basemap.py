@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+from src import navigation
+from src.helpers import GetPlotObject, AddColorbar, AddImageFoot, AddLogo, AddTemperatureLegend
+
+_basemaps = {}
+_cache_lock = threading.Lock()
+
+class Basemap:
+    """
+    Capas estáticas del mapa (límites, costas, grilla, barra lateral, pie y logo) pre-renderizadas.
+
+    Las capas se dibujan una única vez sobre un fondo transparente y se guardan como rasters
+    RGBA del tamaño de la figura. Cada imagen nueva solo dibuja la capa de datos en un eje con la
+    misma posición y límites, y compone los rasters encima con `figimage`. El logo y la barra
+    lateral se guardan en un raster aparte porque en el dibujo original quedan por encima del título.
+    """
+
+    def __init__(self, overlay, top, position, xlim, ylim, title_anchor, figsize, dpi):
+        """
+        Args:
+            overlay (ndarray): Raster RGBA (uint8) de las capas estáticas, con el origen arriba.
+            top (ndarray): Raster RGBA (uint8) con el logo y la barra lateral, a componer sobre el título.
+            position (list): Posición [x0, y0, ancho, alto] del eje del mapa, en fracción de la figura.
+            xlim (tuple): Límites en longitud del eje del mapa.
+            ylim (tuple): Límites en latitud del eje del mapa.
+            title_anchor (tuple): Posición del título en fracción de la figura.
+            figsize (tuple): Tamaño de la figura en pulgadas.
+            dpi (float): Resolución de la figura.
+        """
+        self.overlay = overlay
+        self.top = top
+        self.position = position
+        self.xlim = xlim
+        self.ylim = ylim
+        self.title_anchor = title_anchor
+        self.figsize = figsize
+        self.dpi = dpi
+
+    def NewFrame(self):
+        """
+        Crea una figura lista para dibujar la capa de datos debajo de las capas estáticas.
+
+        Returns:
+            tuple: La figura y el eje del mapa (PlateCarree).
+        """
+        import cartopy.crs as ccrs
+        import matplotlib.pyplot as plt
+
+        fig = plt.figure(figsize=self.figsize, dpi=self.dpi)
+        ax = fig.add_axes(self.position, projection=ccrs.PlateCarree())
+        ax.set_xlim(self.xlim)
+        ax.set_ylim(self.ylim)
+        ax.set_aspect('auto')
+        ax.spines['geo'].set_visible(False)
+        fig.figimage(self.overlay, xo=0, yo=0, origin='upper', zorder=1)
+        fig.figimage(self.top, xo=0, yo=0, origin='upper', zorder=3)
+        return fig, ax
+
+    def AddTitle(self, fig, title, size=8.0):
+        """
+        Escribe el título sobre el pie de imagen pre-renderizado.
+
+        Args:
+            fig (Figure): Figura creada con `NewFrame`.
+            title (str): Título de la imagen.
+            size (float, optional): Tamaño del texto.
+
+        Returns:
+            None
+        """
+        fig.text(self.title_anchor[0], self.title_anchor[1], title, horizontalalignment='left',
+                 color='black', size=size, zorder=2)
+
+def _BasemapKey(confData, extent):
+    """
+    Arma la clave del caché a partir del extent, el tamaño de la figura y el estilo de las líneas.
+
+    Args:
+        confData (dict): Diccionario de configuración.
+        extent (list): Extensión del mapa.
+
+    Returns:
+        str: Clave del caché.
+    """
+    params = [list(map(float, extent)), confData['figure_length_inches'], confData['figure_high_inches'],
+              confData['figure_resolution_dpi'], confData['line_width_inches_for_coast'],
+              confData['line_width_inches_for_nation_limits'], confData['line_width_inches_for_province_limits']]
+    return hashlib.sha1(json.dumps(params).encode()).hexdigest()[:16]
+
+def RenderBasemap(confData, extent):
+    """
+    Dibuja las capas estáticas del mapa sobre un fondo transparente.
+
+    Args:
+        confData (dict): Diccionario de configuración.
+        extent (list): Extensión del mapa.
+
+    Returns:
+        Basemap: Las capas estáticas pre-renderizadas.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.transforms import Bbox
+
+    figsize = (confData['figure_length_inches'], confData['figure_high_inches'])
+    dpi = confData['figure_resolution_dpi']
+    fig = plt.figure(figsize=figsize, dpi=dpi)
+    try:
+        ax = GetPlotObject(confData, extent)
+        cbar = AddColorbar(fig, ax)
+        AddTemperatureLegend(ax)
+        text = AddImageFoot(ax, '', size=8.0)
+        logo_img = AddLogo(ax)
+
+        fig.patch.set_alpha(0.0)
+        ax.patch.set_alpha(0.0)
+        fig.canvas.draw()
+        full = np.array(fig.canvas.buffer_rgba())
+
+        # El logo y la barra lateral se separan en su propio raster con los rectángulos que ocupan
+        bboxes = [Bbox.intersection(logo_img.get_window_extent(), ax.bbox),
+                  cbar.ax.get_tightbbox(fig.canvas.get_renderer())]
+        logo_img.set_visible(False)
+        cbar.ax.set_visible(False)
+        fig.canvas.draw()
+        overlay = np.array(fig.canvas.buffer_rgba())
+        top = np.zeros_like(full)
+        height = full.shape[0]
+        for bbox in bboxes:
+            if bbox is None:
+                continue
+            rows = slice(max(int(np.floor(height - bbox.y1)), 0), int(np.ceil(height - bbox.y0)))
+            cols = slice(max(int(np.floor(bbox.x0)), 0), int(np.ceil(bbox.x1)))
+            top[rows, cols] = full[rows, cols]
+
+        pos = ax.get_position()
+        title_anchor = fig.transFigure.inverted().transform(ax.transData.transform(text.get_position()))
+        return Basemap(overlay, top, [pos.x0, pos.y0, pos.width, pos.height], ax.get_xlim(), ax.get_ylim(),
+                       tuple(float(v) for v in title_anchor), figsize, dpi)
+    finally:
+        plt.close(fig)
+
+def GetBasemap(confData, extent):
+    """
+    Devuelve las capas estáticas para un (extent, tamaño de figura, dpi), memorizadas en memoria y en disco.
+
+    Args:
+        confData (dict): Diccionario de configuración.
+        extent (list): Extensión del mapa.
+
+    Returns:
+        Basemap: Las capas estáticas pre-renderizadas.
+    """
+    key = _BasemapKey(confData, extent)
+    basemap = _basemaps.get(key)
+    if basemap is not None:
+        return basemap
+
+    # Pillow se importa al usarlo: importar el procesador no lo carga
+    from PIL import Image
+
+    with _cache_lock:
+        png_file = os.path.join(navigation.CACHE_DIR, 'basemap_%s.png' % key)
+        top_file = os.path.join(navigation.CACHE_DIR, 'basemap_%s_top.png' % key)
+        meta_file = os.path.join(navigation.CACHE_DIR, 'basemap_%s.json' % key)
+        if os.path.exists(png_file) and os.path.exists(top_file) and os.path.exists(meta_file):
+            with open(meta_file, 'r') as f:
+                meta = json.load(f)
+            basemap = Basemap(np.asarray(Image.open(png_file).convert('RGBA')),
+                              np.asarray(Image.open(top_file).convert('RGBA')), meta['position'],
+                              tuple(meta['xlim']), tuple(meta['ylim']), tuple(meta['title_anchor']),
+                              tuple(meta['figsize']), meta['dpi'])
+        else:
+            basemap = RenderBasemap(confData, extent)
+            try:
+                os.makedirs(navigation.CACHE_DIR, exist_ok=True)
+                Image.fromarray(basemap.overlay, 'RGBA').save(png_file)
+                Image.fromarray(basemap.top, 'RGBA').save(top_file)
+                with open(meta_file, 'w') as f:
+                    json.dump({'position': basemap.position, 'xlim': list(basemap.xlim), 'ylim': list(basemap.ylim),
+                               'title_anchor': list(basemap.title_anchor), 'figsize': list(basemap.figsize),
+                               'dpi': basemap.dpi}, f)
+            except OSError:
+                pass
+        _basemaps[key] = basemap
+    return basemap
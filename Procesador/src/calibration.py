@@ -0,0 +1,256 @@
+import logging
+import threading
+import numpy as np
+from src.helpers import ReadRawWindow, OpenChunkReader, ScaleCounts, GetCalibratedImage
+
+# Memoria de trabajo estimada por píxel de un bloque, en bytes: con tablas (conteos, índices intp del
+# gather y resultados) y con la calibración completa (radiancias, temperaturas enmascaradas y temporales)
+BYTES_PER_PIXEL = {'lut': 16, 'calibrated': 48}
+
+_luts = {}
+_cache_lock = threading.Lock()
+
+def _Attr(variable, name, default):
+    """
+    Lee un atributo escalar de una variable NetCDF, con valor por defecto.
+
+    Args:
+        variable (Variable): Variable NetCDF.
+        name (str): Nombre del atributo.
+        default (float): Valor si el atributo no existe.
+
+    Returns:
+        float: Valor del atributo.
+    """
+    if name in variable.ncattrs():
+        return float(np.ravel(variable.getncattr(name))[0])
+    return default
+
+def _IsUnsigned(variable):
+    """
+    Indica si una variable entera empaquetada debe interpretarse sin signo (convención `_Unsigned`).
+
+    Args:
+        variable (Variable): Variable NetCDF.
+
+    Returns:
+        bool: True si los conteos se guardan sin signo.
+    """
+    return variable.dtype.kind == 'u' or str(getattr(variable, '_Unsigned', 'false')).lower() == 'true'
+
+def GetCalibrationKey(netCDFread, thresholds):
+    """
+    Arma la clave de caché de las tablas: banda, empaquetado de `Rad`, coeficientes de Planck y umbrales.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+        thresholds (tuple): Umbrales (thr_1, thr_2, thr_3, thr_min) en °C.
+
+    Returns:
+        tuple: Clave del caché.
+    """
+    metaCDF = netCDFread.variables
+    rad = metaCDF['Rad']
+    coefs = tuple(float(np.ravel(metaCDF[name][:])[0]) for name in ['planck_fk1', 'planck_fk2', 'planck_bc1', 'planck_bc2'])
+    return (int(metaCDF['band_id'][:]), _Attr(rad, 'scale_factor', 1.0), _Attr(rad, 'add_offset', 0.0),
+            _Attr(rad, '_FillValue', np.nan), _IsUnsigned(rad)) + coefs + tuple(float(t) for t in thresholds)
+
+def BuildTemperatureLUT(netCDFread):
+    """
+    Calcula la temperatura de brillo para cada conteo posible de 16 bits de `Rad`.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído (banda emisiva, 7 o superior).
+
+    Returns:
+        ndarray: Tabla de 65536 temperaturas de brillo en °C (float64), NaN para el valor de relleno
+        y las radiancias no positivas.
+    """
+    metaCDF = netCDFread.variables
+    rad = metaCDF['Rad']
+    fk1, fk2, bc1, bc2 = (float(np.ravel(metaCDF[name][:])[0]) for name in ['planck_fk1', 'planck_fk2', 'planck_bc1', 'planck_bc2'])
+
+    counts = np.arange(65536, dtype=np.float64)
+    if not _IsUnsigned(rad):
+        counts = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.float64)
+    radiance = counts * _Attr(rad, 'scale_factor', 1.0) + _Attr(rad, 'add_offset', 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        temperature = (fk2 / np.log(fk1 / radiance + 1) - bc1) / bc2 - 273.15
+    temperature[radiance <= 0] = np.nan
+    fill = _Attr(rad, '_FillValue', np.nan)
+    if not np.isnan(fill):
+        temperature[np.array([fill]).astype(np.int64).astype(np.uint16)] = np.nan
+    return temperature
+
+def BuildClassLUT(temperature, thresholds):
+    """
+    Clasifica la tabla de temperaturas en las clases de topes nubosos.
+
+    Args:
+        temperature (ndarray): Tabla devuelta por `BuildTemperatureLUT`.
+        thresholds (tuple): Umbrales (thr_1, thr_2, thr_3, thr_min) en °C.
+
+    Returns:
+        ndarray: Tabla de clases (uint8): 0 sin clase, 1 entre thr_1 y thr_2, 2 entre thr_2 y thr_3
+        y 3 entre thr_3 y thr_min.
+    """
+    thr_1, thr_2, thr_3, thr_min = thresholds
+    classes = np.zeros(temperature.shape, dtype=np.uint8)
+    with np.errstate(invalid='ignore'):
+        classes[(temperature < thr_1) & (temperature >= thr_2)] = 1
+        classes[(temperature < thr_2) & (temperature >= thr_3)] = 2
+        classes[(temperature < thr_3) & (temperature >= thr_min)] = 3
+    return classes
+
+def GetLUTs(netCDFread, thresholds):
+    """
+    Devuelve las tablas conteo -> temperatura de brillo y conteo -> clase, memorizadas en memoria.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+        thresholds (tuple): Umbrales (thr_1, thr_2, thr_3, thr_min) en °C.
+
+    Returns:
+        tuple: Tabla de temperaturas (float32) y tabla de clases (uint8).
+    """
+    key = GetCalibrationKey(netCDFread, thresholds)
+    luts = _luts.get(key)
+    if luts is None:
+        with _cache_lock:
+            # Otro hilo pudo calcularlas mientras se esperaba el lock
+            luts = _luts.get(key)
+            if luts is None:
+                temperature = BuildTemperatureLUT(netCDFread)
+                # Las clases se calculan en float64, igual que la calibración original
+                luts = (temperature.astype(np.float32), BuildClassLUT(temperature, thresholds))
+                _luts[key] = luts
+    return luts
+
+def ReadCounts(netCDFread, img_indexes, engine='netcdf4', threads=4):
+    """
+    Lee los conteos crudos de `Rad` del recorte, sin escalar ni enmascarar.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+        img_indexes (list): Índices [min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx] del recorte.
+        engine (str, optional): Motor de lectura de `helpers.ReadRawWindow` ('netcdf4' o 'h5py').
+        threads (int, optional): Hilos de descompresión del motor 'h5py'.
+
+    Returns:
+        ndarray: Conteos (uint16) del recorte, aptos para indexar las tablas de `GetLUTs`. Es una vista
+        del buffer alineado a los chunks.
+    """
+    counts = ReadRawWindow(netCDFread, img_indexes, 'Rad', engine=engine, threads=threads)
+    return counts.view(np.uint16)
+
+def ClassifyCounts(netCDFread, img_indexes, thresholds, engine='netcdf4', threads=4):
+    """
+    Calibra y clasifica el recorte con un único gather sobre la tabla de clases.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+        img_indexes (list): Índices [min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx] del recorte.
+        thresholds (tuple): Umbrales (thr_1, thr_2, thr_3, thr_min) en °C.
+        engine (str, optional): Motor de lectura ('netcdf4' o 'h5py').
+        threads (int, optional): Hilos de descompresión del motor 'h5py'.
+
+    Returns:
+        ndarray: Clases (uint8) del recorte.
+    """
+    _, class_lut = GetLUTs(netCDFread, thresholds)
+    return class_lut[ReadCounts(netCDFread, img_indexes, engine, threads)]
+
+def GetBlockRows(netCDFread, img_indexes, bytes_per_pixel, memory_budget_mb=None):
+    """
+    Calcula cuántas filas del recorte se procesan por bloque para no superar un presupuesto de memoria.
+
+    Los bloques se alinean a las filas de los chunks de `Rad`, para que ningún chunk se descomprima
+    en dos bloques.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+        img_indexes (list): Índices [min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx] del recorte.
+        bytes_per_pixel (int): Memoria de trabajo por píxel (ver `BYTES_PER_PIXEL`).
+        memory_budget_mb (float, optional): Presupuesto de memoria de trabajo en MB; None procesa el recorte en un único bloque.
+
+    Returns:
+        int: Filas por bloque (al menos las de un chunk).
+    """
+    rows = img_indexes[3] - img_indexes[2]
+    if not memory_budget_mb:
+        return max(rows, 1)
+    rad = netCDFread.variables['Rad']
+    chunking = rad.chunking()
+    chunk_rows, chunk_cols = (1, 1) if chunking == 'contiguous' else chunking
+    # El buffer de lectura abarca las columnas completas de los chunks del recorte
+    cols = -(-img_indexes[1] // chunk_cols) * chunk_cols - img_indexes[0] // chunk_cols * chunk_cols
+    block = int(memory_budget_mb * 2 ** 20 // (max(cols, 1) * bytes_per_pixel))
+    return min(max(block // chunk_rows * chunk_rows, chunk_rows), max(rows, 1))
+
+def ClassifyWindow(netCDFread, img_indexes, thresholds, use_lut=True, with_temperature=False, engine='netcdf4',
+                   threads=4, memory_budget_mb=None):
+    """
+    Calibra y clasifica un recorte por bloques de filas, escribiendo en arreglos preasignados.
+
+    Cada bloque se lee (conteos crudos), calibra y clasifica antes de pasar al siguiente. El
+    presupuesto `memory_budget_mb` incluye los resultados, que ocupan todo el recorte (1 byte por
+    píxel para las clases y 4 para la temperatura, si se pide): los bloques usan lo que queda, y si
+    los resultados solos lo superan se procesa de a un chunk de filas. Con `use_lut` se usan las tablas de
+    `GetLUTs`; si no, la calibración de `helpers.GetCalibratedImage` sobre radiancias en float32.
+    Con el motor 'h5py' el archivo se abre una única vez para todos los bloques.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+        img_indexes (list): Índices [min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx] del recorte.
+        thresholds (tuple): Umbrales (thr_1, thr_2, thr_3, thr_min) en °C.
+        use_lut (bool, optional): Si es True se calibra con las tablas precalculadas (bandas emisivas).
+        with_temperature (bool, optional): Si es True se devuelve también la temperatura de brillo.
+        engine (str, optional): Motor de lectura ('netcdf4' o 'h5py').
+        threads (int, optional): Hilos de descompresión del motor 'h5py'.
+        memory_budget_mb (float, optional): Presupuesto de memoria en MB, resultados incluidos; None procesa el recorte en un único bloque.
+
+    Returns:
+        tuple: Clases (uint8) y temperatura de brillo en °C (float32, NaN sin dato) o None.
+    """
+    col0, col1, row0, row1 = img_indexes
+    classes = np.empty((row1 - row0, col1 - col0), dtype=np.uint8)
+    temperature = np.empty(classes.shape, dtype=np.float32) if with_temperature else None
+    if use_lut:
+        temperature_lut, class_lut = GetLUTs(netCDFread, thresholds)
+    working_mb = memory_budget_mb
+    if memory_budget_mb:
+        results_mb = (classes.nbytes + (temperature.nbytes if with_temperature else 0)) / 2 ** 20
+        working_mb = memory_budget_mb - results_mb
+        if working_mb <= 0:
+            logging.warning(f'Los resultados del recorte ocupan {results_mb:.1f} MB, más que memory_budget_mb '
+                            f'({memory_budget_mb} MB): se procesa de a un chunk de filas')
+            working_mb = 2 ** -20  # Un byte: GetBlockRows devuelve un único chunk de filas
+    block = GetBlockRows(netCDFread, img_indexes, BYTES_PER_PIXEL['lut' if use_lut else 'calibrated'], working_mb)
+
+    # Sin archivo en disco (Dataset en memoria) se lee con netCDF4
+    h5 = OpenChunkReader(netCDFread) if engine == 'h5py' else None
+    try:
+        # Los bloques terminan en múltiplos de `block` (que lo es de las filas de un chunk): los cortes caen en bordes de chunk
+        start = row0
+        while start < row1:
+            end = min((start // block + 1) * block, row1) if memory_budget_mb else row1
+            out = slice(start - row0, end - row0)
+            counts = ReadRawWindow(netCDFread, [col0, col1, start, end], 'Rad', threads=threads, h5=h5)
+            if use_lut:
+                counts = counts.view(np.uint16)
+                classes[out] = class_lut[counts]
+                if with_temperature:
+                    temperature[out] = temperature_lut[counts]
+            else:
+                image_cal, _ = GetCalibratedImage(netCDFread, ScaleCounts(netCDFread.variables['Rad'], counts))
+                image_cal = np.ma.filled(np.ma.asarray(image_cal, dtype=np.float32), np.nan)
+                # Misma clasificación que la de las tablas; sin clase (NaN) queda en 0
+                classes[out] = BuildClassLUT(image_cal, thresholds)
+                if with_temperature:
+                    temperature[out] = image_cal
+            del counts
+            start = end
+    finally:
+        if h5 is not None:
+            h5.close()
+    return classes, temperature
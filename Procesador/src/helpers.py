@@ -1,21 +1,41 @@
 import numpy as np
 import colorsys
 import json
+import logging
 import os
-from netCDF4 import Dataset
-import cartopy.crs as ccrs
-import matplotlib.pyplot as plt
-import cartopy.io.shapereader as shpreader
-from matplotlib.patches import Rectangle
-from PIL import Image
-import cartopy
+from src import navigation
 
-Image.MAX_IMAGE_PIXELS = 1000000000
+# matplotlib, cartopy y PIL se importan dentro de las funciones de dibujo: el motor 'numpy' y las
+# funciones de lectura no los necesitan, y así importar este módulo es rápido y sin efectos
 
 def GetCroppedImage(netCDFread, min_lon, max_lon, min_lat, max_lat):
     """
     Obtiene una imagen recortada de los datos NetCDF en las coordenadas especificadas.
 
+    La ventana se calcula de forma analítica a partir de `goes_imager_projection` y queda
+    memorizada por satélite, resolución y extent (ver `navigation.GetCropWindow`). Si el archivo
+    no trae los parámetros de proyección, se usan las grillas de referencia de 8 km.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+        min_lon (float): Longitud mínima.
+        max_lon (float): Longitud máxima.
+        min_lat (float): Latitud mínima.
+        max_lat (float): Latitud máxima.
+
+    Returns:
+        tuple: Extensión de la imagen y los índices de las coordenadas recortadas.
+    """
+    if navigation.HasProjectionParameters(netCDFread):
+        return navigation.GetCropWindow(netCDFread, min_lon, max_lon, min_lat, max_lat)
+    logging.warning('El archivo no trae los parámetros de goes_imager_projection: se recorta con las grillas de referencia de 8 km')
+    return GetCroppedImageFromGrid(netCDFread, min_lon, max_lon, min_lat, max_lat)
+
+def GetCroppedImageFromGrid(netCDFread, min_lon, max_lon, min_lat, max_lat):
+    """
+    Obtiene el recorte buscando el extent en las grillas de referencia de latitud y longitud de 8 km
+    de la posición orbital del satélite.
+
     Args:
         netCDFread (Dataset): Objeto NetCDF leído.
         min_lon (float): Longitud mínima.
@@ -27,10 +47,10 @@ def GetCroppedImage(netCDFread, min_lon, max_lon, min_lat, max_lat):
         tuple: Extensión de la imagen y los índices de las coordenadas recortadas.
     """
     band_resolution_km = float(getattr(netCDFread, 'spatial_resolution').split("km")[0])
-    filepath = os.path.abspath(__file__).split('/src')[0] + '/data/grids/'
 
-    lons = np.loadtxt(filepath + 'g16_lons_8km.txt')
-    lats = np.loadtxt(filepath + 'g16_lats_8km.txt')
+    grid = navigation.GetSatellite(netCDFread)['grid']
+    lons = navigation.LoadReferenceGrid(grid + '_lons_8km')
+    lats = navigation.LoadReferenceGrid(grid + '_lats_8km')
     ref_grid_resolution_km = 8
 
     half = int(np.shape(lons)[0] / 2)
@@ -45,6 +65,17 @@ def GetCroppedImage(netCDFread, min_lon, max_lon, min_lat, max_lat):
     max_lat_idx *= frac
     max_lon_idx *= frac
 
+    # Archivos recortados en la descarga: los índices se expresan respecto del recorte
+    if 'crop_offset_x' in netCDFread.ncattrs():
+        offset_x = int(netCDFread.getncattr('crop_offset_x'))
+        offset_y = int(netCDFread.getncattr('crop_offset_y'))
+        size_x = len(netCDFread.dimensions['x'])
+        size_y = len(netCDFread.dimensions['y'])
+        min_lon_idx = min(max(min_lon_idx - offset_x, 0), size_x)
+        max_lon_idx = min(max(max_lon_idx - offset_x, 0), size_x)
+        min_lat_idx = min(max(min_lat_idx - offset_y, 0), size_y)
+        max_lat_idx = min(max(max_lat_idx - offset_y, 0), size_y)
+
     sat_h = netCDFread.variables['goes_imager_projection'].perspective_point_height
     x = netCDFread.variables['x'][min_lon_idx:max_lon_idx] * sat_h
     y = netCDFread.variables['y'][min_lat_idx:max_lat_idx] * sat_h
@@ -54,6 +85,192 @@ def GetCroppedImage(netCDFread, min_lon, max_lon, min_lat, max_lat):
 
     return img_extent, img_indexes
 
+def GetChunkAlignedWindow(img_indexes, chunks, shape):
+    """
+    Expande una ventana de recorte a los bordes de los chunks HDF5 de la variable.
+
+    Args:
+        img_indexes (list): Índices [min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx] del recorte.
+        chunks (tuple): Tamaño (filas, columnas) de los chunks, o None si la variable es contigua.
+        shape (tuple): Forma (filas, columnas) de la variable.
+
+    Returns:
+        list: Índices [min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx] alineados a los chunks.
+    """
+    if not chunks:
+        return list(img_indexes)
+    rows, cols = chunks
+    return [img_indexes[0] // cols * cols, min(-(-img_indexes[1] // cols) * cols, shape[1]),
+            img_indexes[2] // rows * rows, min(-(-img_indexes[3] // rows) * rows, shape[0])]
+
+def _ChunkDecoder(dataset):
+    """
+    Arma el decodificador de los chunks de un dataset HDF5 comprimido con deflate y, opcionalmente, shuffle.
+
+    Args:
+        dataset (h5py.Dataset): Variable abierta con h5py.
+
+    Returns:
+        callable: Función `decode(filter_mask, raw)` que devuelve los bytes del chunk, o None si la
+        variable usa filtros que no se decodifican aquí (en ese caso se lee con h5py).
+    """
+    import h5py
+    import zlib
+
+    plist = dataset.id.get_create_plist()
+    filters = [plist.get_filter(i)[0] for i in range(plist.get_nfilters())]
+    if any(code not in (h5py.h5z.FILTER_DEFLATE, h5py.h5z.FILTER_SHUFFLE) for code in filters):
+        return None
+    itemsize = dataset.dtype.itemsize
+
+    def decode(filter_mask, raw):
+        # Los filtros se aplican en orden al escribir: se deshacen en orden inverso, salteando los omitidos
+        for i in reversed(range(len(filters))):
+            if filter_mask & (1 << i):
+                continue
+            if filters[i] == h5py.h5z.FILTER_DEFLATE:
+                raw = zlib.decompress(raw)
+            elif itemsize > 1:
+                raw = np.frombuffer(raw, dtype=np.uint8).reshape(itemsize, -1).T.tobytes()
+        return raw
+    return decode
+
+def OpenChunkReader(netCDFread):
+    """
+    Abre con h5py el archivo de un Dataset, para leer sus chunks directamente con `ReadRawWindow`.
+
+    Los Dataset abiertos desde un buffer (`memory=`, modo en memoria del descargador) no tienen un
+    archivo en disco que h5py pueda abrir: en ese caso se devuelve None y se lee con netCDF4.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+
+    Returns:
+        h5py.File: El archivo abierto en modo lectura, que cierra el llamador, o None.
+    """
+    try:
+        path = netCDFread.filepath()
+    except ValueError:
+        return None
+    if not os.path.isfile(path):
+        return None
+    import h5py
+    return h5py.File(path, 'r')
+
+def _ReadDirectChunks(h5, name, window, threads=4):
+    """
+    Lee una ventana alineada a los chunks leyendo los chunks comprimidos directamente del archivo
+    y descomprimiéndolos en varios hilos (zlib libera el GIL) dentro de un buffer preasignado.
+
+    Args:
+        h5 (h5py.File): Archivo abierto con `OpenChunkReader`.
+        name (str): Nombre de la variable.
+        window (list): Índices [min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx] alineados a los chunks.
+        threads (int, optional): Cantidad de hilos de descompresión.
+
+    Returns:
+        ndarray: Valores crudos de la ventana, con el tipo entero de la variable.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    col0, col1, row0, row1 = window
+    dataset = h5[name]
+    dtype = dataset.dtype.newbyteorder('=')
+    buffer = np.empty((row1 - row0, col1 - col0), dtype=dtype)
+    decode = _ChunkDecoder(dataset) if dataset.chunks else None
+    if decode is None:
+        dataset.read_direct(buffer, np.s_[row0:row1, col0:col1])
+        return buffer
+    rows, cols = dataset.chunks
+    fill = dataset.fillvalue
+
+    def read_chunk(offset):
+        r, c = offset
+        try:
+            filter_mask, raw = dataset.id.read_direct_chunk(offset)
+        except (KeyError, OSError, ValueError):
+            # Chunk nunca escrito: vale el valor de relleno
+            buffer[r - row0:r - row0 + rows, c - col0:c - col0 + cols] = fill
+            return
+        chunk = np.frombuffer(decode(filter_mask, raw), dtype=dataset.dtype).reshape(rows, cols)
+        height, width = min(rows, row1 - r), min(cols, col1 - c)
+        buffer[r - row0:r - row0 + height, c - col0:c - col0 + width] = chunk[:height, :width]
+
+    offsets = [(r, c) for r in range(row0, row1, rows) for c in range(col0, col1, cols)]
+    with ThreadPoolExecutor(max_workers=max(int(threads), 1)) as executor:
+        list(executor.map(read_chunk, offsets))
+    return buffer
+
+def ReadRawWindow(netCDFread, img_indexes, name='Rad', engine='netcdf4', threads=4, h5=None):
+    """
+    Lee los valores crudos (enteros, sin escalar ni enmascarar) de una ventana de una variable 2D.
+
+    La ventana se expande a los bordes de los chunks de la variable y se lee completa, de modo que
+    cada chunk se descomprime una única vez y ninguno se descarta a medias; el recorte pedido se
+    devuelve como una vista de ese buffer. Con `engine='h5py'` los chunks comprimidos se leen
+    directamente del archivo y se descomprimen en `threads` hilos; si el Dataset no tiene un archivo
+    en disco (ver `OpenChunkReader`) se lee con netCDF4, y si la variable usa otros filtros, con h5py.
+    Quien lee varias ventanas del mismo archivo puede pasar el archivo ya abierto en `h5`.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+        img_indexes (list): Índices [min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx] del recorte.
+        name (str, optional): Nombre de la variable.
+        engine (str, optional): 'netcdf4' o 'h5py'.
+        threads (int, optional): Hilos de descompresión del motor 'h5py'.
+        h5 (h5py.File, optional): Archivo abierto con `OpenChunkReader`; si se indica se usa el motor 'h5py'.
+
+    Returns:
+        ndarray: Valores crudos del recorte (vista del buffer alineado), con el tipo entero de la variable.
+    """
+    if h5 is None and engine == 'h5py':
+        h5 = OpenChunkReader(netCDFread)
+        if h5 is not None:
+            with h5:
+                return ReadRawWindow(netCDFread, img_indexes, name, engine, threads, h5)
+    variable = netCDFread.variables[name]
+    chunking = variable.chunking()
+    window = GetChunkAlignedWindow(img_indexes, None if chunking == 'contiguous' else chunking, variable.shape)
+    if h5 is not None:
+        buffer = _ReadDirectChunks(h5, name, window, threads)
+    else:
+        # Se restaura el estado previo de la variable: el Dataset es del llamador
+        mask, scale = variable.mask, variable.scale
+        variable.set_auto_maskandscale(False)
+        try:
+            buffer = np.asarray(variable[window[2]:window[3], window[0]:window[1]])
+        finally:
+            variable.set_auto_mask(mask)
+            variable.set_auto_scale(scale)
+    return buffer[img_indexes[2] - window[2]:img_indexes[3] - window[2], img_indexes[0] - window[0]:img_indexes[1] - window[0]]
+
+def ScaleCounts(variable, counts):
+    """
+    Convierte valores crudos a valores físicos en float32, con NaN en el valor de relleno.
+
+    Reemplaza la lectura con `set_auto_maskandscale`, que produce un arreglo enmascarado en float64.
+    La escala y el desplazamiento se aplican solo si la variable los define.
+
+    Args:
+        variable (Variable): Variable NetCDF de la que provienen los valores.
+        counts (ndarray): Valores crudos devueltos por `ReadRawWindow`.
+
+    Returns:
+        ndarray: Valores físicos (float32).
+    """
+    attrs = variable.ncattrs()
+    if counts.dtype.kind == 'i' and str(getattr(variable, '_Unsigned', 'false')).lower() == 'true':
+        counts = counts.view(counts.dtype.str.replace('i', 'u'))
+    values = counts.astype(np.float32)
+    if 'scale_factor' in attrs:
+        values *= np.float32(np.ravel(variable.getncattr('scale_factor'))[0])
+    if 'add_offset' in attrs:
+        values += np.float32(np.ravel(variable.getncattr('add_offset'))[0])
+    if '_FillValue' in attrs:
+        fill = np.array(np.ravel(variable.getncattr('_FillValue'))[0]).astype(counts.dtype)
+        values[counts == fill] = np.nan
+    return values
+
 def GetPlotObject(confData, extent):
     """
     Crea un objeto de trama configurado con los parámetros especificados.
@@ -65,6 +282,11 @@ def GetPlotObject(confData, extent):
     Returns:
         Axes: Objeto de ejes configurado.
     """
+    import cartopy
+    import cartopy.crs as ccrs
+    import cartopy.io.shapereader as shpreader
+    import matplotlib.pyplot as plt
+
     shapesdir = os.path.dirname(os.path.abspath(__file__)).split('/src')[0] + '/data/shp'
     ax = plt.axes(projection=ccrs.PlateCarree())
 
@@ -137,6 +359,33 @@ def GetCalibratedImage(netCDFread, image):
         unit = 'Reflectancia'
     return image_cal, unit
 
+def AddColorbar(fig, ax):
+    """
+    Añade la barra lateral de temperaturas con título y etiquetas personalizadas.
+
+    Args:
+        fig (Figure): Figura de matplotlib.
+        ax (Axes): Objeto de ejes del mapa.
+
+    Returns:
+        Colorbar: La barra lateral creada.
+    """
+    import matplotlib.colors
+    import matplotlib.pyplot as plt
+
+    # Define los colores y los límites de la barra lateral
+    colors = ["red", "orange", "yellow"]
+    bounds = [-90 , -73, -63, -53]
+    norm = matplotlib.colors.BoundaryNorm(bounds, len(colors))
+
+    sm = plt.cm.ScalarMappable(cmap=matplotlib.colors.ListedColormap(colors), norm=norm)
+    sm.set_array([])
+    cbar = fig.colorbar(sm, boundaries=bounds, ticks=bounds, ax=ax)
+    cbar.ax.set_title('T°C', fontsize=8)
+    cbar.ax.tick_params(labelsize=6)
+    cbar.ax.set_yticklabels([f'{int(tick)}°C' for tick in bounds], fontsize=6)
+    return cbar
+
 def AddImageFoot(ax, title, institution=None, size=8.0):
     """
     Añade el pie de imagen con el título y la institución opcional.
@@ -148,16 +397,19 @@ def AddImageFoot(ax, title, institution=None, size=8.0):
         size (float, optional): Tamaño del texto.
 
     Returns:
-        None
+        Text: El texto del título, para poder ubicarlo desde el caché del mapa base.
     """
+    from matplotlib.patches import Rectangle
+
     xlim = ax.get_xlim()
     ylim = ax.get_ylim()
     width = abs(xlim[0]) + abs(xlim[1])
     height = 0.035 * (abs(ylim[0]) + abs(ylim[1]))
     ax.add_patch(Rectangle((xlim[0], ylim[1]-height), width, height, alpha=1, zorder=3, facecolor='white'))
-    ax.text(xlim[0], ylim[1]-height/1.5, title, horizontalalignment='left', color='black', size=size)
+    text = ax.text(xlim[0], ylim[1]-height/1.5, title, horizontalalignment='left', color='black', size=size)
     if institution:
         ax.text(xlim[1] - 0.05 * xlim[1], ylim[1] - height / 1.5, institution, horizontalalignment='right', color='black', size=size)
+    return text
 
 def AddTemperatureLegend(ax):
     """
@@ -180,9 +432,13 @@ def AddLogo(ax):
         ax (Axes): Objeto de ejes.
 
     Returns:
-        None
+        AxesImage: La imagen del logo agregada a los ejes.
     """
-    logo_path = 'Procesador/data/logo/logo.png'  
+    import matplotlib.pyplot as plt
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = 1000000000
+    logo_path = os.path.abspath(__file__).split('/src')[0] + '/data/logo/logo.png'
     logo_img = plt.imread(logo_path)
     xlim = ax.get_xlim()
     ylim = ax.get_ylim()
@@ -190,7 +446,7 @@ def AddLogo(ax):
     logo_height = logo_width * logo_img.shape[0] / logo_img.shape[1]
     logo_x = xlim[1] - 0.01 * (xlim[1] - xlim[0]) - logo_width
     logo_y = ylim[1] - 0.001 * (ylim[1] - ylim[0]) - logo_height - 0.01 * (ylim[1] - ylim[0])
-    ax.imshow(logo_img, extent=(logo_x, logo_x + logo_width, logo_y, logo_y + logo_height), aspect='auto', zorder=10)
+    return ax.imshow(logo_img, extent=(logo_x, logo_x + logo_width, logo_y, logo_y + logo_height), aspect='auto', zorder=10)
 
 
 
@@ -0,0 +1,297 @@
+import json
+import os
+import threading
+import numpy as np
+
+# Directorio del caché en disco de ventanas de recorte y grillas de referencia
+CACHE_DIR = os.path.abspath(__file__).split('/src')[0] + '/data/cache/'
+GRIDS_DIR = os.path.abspath(__file__).split('/src')[0] + '/data/grids/'
+
+_window_cache = {}
+_disk_cache = None
+_reference_grids = {}
+_cache_lock = threading.Lock()
+
+# Satélites GOES-R: nombre, etiqueta de los productos, grillas de referencia de 8 km (una por posición orbital)
+# y bucket S3 del programa Open Data de NOAA. G16 y G19 operan como GOES-Este, G17 y G18 como GOES-Oeste.
+# El descargador usa esta misma tabla (`descarga/helpers.py`)
+SATELLITES = {'G16': {'name': 'GOES-16', 'label': 'GOES16', 'grid': 'g16', 'bucket': 'noaa-goes16'},
+              'G17': {'name': 'GOES-17', 'label': 'GOES17', 'grid': 'g17', 'bucket': 'noaa-goes17'},
+              'G18': {'name': 'GOES-18', 'label': 'GOES18', 'grid': 'g17', 'bucket': 'noaa-goes18'},
+              'G19': {'name': 'GOES-19', 'label': 'GOES19', 'grid': 'g16', 'bucket': 'noaa-goes19'}}
+
+# Parámetros de `goes_imager_projection` que necesita la navegación analítica
+PROJECTION_PARAMETERS = ['semi_major_axis', 'semi_minor_axis', 'perspective_point_height', 'longitude_of_projection_origin']
+
+def GetSatellite(netCDFread):
+    """
+    Identifica el satélite de un archivo a partir del atributo global `platform_ID`.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+
+    Returns:
+        dict: Identificador ('G16', 'G19', ...), nombre, etiqueta de los productos y prefijo de las grillas
+        de referencia. Un satélite no listado en `SATELLITES` usa su propio identificador en la etiqueta y
+        en las grillas.
+    """
+    platform = str(getattr(netCDFread, 'platform_ID', 'G16'))
+    satellite = SATELLITES.get(platform)
+    if satellite is None:
+        satellite = {'name': 'GOES-' + platform[1:], 'label': 'GOES' + platform[1:], 'grid': platform.lower()}
+    return dict(satellite, id=platform)
+
+def GetProjectionParameters(netCDFread):
+    """
+    Obtiene los parámetros de la grilla fija desde la variable `goes_imager_projection`.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+
+    Returns:
+        dict: semi_major_axis, semi_minor_axis, perspective_point_height y longitude_of_projection_origin.
+
+    Raises:
+        AttributeError: Si la variable de proyección no tiene alguno de los parámetros.
+    """
+    proj = netCDFread.variables['goes_imager_projection']
+    return {name: float(getattr(proj, name)) for name in PROJECTION_PARAMETERS}
+
+def HasProjectionParameters(netCDFread):
+    """
+    Indica si el archivo trae la variable `goes_imager_projection` con los parámetros de la navegación analítica.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+
+    Returns:
+        bool: True si están todos los parámetros de `PROJECTION_PARAMETERS`.
+    """
+    proj = netCDFread.variables.get('goes_imager_projection')
+    return proj is not None and all(name in proj.ncattrs() for name in PROJECTION_PARAMETERS)
+
+def LatLonToScanAngle(lat, lon, projection):
+    """
+    Convierte coordenadas geográficas a ángulos de escaneo (x, y) de la grilla fija de GOES.
+
+    Args:
+        lat (ndarray): Latitudes geodésicas en grados.
+        lon (ndarray): Longitudes en grados.
+        projection (dict): Parámetros devueltos por `GetProjectionParameters` (o los atributos de
+            `goes_imager_projection` leídos con h5py).
+
+    Returns:
+        tuple: Ángulos x e y en radianes (NaN para los puntos no visibles desde el satélite).
+    """
+    req = float(projection['semi_major_axis'])
+    rpol = float(projection['semi_minor_axis'])
+    H = float(projection['perspective_point_height']) + req
+
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64) - float(projection['longitude_of_projection_origin']))
+    e2 = (req ** 2 - rpol ** 2) / req ** 2
+    lat_c = np.arctan((rpol ** 2 / req ** 2) * np.tan(lat))
+    r_c = rpol / np.sqrt(1 - e2 * np.cos(lat_c) ** 2)
+    sx = H - r_c * np.cos(lat_c) * np.cos(lon)
+    sy = -r_c * np.cos(lat_c) * np.sin(lon)
+    sz = r_c * np.sin(lat_c)
+
+    x = np.arcsin(-sy / np.sqrt(sx ** 2 + sy ** 2 + sz ** 2))
+    y = np.arctan(sz / sx)
+    hidden = H * (H - sx) < sy ** 2 + (req ** 2 / rpol ** 2) * sz ** 2
+    x = np.where(hidden, np.nan, x)
+    y = np.where(hidden, np.nan, y)
+    return x, y
+
+def GetScanWindow(extent, projection, x, y, margin=0):
+    """
+    Calcula la ventana de filas y columnas de la grilla fija que cubre un extent geográfico.
+
+    Se proyectan muestras de los cuatro bordes del extent a ángulos de escaneo y se toma la caja
+    que las contiene. Es la única implementación de la navegación: la usan tanto el recorte remoto
+    del descargador como la ventana del procesador, por lo que ambos coinciden.
+
+    Args:
+        extent (tuple): [lon_W, lon_E, lat_S, lat_N] en grados.
+        projection (dict): Parámetros de la proyección (ver `LatLonToScanAngle`).
+        x (ndarray): Ángulos de escaneo de las columnas, en radianes.
+        y (ndarray): Ángulos de escaneo de las filas, en radianes (decrecientes).
+        margin (int, optional): Píxeles extra a agregar en cada borde.
+
+    Returns:
+        tuple: (row0, row1, col0, col1) con límites superiores exclusivos, limitados a la grilla.
+
+    Raises:
+        ValueError: Si el extent no es visible desde el satélite.
+    """
+    lon_W, lon_E, lat_S, lat_N = extent
+    samples = np.linspace(0.0, 1.0, 64)
+    lons = np.concatenate([lon_W + (lon_E - lon_W) * samples] * 2 + [np.full(64, lon_W), np.full(64, lon_E)])
+    lats = np.concatenate([np.full(64, lat_S), np.full(64, lat_N)] + [lat_S + (lat_N - lat_S) * samples] * 2)
+    sx, sy = LatLonToScanAngle(lats, lons, projection)
+    if np.all(np.isnan(sx)):
+        raise ValueError('El extent solicitado no es visible desde el satélite')
+
+    dx = x[1] - x[0]
+    dy = y[1] - y[0]
+    col0 = min(max(int(np.floor((np.nanmin(sx) - x[0]) / dx)) - margin, 0), len(x))
+    col1 = min(max(int(np.ceil((np.nanmax(sx) - x[0]) / dx)) + 1 + margin, 0), len(x))
+    row0 = min(max(int(np.floor((np.nanmax(sy) - y[0]) / dy)) - margin, 0), len(y))
+    row1 = min(max(int(np.ceil((np.nanmin(sy) - y[0]) / dy)) + 1 + margin, 0), len(y))
+    return row0, row1, col0, col1
+
+def GetGridKey(netCDFread, extent):
+    """
+    Arma la clave de caché de una grilla: satélite, resolución, grilla del archivo y extent.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+        extent (tuple): (min_lon, max_lon, min_lat, max_lat).
+
+    Returns:
+        str: Clave del caché.
+    """
+    attrs = netCDFread.ncattrs()
+    proj = netCDFread.variables['goes_imager_projection']
+    parts = [getattr(netCDFread, 'platform_ID', 'G16'),
+             getattr(netCDFread, 'spatial_resolution', ''),
+             repr(float(proj.longitude_of_projection_origin)),
+             repr(float(proj.perspective_point_height)),
+             str(int(netCDFread.getncattr('crop_offset_x')) if 'crop_offset_x' in attrs else 0),
+             str(int(netCDFread.getncattr('crop_offset_y')) if 'crop_offset_y' in attrs else 0),
+             str(len(netCDFread.dimensions['x'])),
+             str(len(netCDFread.dimensions['y']))]
+    parts += ['%.6f' % value for value in extent]
+    return '|'.join(parts)
+
+def _LoadDiskCache():
+    """
+    Carga (una sola vez) el caché en disco de ventanas de recorte.
+
+    Returns:
+        dict: Ventanas calculadas previamente, indexadas por clave.
+    """
+    global _disk_cache
+    if _disk_cache is None:
+        cache_file = os.path.join(CACHE_DIR, 'navigation.json')
+        try:
+            with open(cache_file, 'r') as f:
+                _disk_cache = json.load(f)
+        except (OSError, ValueError):
+            _disk_cache = {}
+    return _disk_cache
+
+def _SaveDiskCache():
+    """
+    Guarda el caché de ventanas en disco de forma atómica.
+
+    Returns:
+        None
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cache_file = os.path.join(CACHE_DIR, 'navigation.json')
+    tmp_file = cache_file + '.%d.tmp' % os.getpid()
+    with open(tmp_file, 'w') as f:
+        json.dump(_disk_cache, f)
+    os.replace(tmp_file, cache_file)
+
+def ComputeCropWindow(netCDFread, min_lon, max_lon, min_lat, max_lat):
+    """
+    Calcula de forma analítica la ventana de la grilla fija que cubre un extent geográfico.
+
+    La ventana se obtiene con `GetScanWindow`, por lo que los índices son exactos a la resolución
+    de la banda.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+        min_lon (float): Longitud mínima.
+        max_lon (float): Longitud máxima.
+        min_lat (float): Latitud mínima.
+        max_lat (float): Latitud máxima.
+
+    Returns:
+        tuple: Extensión de la imagen (en metros sobre la proyección geoestacionaria) y los
+        índices [min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx] del recorte.
+
+    Raises:
+        ValueError: Si el extent no es visible desde el satélite.
+    """
+    projection = GetProjectionParameters(netCDFread)
+    x = np.asarray(netCDFread.variables['x'][:], dtype=np.float64)
+    y = np.asarray(netCDFread.variables['y'][:], dtype=np.float64)
+
+    min_lat_idx, max_lat_idx, min_lon_idx, max_lon_idx = GetScanWindow((min_lon, max_lon, min_lat, max_lat), projection, x, y)
+    dx = x[1] - x[0]
+    dy = y[1] - y[0]
+    if min_lon_idx >= max_lon_idx or min_lat_idx >= max_lat_idx:
+        raise ValueError('El extent solicitado no está contenido en la grilla del archivo')
+
+    # Extensión a los bordes de los píxeles, en metros
+    sat_h = projection['perspective_point_height']
+    img_extent = ((x[min_lon_idx] - abs(dx) / 2) * sat_h, (x[max_lon_idx - 1] + abs(dx) / 2) * sat_h,
+                  (y[max_lat_idx - 1] - abs(dy) / 2) * sat_h, (y[min_lat_idx] + abs(dy) / 2) * sat_h)
+    img_indexes = [min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx]
+    return tuple(float(v) for v in img_extent), img_indexes
+
+def GetCropWindow(netCDFread, min_lon, max_lon, min_lat, max_lat):
+    """
+    Devuelve la ventana de recorte para un extent, memorizada en memoria y en disco.
+
+    La ventana depende únicamente del satélite, la resolución, la grilla del archivo y el
+    extent, por lo que después del primer cálculo se resuelve con una búsqueda en un diccionario.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+        min_lon (float): Longitud mínima.
+        max_lon (float): Longitud máxima.
+        min_lat (float): Latitud mínima.
+        max_lat (float): Latitud máxima.
+
+    Returns:
+        tuple: Extensión de la imagen y los índices de las coordenadas recortadas.
+    """
+    key = GetGridKey(netCDFread, (min_lon, max_lon, min_lat, max_lat))
+    window = _window_cache.get(key)
+    if window is not None:
+        return window
+
+    with _cache_lock:
+        # Otro hilo pudo calcularla mientras se esperaba el lock
+        window = _window_cache.get(key)
+        if window is not None:
+            return window
+        stored = _LoadDiskCache().get(key)
+        if stored is not None:
+            window = (tuple(stored['extent']), list(stored['indexes']))
+        else:
+            window = ComputeCropWindow(netCDFread, min_lon, max_lon, min_lat, max_lat)
+            _disk_cache[key] = {'extent': list(window[0]), 'indexes': window[1]}
+            try:
+                _SaveDiskCache()
+            except OSError:
+                pass
+        _window_cache[key] = window
+    return window
+
+def LoadReferenceGrid(name):
+    """
+    Carga una grilla de referencia (por ejemplo `g16_lons_8km`) como arreglo mapeado en memoria.
+
+    La primera vez se convierte el archivo de texto a `.npy` en el directorio de caché; las
+    siguientes lecturas usan `np.load(..., mmap_mode='r')` en lugar de volver a parsear el texto.
+
+    Args:
+        name (str): Nombre de la grilla sin extensión.
+
+    Returns:
+        ndarray: La grilla mapeada en memoria.
+    """
+    grid = _reference_grids.get(name)
+    if grid is None:
+        npy_file = os.path.join(CACHE_DIR, name + '.npy')
+        if not os.path.exists(npy_file):
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            np.save(npy_file, np.loadtxt(os.path.join(GRIDS_DIR, name + '.txt')))
+        grid = np.load(npy_file, mmap_mode='r')
+        _reference_grids[name] = grid
+    return grid
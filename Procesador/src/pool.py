@@ -0,0 +1,165 @@
+import logging
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+class ProcessingPool:
+    """
+    Cola acotada de archivos a procesar, consumida por un pool de procesos.
+
+    matplotlib y cartopy no son seguros entre hilos, por lo que cada archivo se procesa en un
+    proceso aparte (contexto `spawn`). Un hilo despachador toma los archivos de la cola y nunca
+    envía al pool más tareas que procesos, de modo que la cola acotada es la única espera: cuando
+    se llena, `Submit` bloquea (contrapresión) o devuelve False al vencer el tiempo de espera. Un
+    mismo archivo no se encola dos veces mientras está pendiente o en proceso. Los resultados se
+    entregan en el proceso principal con `on_result`, que es donde se arma la animación.
+    """
+
+    def __init__(self, function, workers=1, queue_size=64, on_result=None, mp_context='spawn', initializer=None):
+        """
+        Args:
+            function (callable): Función a nivel de módulo que procesa un archivo (debe poder serializarse).
+            workers (int, optional): Cantidad de procesos.
+            queue_size (int, optional): Cantidad máxima de archivos en espera.
+            on_result (callable, optional): Se llama como `on_result(path, resultado)` en el proceso principal.
+            mp_context (str, optional): Método de inicio de los procesos.
+            initializer (callable, optional): Función a nivel de módulo que prepara cada proceso al iniciarlo.
+        """
+        self.function = function
+        self.workers = max(int(workers), 1)
+        self.on_result = on_result
+        self._queue = queue.Queue(maxsize=max(int(queue_size), 1))
+        self._slots = threading.Semaphore(self.workers)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(mp_context),
+                                             initializer=initializer)
+        self._dispatcher = threading.Thread(target=self._Dispatch, name='processing-pool', daemon=True)
+        self._dispatcher.start()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def IsFull(self):
+        """
+        Indica si la cola de espera está llena.
+
+        Returns:
+            bool: True si un nuevo `Submit` tendría que esperar.
+        """
+        return self._queue.full()
+
+    def Submit(self, path, timeout=None):
+        """
+        Encola un archivo para procesar.
+
+        Args:
+            path (str): Ruta del archivo.
+            timeout (float, optional): Espera máxima si la cola está llena; None espera indefinidamente.
+
+        Returns:
+            bool: True si el archivo se encoló, False si ya estaba pendiente o la cola siguió llena.
+        """
+        with self._lock:
+            if path in self._pending:
+                logging.info(f"Archivo ya encolado, se ignora: {path}")
+                return False
+            self._pending.add(path)
+        if self._queue.full():
+            logging.warning(f"Cola de procesamiento llena ({self._queue.maxsize} archivos): esperando para encolar {path}")
+        try:
+            self._queue.put(path, timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(path)
+                self._idle.notify_all()
+            logging.warning(f"Cola de procesamiento llena, no se encoló {path}")
+            return False
+        return True
+
+    def _Dispatch(self):
+        """
+        Bucle del hilo despachador: envía los archivos al pool a medida que se liberan procesos.
+
+        Returns:
+            None
+        """
+        while True:
+            path = self._queue.get()
+            if path is None:
+                return
+            self._slots.acquire()
+            try:
+                future = self._executor.submit(self.function, path)
+            except RuntimeError as e:
+                self._slots.release()
+                self._Finish(path)
+                logging.error(f"No se pudo enviar {path} al pool: {e}")
+                continue
+            future.add_done_callback(lambda f, path=path: self._Done(path, f))
+
+    def _Done(self, path, future):
+        """
+        Entrega el resultado de un archivo y libera su lugar en el pool.
+
+        Returns:
+            None
+        """
+        self._slots.release()
+        try:
+            result = future.result()
+            if self.on_result is not None:
+                self.on_result(path, result)
+        except Exception as e:
+            logging.error(f"Error al procesar el archivo {path}: {e}")
+        finally:
+            self._Finish(path)
+
+    def _Finish(self, path):
+        """
+        Quita un archivo de los pendientes.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._pending.discard(path)
+            self._idle.notify_all()
+
+    def Join(self, timeout=None):
+        """
+        Espera a que se procesen todos los archivos encolados.
+
+        Args:
+            timeout (float, optional): Tiempo máximo de espera en segundos.
+
+        Returns:
+            bool: True si no quedan archivos pendientes.
+        """
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._pending, timeout)
+
+    def Close(self, wait=True):
+        """
+        Detiene el despachador y el pool de procesos.
+
+        Args:
+            wait (bool, optional): Si es True, procesa antes los archivos ya encolados.
+
+        Returns:
+            None
+        """
+        if wait:
+            self.Join()
+        else:
+            while True:
+                try:
+                    self._Finish(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+        self._queue.put(None)
+        self._dispatcher.join()
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,141 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# Inicio del escaneo en los nombres de GOES: ..._sYYYYJJJHHMMSSs_...
+SCAN_TIME_PATTERN = re.compile(r'_s(\d{4})(\d{3})(\d{2})(\d{2})(\d{2})')
+
+def ScanTimeFromName(path):
+    """
+    Obtiene el inicio del escaneo a partir del nombre de un archivo GOES.
+
+    Args:
+        path (str): Ruta del archivo NetCDF.
+
+    Returns:
+        datetime: Inicio del escaneo, o None si el nombre no lo contiene.
+    """
+    match = SCAN_TIME_PATTERN.search(os.path.basename(path))
+    if match is None:
+        return None
+    return datetime.strptime(''.join(match.groups()), '%Y%j%H%M%S')
+
+def FileKey(path):
+    """
+    Arma la clave de un archivo: nombre, tamaño y fecha de modificación.
+
+    Args:
+        path (str): Ruta del archivo.
+
+    Returns:
+        tuple: (nombre, tamaño en bytes, mtime en nanosegundos).
+
+    Raises:
+        OSError: Si el archivo no existe.
+    """
+    stat = os.stat(path)
+    return os.path.basename(path), stat.st_size, stat.st_mtime_ns
+
+class ProcessedIndex:
+    """
+    Registro persistente de los archivos ya procesados, respaldado por SQLite en modo WAL.
+
+    Cada archivo se identifica por su nombre, tamaño y fecha de modificación, de modo que un
+    archivo reemplazado con otro contenido vuelve a procesarse. Las claves se mantienen en un
+    conjunto en memoria para responder "¿ya se procesó?" en O(1), y las escrituras están
+    protegidas por un lock para compartir la instancia entre hilos.
+    """
+
+    def __init__(self, db_file):
+        """
+        Abre (o crea) el registro de archivos procesados.
+
+        Args:
+            db_file (str): Ruta del archivo SQLite.
+        """
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS processed ('
+                           'name TEXT NOT NULL, size INTEGER NOT NULL, mtime INTEGER NOT NULL, '
+                           'png TEXT, processed_at REAL NOT NULL, PRIMARY KEY (name, size, mtime))')
+        self._keys = set(self._conn.execute('SELECT name, size, mtime FROM processed'))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def IsProcessed(self, path):
+        """
+        Indica si un archivo ya fue procesado.
+
+        Args:
+            path (str): Ruta del archivo NetCDF.
+
+        Returns:
+            bool: True si el archivo (con el mismo tamaño y fecha de modificación) ya está registrado.
+        """
+        try:
+            return FileKey(path) in self._keys
+        except OSError:
+            return False
+
+    def Add(self, path, png_path=None):
+        """
+        Registra un archivo procesado.
+
+        Args:
+            path (str): Ruta del archivo NetCDF.
+            png_path (str, optional): Imagen generada a partir del archivo.
+
+        Returns:
+            bool: True si el archivo se registró, False si ya estaba registrado o ya no existe.
+        """
+        try:
+            key = FileKey(path)
+        except OSError:
+            return False
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._conn.execute('INSERT OR IGNORE INTO processed (name, size, mtime, png, processed_at) VALUES (?, ?, ?, ?, ?)',
+                               key + (png_path, time.time()))
+            self._keys.add(key)
+        return True
+
+    def Pending(self, paths):
+        """
+        Filtra los archivos sin procesar y los ordena del más reciente al más antiguo.
+
+        Args:
+            paths (iterable): Rutas de archivos NetCDF.
+
+        Returns:
+            list: Rutas sin procesar, ordenadas por inicio de escaneo (o fecha de modificación) descendente.
+        """
+        pending = []
+        for path in paths:
+            try:
+                key = FileKey(path)
+            except OSError:
+                continue
+            if key not in self._keys:
+                scan_time = ScanTimeFromName(path)
+                order = scan_time.timestamp() if scan_time is not None else key[2] / 1e9
+                pending.append((order, path))
+        pending.sort(reverse=True)
+        return [path for _, path in pending]
+
+    def Close(self):
+        """
+        Cierra la conexión con la base de datos.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,67 @@
+import numpy as np
+
+# Regiones con extent en SMN_dict.conf como <prefijo>_lon_W, <prefijo>_lon_E, <prefijo>_lat_S y <prefijo>_lat_N
+PRESETS = {'Argentina': 'argentina', 'Sudamerica': 'sudamerica'}
+
+def GetRegions(confData):
+    """
+    Arma las regiones a dibujar a partir de la configuración.
+
+    Cada entrada de `regions` define `name` (se usa en el nombre de la imagen, `gC<name>`) y el
+    mapa con `extent` ([lon_W, lon_E, lat_S, lat_N]) o con `preset` (prefijo de los extents de
+    SMN_dict.conf, por ejemplo 'sudamerica'). Sin `regions` se dibuja solo Argentina. La grilla de
+    datos de cada región es su extent corrido por los `delta_*_for_graph` de la configuración.
+
+    Args:
+        confData (dict): Diccionario de configuración.
+
+    Returns:
+        list: Regiones con `name`, `extent` (mapa) y `grid_extent` (grilla de datos), en el orden configurado.
+
+    Raises:
+        KeyError: Si una región no define `extent` ni un `preset` con sus cuatro valores.
+    """
+    regions = []
+    for entry in confData.get('regions') or [{'name': 'Argentina'}]:
+        extent = entry.get('extent')
+        if extent is None:
+            preset = entry.get('preset', PRESETS.get(entry['name'], entry['name'].lower()))
+            extent = [confData[f'{preset}_lon_W'], confData[f'{preset}_lon_E'],
+                      confData[f'{preset}_lat_S'], confData[f'{preset}_lat_N']]
+        extent = [float(value) for value in extent]
+        grid_extent = [extent[0] + confData.get('delta_lon_W_for_graph', 0), extent[1],
+                       extent[2] + confData.get('delta_lat_S_for_graph', 0), extent[3] + confData.get('delta_lat_N_for_graph', 0)]
+        regions.append({'name': entry['name'], 'extent': extent, 'grid_extent': grid_extent})
+    return regions
+
+def UnionExtent(extents):
+    """
+    Calcula el extent que cubre a todos los extents dados.
+
+    Args:
+        extents (list): Extents [lon_W, lon_E, lat_S, lat_N].
+
+    Returns:
+        list: El extent [lon_W, lon_E, lat_S, lat_N] de la unión.
+    """
+    extents = np.asarray(extents, dtype=np.float64)
+    return [float(extents[:, 0].min()), float(extents[:, 1].max()), float(extents[:, 2].min()), float(extents[:, 3].max())]
+
+def SliceWindow(image, union_indexes, img_indexes):
+    """
+    Obtiene la vista (sin copia) de una ventana dentro de la imagen leída para la unión de regiones.
+
+    Args:
+        image (ndarray): Imagen del recorte de la unión (filas x columnas).
+        union_indexes (list): Índices [min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx] de la unión.
+        img_indexes (list): Índices de la ventana de la región, respecto del archivo.
+
+    Returns:
+        tuple: La vista de la región y sus índices respecto del archivo, limitados a la unión.
+    """
+    col0 = min(max(img_indexes[0], union_indexes[0]), union_indexes[1])
+    col1 = min(max(img_indexes[1], col0), union_indexes[1])
+    row0 = min(max(img_indexes[2], union_indexes[2]), union_indexes[3])
+    row1 = min(max(img_indexes[3], row0), union_indexes[3])
+    view = image[row0 - union_indexes[2]:row1 - union_indexes[2], col0 - union_indexes[0]:col1 - union_indexes[0]]
+    return view, [col0, col1, row0, row1]
@@ -0,0 +1,273 @@
+import importlib.util
+import os
+import threading
+import numpy as np
+
+# Pillow se importa dentro de las funciones que lo usan: importar el procesador no lo carga
+
+# Colores de las clases de topes nubosos (índice = clase), iguales a los del mapa de colores de main.py
+CLASS_COLORS = np.array([[255, 255, 255],   # white
+                         [255, 255, 0],     # yellow
+                         [255, 165, 0],     # orange
+                         [255, 0, 0]],      # red
+                        dtype=np.uint8)
+
+_renderers = []
+_glyph_cache = {}
+_fonts = {}
+_cache_lock = threading.Lock()
+
+def _Blend(top_rgba, below_rgb):
+    """
+    Compone píxeles RGBA sobre píxeles RGB con aritmética entera.
+
+    Args:
+        top_rgba (ndarray): Píxeles superiores (N x 4, uint8).
+        below_rgb (ndarray): Píxeles inferiores (N x 3, uint8).
+
+    Returns:
+        ndarray: Píxeles compuestos (N x 3, uint8).
+    """
+    alpha = top_rgba[:, 3:4].astype(np.uint16)
+    blended = top_rgba[:, :3] * alpha + below_rgb * (255 - alpha) + 127
+    return (blended // 255).astype(np.uint8)
+
+def _ToPalette(rgb, palette_img):
+    """
+    Asigna a cada píxel RGB el índice del color más cercano de la paleta.
+
+    Args:
+        rgb (ndarray): Píxeles (N x 3, uint8).
+        palette_img (Image): Imagen en modo 'P' que solo aporta la paleta.
+
+    Returns:
+        ndarray: Índices de la paleta (N, uint8).
+    """
+    from PIL import Image
+
+    img = Image.fromarray(np.ascontiguousarray(rgb.reshape(-1, 1, 3)), 'RGB')
+    return np.asarray(img.quantize(palette=palette_img, dither=Image.Dither.NONE)).ravel()
+
+def GetFontPath():
+    """
+    Ubica la tipografía que usa matplotlib por defecto, sin importar matplotlib.
+
+    Returns:
+        str: Ruta de DejaVuSans.ttf, o None si matplotlib no está instalado o no la incluye.
+    """
+    spec = importlib.util.find_spec('matplotlib')
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    path = os.path.join(spec.submodule_search_locations[0], 'mpl-data', 'fonts', 'ttf', 'DejaVuSans.ttf')
+    return path if os.path.exists(path) else None
+
+def GetFont(size_px):
+    """
+    Devuelve la tipografía de los títulos para un tamaño, memorizada por tamaño.
+
+    Args:
+        size_px (int): Tamaño de la tipografía en píxeles.
+
+    Returns:
+        ImageFont.FreeTypeFont: DejaVu Sans, o la tipografía por defecto de Pillow si no se encuentra.
+    """
+    font = _fonts.get(size_px)
+    if font is None:
+        from PIL import ImageFont
+
+        path = GetFontPath()
+        font = _fonts[size_px] = ImageFont.truetype(path, size_px) if path else ImageFont.load_default(size_px)
+    return font
+
+def GetGlyph(char, size_px):
+    """
+    Devuelve el raster de un carácter, memorizado por carácter y tamaño.
+
+    Args:
+        char (str): Carácter a dibujar.
+        size_px (int): Tamaño de la tipografía en píxeles.
+
+    Returns:
+        tuple: Máscara (uint8), desplazamiento (x, y) respecto de la línea base y avance horizontal.
+    """
+    key = (char, size_px)
+    glyph = _glyph_cache.get(key)
+    if glyph is None:
+        from PIL import Image, ImageDraw
+
+        font = GetFont(size_px)
+        x0, y0, x1, y1 = font.getbbox(char, anchor='ls')
+        mask = Image.new('L', (max(x1 - x0, 1), max(y1 - y0, 1)), 0)
+        ImageDraw.Draw(mask).text((-x0, -y0), char, fill=255, font=font, anchor='ls')
+        glyph = (np.asarray(mask), (x0, y0), font.getlength(char))
+        _glyph_cache[key] = glyph
+    return glyph
+
+class Renderer:
+    """
+    Motor de dibujo sin matplotlib para el producto IROL.
+
+    A partir de las capas estáticas de un `basemap.Basemap` y del mapa de índices de reproyección
+    precalcula, para cada píxel de la figura, de qué píxel de la imagen recortada toma su clase y
+    cómo se compone con las capas estáticas. Cada imagen nueva se arma entonces directamente en
+    índices de paleta con unos pocos gathers de NumPy y se codifica como PNG en modo paleta.
+    """
+
+    def __init__(self, base, grid_extent, index_map, title_size=8.0):
+        """
+        Args:
+            base (Basemap): Capas estáticas pre-renderizadas.
+            grid_extent (list): [lon_W, lon_E, lat_S, lat_N] de la grilla del mapa de índices.
+            index_map (ndarray): Mapa de índices de `resample.GetIndexMap`.
+            title_size (float, optional): Tamaño del título en puntos.
+        """
+        from PIL import Image
+
+        self.base = base
+        self.index_map = index_map
+        self.title_size_px = int(round(title_size * base.dpi / 72.0))
+        overlay = base.overlay
+        top = base.top
+        height, width = overlay.shape[:2]
+        self.shape = (height, width)
+
+        # Píxeles de la figura que caen dentro del eje del mapa
+        x0, y0, w, h = base.position
+        col0, col1 = int(round(x0 * width)), int(round((x0 + w) * width))
+        row0, row1 = int(round(height - (y0 + h) * height)), int(round(height - y0 * height))
+        lons = base.xlim[0] + (np.arange(col0, col1) + 0.5 - x0 * width) / (w * width) * (base.xlim[1] - base.xlim[0])
+        lats = base.ylim[1] - (np.arange(row0, row1) + 0.5 - (height - (y0 + h) * height)) / (h * height) * (base.ylim[1] - base.ylim[0])
+
+        # Píxel de la figura -> celda de la grilla -> píxel de la imagen recortada
+        nrows, ncols = index_map.shape
+        grid_cols = np.floor((lons - grid_extent[0]) / (grid_extent[1] - grid_extent[0]) * ncols).astype(np.int64)
+        grid_rows = np.floor((grid_extent[3] - lats) / (grid_extent[3] - grid_extent[2]) * nrows).astype(np.int64)
+        # Fuera de la grilla se usa -1, que en `Render` apunta (igual que el centinela) al valor de relleno
+        source = np.full((row1 - row0, col1 - col0), -1, dtype=np.int64)
+        valid = (grid_rows[:, None] >= 0) & (grid_rows[:, None] < nrows) & (grid_cols[None, :] >= 0) & (grid_cols[None, :] < ncols)
+        rr, cc = np.nonzero(valid)
+        source[rr, cc] = index_map[grid_rows[rr], grid_cols[cc]]
+        box_pixels = (np.arange(row0, row1)[:, None] * width + np.arange(col0, col1)[None, :]).ravel()
+        source = source.ravel()
+
+        # Fondo estático (datos en blanco) con las capas inferiores y superiores
+        white = np.full((height * width, 3), 255, dtype=np.uint8)
+        under = _Blend(overlay.reshape(-1, 4), white)
+        static = _Blend(top.reshape(-1, 4), under)
+        self.under_rgb = under.reshape(height, width, 3)
+
+        # Dentro del eje: píxeles libres (clase directa) y píxeles cubiertos por capas estáticas
+        overlay = overlay.reshape(-1, 4)
+        top = top.reshape(-1, 4)
+        covered = (overlay[box_pixels, 3] > 0) | (top[box_pixels, 3] > 0)
+        self.free_pixels = box_pixels[~covered]
+        self.free_source = source[~covered]
+        self.covered_pixels = box_pixels[covered]
+        self.covered_source = source[covered]
+        blends = [_Blend(top[self.covered_pixels], _Blend(overlay[self.covered_pixels], np.broadcast_to(color, (len(self.covered_pixels), 3))))
+                  for color in CLASS_COLORS]
+
+        # Paleta: las cuatro clases primero y luego los colores de las capas estáticas y sus mezclas con cada clase
+        colors = np.concatenate([static] + blends)
+        quantized = Image.fromarray(colors.reshape(-1, 1, 3), 'RGB').quantize(colors=252, dither=Image.Dither.NONE)
+        palette = np.concatenate([CLASS_COLORS, np.asarray(quantized.getpalette()[:252 * 3], dtype=np.uint8).reshape(-1, 3)])
+        palette = np.concatenate([palette, np.zeros((256 - len(palette), 3), dtype=np.uint8)])
+        self.palette = palette.ravel().tolist()
+        self.palette_img = Image.new('P', (1, 1))
+        self.palette_img.putpalette(self.palette)
+        self.static_idx = _ToPalette(static, self.palette_img)
+        self.covered_idx = np.stack([_ToPalette(blended, self.palette_img) for blended in blends], axis=1)
+
+    def DrawTitle(self, idx, title):
+        """
+        Escribe el título componiendo los glifos en caché entre las capas estáticas inferiores y superiores.
+
+        Args:
+            idx (ndarray): Imagen en índices de paleta (filas x columnas, uint8), se modifica en el lugar.
+            title (str): Título de la imagen.
+
+        Returns:
+            None
+        """
+        height, width = self.shape
+        pen_x = self.base.title_anchor[0] * width
+        baseline = height - self.base.title_anchor[1] * height
+        placed = []
+        for char in title:
+            mask, (dx, dy), advance = GetGlyph(char, self.title_size_px)
+            placed.append((mask, int(round(pen_x + dx)), int(round(baseline + dy))))
+            pen_x += advance
+        if not placed:
+            return
+
+        r0 = max(min(y for _, _, y in placed), 0)
+        r1 = min(max(y + m.shape[0] for m, _, y in placed), height)
+        c0 = max(min(x for _, x, _ in placed), 0)
+        c1 = min(max(x + m.shape[1] for m, x, _ in placed), width)
+        if r0 >= r1 or c0 >= c1:
+            return
+        alpha = np.zeros((r1 - r0, c1 - c0), dtype=np.uint16)
+        for mask, x, y in placed:
+            ys, xs = max(y, r0), max(x, c0)
+            ye, xe = min(y + mask.shape[0], r1), min(x + mask.shape[1], c1)
+            if ys < ye and xs < xe:
+                region = alpha[ys - r0:ye - r0, xs - c0:xe - c0]
+                np.maximum(region, mask[ys - y:ye - y, xs - x:xe - x], out=region)
+
+        # Texto negro sobre las capas inferiores y luego las capas superiores (logo y barra lateral)
+        under = self.under_rgb[r0:r1, c0:c1].reshape(-1, 3)
+        text = (under * (255 - alpha.reshape(-1, 1)) + 127) // 255
+        top = self.base.top[r0:r1, c0:c1].reshape(-1, 4)
+        strip = _Blend(top, text.astype(np.uint8))
+        touched = alpha.reshape(-1) > 0
+        rows, cols = np.nonzero(alpha > 0)
+        idx[rows + r0, cols + c0] = _ToPalette(strip[touched], self.palette_img)
+
+    def Render(self, image_class, title, png_path, compress_level=6):
+        """
+        Dibuja una imagen clasificada y la guarda como PNG en modo paleta.
+
+        Args:
+            image_class (ndarray): Clases (0 a 3, uint8) sobre la grilla del recorte.
+            title (str): Título de la imagen.
+            png_path (str): Ruta del PNG a escribir.
+            compress_level (int, optional): Nivel de compresión zlib del PNG.
+
+        Returns:
+            None
+        """
+        # El último elemento es el relleno (clase 0, blanco) para el centinela y los píxeles fuera de la grilla
+        source = np.zeros(image_class.size + 1, dtype=np.uint8)
+        source[:-1] = np.ravel(image_class)
+
+        idx = self.static_idx.copy()
+        idx[self.free_pixels] = source[self.free_source]
+        idx[self.covered_pixels] = self.covered_idx[np.arange(len(self.covered_pixels)), source[self.covered_source]]
+        idx = idx.reshape(self.shape)
+        self.DrawTitle(idx, title)
+
+        from PIL import Image
+
+        img = Image.frombuffer('P', (self.shape[1], self.shape[0]), idx, 'raw', 'P', 0, 1)
+        img.putpalette(self.palette)
+        img.save(png_path, compress_level=compress_level, dpi=(self.base.dpi, self.base.dpi))
+
+def GetRenderer(base, grid_extent, index_map):
+    """
+    Devuelve el motor de dibujo para unas capas estáticas y un mapa de índices, memorizado en memoria.
+
+    Args:
+        base (Basemap): Capas estáticas pre-renderizadas.
+        grid_extent (list): [lon_W, lon_E, lat_S, lat_N] de la grilla del mapa de índices.
+        index_map (ndarray): Mapa de índices de `resample.GetIndexMap`.
+
+    Returns:
+        Renderer: El motor de dibujo.
+    """
+    with _cache_lock:
+        for cached_base, cached_extent, cached_map, renderer in _renderers:
+            if cached_base is base and cached_map is index_map and cached_extent == list(grid_extent):
+                return renderer
+        renderer = Renderer(base, grid_extent, index_map)
+        _renderers.append((base, list(grid_extent), index_map, renderer))
+    return renderer
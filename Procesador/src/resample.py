@@ -0,0 +1,124 @@
+import hashlib
+import os
+import threading
+import numpy as np
+from src import navigation
+
+_index_maps = {}
+_cache_lock = threading.Lock()
+
+def GetTargetGrid(extent, resolution_deg):
+    """
+    Define la grilla de salida en coordenadas geográficas (PlateCarree) para un extent.
+
+    Args:
+        extent (list): [lon_W, lon_E, lat_S, lat_N] en grados.
+        resolution_deg (float): Tamaño del píxel de salida en grados.
+
+    Returns:
+        tuple: Forma (filas, columnas) de la grilla de salida.
+    """
+    ncols = int(np.ceil((extent[1] - extent[0]) / resolution_deg))
+    nrows = int(np.ceil((extent[3] - extent[2]) / resolution_deg))
+    return nrows, ncols
+
+def BuildIndexMap(projection, x, y, extent, shape):
+    """
+    Construye el mapa de índices de vecino más cercano desde la grilla de salida a la imagen recortada.
+
+    Cada píxel de la grilla de salida (centros equiespaciados en longitud y latitud, con el origen
+    arriba) se proyecta a ángulos de escaneo y se le asigna el píxel de la grilla fija más cercano.
+    Los píxeles no visibles o fuera del recorte apuntan a un índice centinela igual al tamaño de
+    la imagen recortada.
+
+    Args:
+        projection (dict): Parámetros devueltos por `navigation.GetProjectionParameters`.
+        x (ndarray): Ángulos de escaneo de las columnas del recorte, en radianes.
+        y (ndarray): Ángulos de escaneo de las filas del recorte, en radianes.
+        extent (list): [lon_W, lon_E, lat_S, lat_N] de la grilla de salida.
+        shape (tuple): Forma (filas, columnas) de la grilla de salida.
+
+    Returns:
+        ndarray: Índices planos (int32) sobre la imagen recortada, con la forma de la grilla de salida.
+    """
+    nrows, ncols = shape
+    lon_step = (extent[1] - extent[0]) / ncols
+    lat_step = (extent[3] - extent[2]) / nrows
+    lons = extent[0] + lon_step * (np.arange(ncols) + 0.5)
+    lats = extent[3] - lat_step * (np.arange(nrows) + 0.5)
+    sentinel = len(x) * len(y)
+
+    index_map = np.empty(shape, dtype=np.int32)
+    dx = x[1] - x[0]
+    dy = y[1] - y[0]
+    # Por filas, para no materializar todas las coordenadas en float64 a la vez
+    for row, lat in enumerate(lats):
+        sx, sy = navigation.LatLonToScanAngle(np.full(ncols, lat), lons, projection)
+        with np.errstate(invalid='ignore'):
+            cols = np.rint((sx - x[0]) / dx)
+            rows = np.rint((sy - y[0]) / dy)
+            valid = (cols >= 0) & (cols < len(x)) & (rows >= 0) & (rows < len(y))
+        flat = np.full(ncols, sentinel, dtype=np.int32)
+        flat[valid] = (rows[valid] * len(x) + cols[valid]).astype(np.int32)
+        index_map[row] = flat
+    return index_map
+
+def GetIndexMap(netCDFread, img_indexes, extent, resolution_deg):
+    """
+    Devuelve el mapa de índices para un recorte y una grilla de salida, memorizado en memoria y en disco.
+
+    El mapa depende solo de la posición del satélite, la ventana de recorte y la grilla de salida,
+    por lo que se calcula una única vez y luego cada imagen se reproyecta con un solo gather.
+
+    Args:
+        netCDFread (Dataset): Objeto NetCDF leído.
+        img_indexes (list): Índices [min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx] del recorte.
+        extent (list): [lon_W, lon_E, lat_S, lat_N] de la grilla de salida.
+        resolution_deg (float): Tamaño del píxel de salida en grados.
+
+    Returns:
+        ndarray: El mapa de índices (ver `BuildIndexMap`).
+    """
+    shape = GetTargetGrid(extent, resolution_deg)
+    key = navigation.GetGridKey(netCDFread, extent) + '|%s|%d|%d|%d|%d' % (
+        repr(float(resolution_deg)), img_indexes[0], img_indexes[1], img_indexes[2], img_indexes[3])
+    index_map = _index_maps.get(key)
+    if index_map is not None:
+        return index_map
+
+    with _cache_lock:
+        cache_file = os.path.join(navigation.CACHE_DIR, 'resample_%s.npy' % hashlib.sha1(key.encode()).hexdigest()[:16])
+        if os.path.exists(cache_file):
+            index_map = np.load(cache_file)
+        else:
+            min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx = img_indexes
+            projection = navigation.GetProjectionParameters(netCDFread)
+            x = np.asarray(netCDFread.variables['x'][min_lon_idx:max_lon_idx], dtype=np.float64)
+            y = np.asarray(netCDFread.variables['y'][min_lat_idx:max_lat_idx], dtype=np.float64)
+            index_map = BuildIndexMap(projection, x, y, extent, shape)
+            try:
+                os.makedirs(navigation.CACHE_DIR, exist_ok=True)
+                tmp_file = cache_file + '.%d.tmp.npy' % os.getpid()
+                np.save(tmp_file, index_map)
+                os.replace(tmp_file, cache_file)
+            except OSError:
+                pass
+        _index_maps[key] = index_map
+    return index_map
+
+def Reproject(image, index_map, fill_value):
+    """
+    Reproyecta una imagen recortada a la grilla de salida con un único gather de NumPy.
+
+    Args:
+        image (ndarray): Imagen en la grilla fija, con la forma del recorte.
+        index_map (ndarray): Mapa de índices devuelto por `GetIndexMap`.
+        fill_value: Valor para los píxeles de salida sin dato.
+
+    Returns:
+        ndarray: Imagen en la grilla de salida.
+    """
+    source = np.empty(image.size + 1, dtype=np.result_type(image.dtype, np.min_scalar_type(fill_value)))
+    source[:-1] = np.ravel(image)
+    source[-1] = fill_value
+    return source[index_map]
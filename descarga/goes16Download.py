@@ -1,108 +1,121 @@
 import logging
 import time
 import json
-import s3fs
 import datetime
 import os
-import shutil
+import sys
+import threading
+import queue
+import importlib.util
 import helpers as help
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-logging.basicConfig(level=logging.DEBUG)
-
 # Obtiene la ruta absoluta al directorio del script
 script_dir = os.path.dirname(os.path.abspath(__file__))
 # Construye la ruta absoluta al archivo de configuración
 setup_file = os.path.join(script_dir, 'setup.json')
+main_path = script_dir  # Directorio del script
 
-# Leo el archivo de configuración
-data = help.readJson(setup_file)
-
-# Extraigo los paths y cantidad de bandas
-main_path = os.path.dirname(os.path.abspath(__file__))  # Directorio del script
-image_path = os.path.join(main_path, '..', 'Procesador', 'inbox')
-temp_path = os.path.join(main_path, 'temp')  # Carpeta temporal para descargas
-db_path = os.path.join(main_path, data['db_path'])
-log_path = os.path.join(main_path, data['log_path'])
-bands = data['bands']  # Bandas a descargar
-product = data['product']
-timeout = data['timeout']
-dates = data['dates']  # Fechas para realizar la descarga
-start_hour = data.get('start_hour', '00:00')  # Hora de inicio para realizar la descarga
-end_date = data.get('end_date', None)  # Fecha de fin para realizar la descarga
-end_hour = data.get('end_hour', None)  # Hora de fin para realizar la descarga
-max_workers = data.get('max_workers', 1)  # Número de descargas paralelas
-
-# Verificar y crear carpetas necesarias
-for path in [image_path, temp_path, db_path, log_path]:
-    if not os.path.exists(path):
-        os.makedirs(path)
-
-# Configuración del archivo de logging
-logger, logfile = help.createLogger(__file__, log_path)
-
-# Configuro las credenciales anónimas para acceder al servidor de imágenes
-logger.info('Configurando las credenciales de acceso al repositorio remoto')
-fs = s3fs.S3FileSystem(anon=True)
-
-# Verificar conexión a S3
-while True:
-    try:
-        fs.ls('s3://noaa-goes16/')
-        logger.info('Conexión a S3 exitosa, reanudando descargas')
-        break
-    except Exception as e:
-        logger.error('Error en la conexión a S3: ' + str(e))
-        time.sleep(60)
-
-# Crear o leer el archivo de base de datos
-db_file = os.path.join(db_path, 'download_db.json')
-if not os.path.exists(db_file):
-    logger.info('Creando el archivo de base de datos con los archivos descargados')
-    download_db = {}
-    help.writeJson(db_file, download_db)
-else:
-    try:
-        logger.info('Leyendo la base de datos de archivos descargados')
-        download_db = help.readJson(db_file)
-    except json.JSONDecodeError:
-        logger.error('El archivo de base de datos estaba vacío o corrupto, inicializándolo de nuevo.')
-        download_db = {}
-        help.writeJson(db_file, download_db)
+# Configuración leída de setup.json; se carga en loadConfig() para que importar el módulo no tenga efectos
+data = None
+image_path = None
+temp_path = None
+db_path = None
+log_path = None
+bands = None
+product = None
+timeout = None
+dates = None
+start_hour = None
+end_date = None
+end_hour = None
+max_workers = None
+download_mode = None
+crop_extent = None
+stream_to_processor = None
+archive_path = None
+stream_max_attempts = None
+rules = None
+
+def loadConfig(path=None):
+    """
+    Lee el archivo de configuración y define los paths y parámetros de la descarga.
+
+    Args:
+        path (str, optional): Ruta del archivo de configuración; por defecto `setup.json` junto al script.
+
+    Returns:
+        dict: La configuración leída.
+    """
+    global data, image_path, temp_path, db_path, log_path, bands, product, timeout, dates, start_hour
+    global end_date, end_hour, max_workers, download_mode, crop_extent, stream_to_processor, archive_path, rules
+    global stream_max_attempts
+
+    # Leo el archivo de configuración
+    data = help.readJson(path or setup_file)
+
+    # Extraigo los paths y cantidad de bandas
+    image_path = os.path.join(main_path, '..', 'Procesador', 'inbox')
+    temp_path = os.path.join(main_path, 'temp')  # Carpeta temporal para descargas
+    db_path = os.path.join(main_path, data['db_path'])
+    log_path = os.path.join(main_path, data['log_path'])
+    bands = data.get('bands', [])  # Bandas a descargar (si no se define `products`)
+    product = data.get('product')
+    timeout = data['timeout']
+    dates = data['dates']  # Fechas para realizar la descarga
+    start_hour = data.get('start_hour', '00:00')  # Hora de inicio para realizar la descarga
+    end_date = data.get('end_date', None)  # Fecha de fin para realizar la descarga
+    end_hour = data.get('end_hour', None)  # Hora de fin para realizar la descarga
+    max_workers = data.get('max_workers', 1)  # Número de descargas paralelas
+    download_mode = data.get('download_mode', 'full')  # 'full': disco completo, 'crop': solo la región crop_extent
+    crop_extent = data.get('crop_extent', None)  # [lon_W, lon_E, lat_S, lat_N] para el modo 'crop'
+    stream_to_processor = data.get('stream_to_processor', False)  # Entrega los bytes al procesador sin pasar por el inbox
+    archive_path = os.path.join(main_path, data.get('archive_path', 'archive'))  # Archivo de NetCDF en el modo en memoria
+    stream_max_attempts = data.get('stream_max_attempts', 3)  # Intentos de procesamiento antes de abandonar un archivo
+    rules = help.buildRules(data, image_path, main_path)  # Reglas por producto, banda y modo de escaneo
+    return data
+
+# Estado compartido con las funciones de descarga; se inicializa en run()
+logger = None
+ledger = None
+fs = None
+procesador = None
+archive_executor = None
+process_executor = None
+in_flight = set()
+in_flight_lock = threading.Lock()
+hand_off = None
+shutdown_event = None
+limiter = None
+meter = None
+engine = None
 
 # Obtener la última fecha y hora de la imagen descargada
 def get_last_downloaded_time():
     """
-    Obtiene la última fecha y hora de la imagen descargada de la base de datos.
+    Obtiene la última fecha y hora de la imagen descargada del registro de descargas.
 
     Returns:
-        datetime.datetime o None: La última fecha y hora descargada, o None si no hay registros.
-    """
-    last_time = None
-    for year in sorted(download_db.keys()):
-        for day in sorted(download_db[year].keys()):
-            for hour in sorted(download_db[year][day].keys()):
-                if len(download_db[year][day][hour]) == 6:
-                    last_time = datetime.datetime.strptime(f"{year}{day}{hour}", "%Y%j%H")
-    return last_time
-
-# Definir la fecha y hora inicial para la descarga
-last_time = get_last_downloaded_time()
-if last_time:
-    logger.info(f'Continuando desde la última fecha y hora descargada: {last_time}')
-else:
-    logger.info('No se encontró ninguna descarga previa. Iniciando desde el principio.')
-
-# Convertir la fecha y hora de inicio
-start_datetime = datetime.datetime.strptime(f"{dates[0]} {start_hour}", "%Y-%m-%d %H:%M")
-
-# Convertir la fecha y hora de fin si está disponible
-if end_date and end_hour:
-    end_datetime = datetime.datetime.strptime(f"{end_date} {end_hour}", "%Y-%m-%d %H:%M") if end_hour else datetime.datetime.strptime(f"{end_date} 23:59", "%Y-%m-%d %H:%M")
-else:
-    end_datetime = None
+        datetime.datetime o None: La última hora completa en todos los flujos configurados, o None si alguno no tiene registros.
+    """
+    last_hours = [ledger.getLastCompleteHour(rule.filesPerHour, stream) for rule in rules for stream in rule.streams]
+    if not last_hours or None in last_hours:
+        return None
+    return min(last_hours)
 
 # Definir la función de descarga de archivos
+def rule_for(image_name):
+    """
+    Busca la regla de descarga a la que pertenece un archivo.
+
+    Args:
+        image_name (str): Nombre o ruta del archivo.
+
+    Returns:
+        DownloadRule: La primera regla (en orden de prioridad) que lo incluye, o None.
+    """
+    return next((rule for rule in rules if rule.matches(image_name)), None)
+
 def download_file(f, temp_path, final_path, year, day, hour):
     """
     Descarga un archivo desde el repositorio remoto a una ubicación temporal y luego lo mueve a la ubicación final.
@@ -123,111 +136,559 @@ def download_file(f, temp_path, final_path, year, day, hour):
         logger.error('Nombre de archivo inválido para descargar. Omitiendo...')
         return
     
-    band_number = int(image_name.split('_')[1].split('M6C')[-1])
-    if band_number in bands:
-        if f not in download_db.get(year, {}).get(day, {}).get(hour, []):
+    rule = rule_for(image_name)
+    if rule is not None:
+        if not ledger.isDownloaded(f):
+            if procesador is not None and final_path == image_path:
+                stream_file(f, image_name, year, day, hour)
+                return
             logger.info(f'Descargando archivo para {hour}:00 ' + image_name)
             print(f'Descargando archivo: {image_name}')
             temp_file_path = os.path.join(temp_path, image_name)
             final_file_path = os.path.join(final_path, image_name)
             try:
-                fs.get(f, temp_file_path)
+                if download_mode == 'crop' and rule.radiance:
+                    # Solo se transfieren los chunks que intersectan la región de interés
+                    help.cropRemoteFile(fs, f, temp_file_path, crop_extent)
+                elif engine is not None:
+                    timing = engine.download(f, temp_file_path)
+                    logger.info(f'{image_name}: {timing["bytes"] / 2 ** 20:.1f} MB en {timing["seconds"]:.2f} s '
+                                f'(primer byte en {timing["first_byte"]:.2f} s, {timing["mb_s"]:.1f} MB/s'
+                                + (f', reanudado desde el byte {timing["resumed"]}' if timing["resumed"] else '') + ')')
+                else:
+                    # Descarga por rangos reanudable, verificada contra el tamaño y el ETag del objeto remoto
+                    help.downloadThrottled(fs, f, temp_file_path, limiter)
             except Exception as e:
                 logger.error(f'Error al descargar el archivo {image_name}: {str(e)}')
                 return
             
-            # Verificación de integridad
-            if os.path.getsize(temp_file_path) > 0:
-                shutil.move(temp_file_path, final_file_path)
-                if year not in download_db:
-                    download_db[year] = {}
-                if day not in download_db[year]:
-                    download_db[year][day] = {}
-                if hour not in download_db[year][day]:
-                    download_db[year][day][hour] = []
-                download_db[year][day][hour].append(f)
-                # Guardar el archivo JSON inmediatamente después de cada descarga
-                help.writeJson(db_file, download_db)
+            # Verificación de integridad: la cabecera NetCDF debe abrirse antes de entregar el archivo al inbox
+            size = os.path.getsize(temp_file_path)
+            if size > 0 and help.validateNetCDF(temp_file_path, rule.variables):
+                help.moveAtomic(temp_file_path, final_file_path)
+                ledger.add(f, year, day, hour)
+                if meter is not None:
+                    meter.add(size)
+                if hand_off is not None and final_path == image_path:
+                    # Entrega directa al procesador, sin esperar a que lo detecte el observador del inbox. Si el
+                    # orquestador se detiene con la cola llena, el archivo queda en el inbox y se recupera al reiniciar
+                    while shutdown_event is None or not shutdown_event.is_set():
+                        try:
+                            hand_off.put(final_file_path, timeout=1)
+                            break
+                        except queue.Full:
+                            pass
             else:
-                logger.error('Archivo descargado incompleto: ' + image_name)
+                logger.error('Archivo descargado incompleto o NetCDF inválido: ' + image_name)
                 os.remove(temp_file_path)
 
-# Bucle principal para cada fecha y hora
-current_datetime = last_time + datetime.timedelta(hours=1) if last_time else start_datetime
-retry_timeout = timeout
-max_retries = 5  # Número máximo de intentos antes de aumentar el tiempo de espera
-retry_count = 0
-max_wait_time = 1800  # Máximo tiempo de espera después de varios intentos fallidos (30 minutos)
-
-while True:
-    # Verificar si se ha alcanzado la fecha y hora de fin
-    if end_datetime and current_datetime > end_datetime:
-        logger.info('Se ha alcanzado la fecha y hora de fin. Proceso de descarga completado.')
-        print('Proceso de descarga completado.')
-        break
-    else:
-        logger.info('Descarga iniciada en modo continuo. Manteniéndose en espera para descargas futuras.')
-        print('Manteniéndose en espera para futuras descargas.')
-    
-    year, day, hour = current_datetime.strftime("%Y"), current_datetime.strftime("%j"), current_datetime.strftime("%H")
-    remotePath, year, day, hour = help.getRemotePath('s3://noaa-goes16/', product, current_datetime)
-
-    if year not in download_db:
-        download_db[year] = {}
-    if day not in download_db[year]:
-        download_db[year][day] = {}
-    if hour not in download_db[year][day]:
-        download_db[year][day][hour] = []
-
-    elapsed_time = 0
-    while len(download_db[year][day][hour]) < 6:
+def stream_file(f, image_name, year, day, hour):
+    """
+    Descarga un archivo a memoria, lo entrega al hilo del procesador y lo archiva en segundo plano.
+
+    Args:
+        f (str): La ruta del archivo remoto a descargar.
+        image_name (str): Nombre del archivo.
+        year (str): Año de la descarga.
+        day (str): Día del año de la descarga.
+        hour (str): Hora de la descarga.
+
+    Returns:
+        None
+    """
+    # Un archivo descargado que todavía se está procesando no figura en el registro: no se vuelve a pedir
+    with in_flight_lock:
+        if f in in_flight:
+            return
+        in_flight.add(f)
+
+    logger.info(f'Descargando a memoria archivo para {hour}:00 ' + image_name)
+    try:
+        if download_mode == 'crop' and rule_for(image_name).radiance:
+            content, _ = help.cropRemoteBytes(fs, f, crop_extent)
+        else:
+            content = fs.cat(f)
+    except Exception as e:
+        logger.error(f'Error al descargar el archivo {image_name}: {str(e)}')
+        with in_flight_lock:
+            in_flight.discard(f)
+        return
+
+    # Misma verificación de integridad que en la descarga a disco, sobre el buffer
+    if len(content) == 0 or not help.validateNetCDFBytes(content, rule_for(image_name).variables):
+        logger.error('Archivo descargado incompleto o NetCDF inválido: ' + image_name)
+        with in_flight_lock:
+            in_flight.discard(f)
+        return
+
+    # La escritura en disco se superpone con el procesamiento
+    archive_executor.submit(help.writeBytes, os.path.join(archive_path, image_name), content)
+    if meter is not None:
+        meter.add(len(content))
+    # El dibujo corre en un único hilo propio, sin ocupar los hilos de descarga
+    process_executor.submit(process_stream, f, image_name, content, year, day, hour)
+
+def process_stream(f, image_name, content, year, day, hour):
+    """
+    Procesa un archivo descargado a memoria y recién entonces lo registra como descargado.
+
+    Si el procesamiento falla el archivo queda fuera del registro, por lo que el siguiente
+    sondeo de su hora lo vuelve a descargar. Tras `stream_max_attempts` fallos se abandona: se
+    registra sin imágenes (la copia queda en `archive_path`) para que su hora pueda completarse.
+
+    Args:
+        f (str): La ruta del archivo remoto.
+        image_name (str): Nombre del archivo.
+        content (bytes): Contenido del NetCDF.
+        year (str): Año de la descarga.
+        day (str): Día del año de la descarga.
+        hour (str): Hora de la descarga.
+
+    Returns:
+        bool: True si el archivo se procesó y quedó registrado.
+    """
+    try:
         try:
-            logger.info(f'Obteniendo lista de archivos del repositorio remoto para la fecha {current_datetime.strftime("%Y-%m-%d")}, hora {hour}')
-            currentFileList = list(fs.ls(remotePath, refresh=True))
-            expected_files = [f for f in currentFileList if f.split('/')[-1].startswith(f"OR_ABI-L1b-RadF-M6C13_G16_s{year}{day}{hour}")]
-            logger.info(f'Se encontraron {len(expected_files)} archivos disponibles en el repositorio para la hora {hour}')
-
-            if len(expected_files) != 0:
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    futures = [executor.submit(download_file, f, temp_path, image_path, year, day, hour) for f in expected_files]
-                    for future in as_completed(futures):
-                        try:
-                            future.result()
-                        except Exception as e:
-                            logger.error('Error durante la descarga de un archivo: ' + str(e))
-                            print(f'Error durante la descarga de un archivo: ' + str(e))
-
-                if len(download_db[year][day][hour]) == 6:
-                    logger.info('Todas las imágenes para la hora {} han sido descargadas.'.format(hour))
-                    retry_count = 0  # Reiniciar el contador de intentos
-                    break
-                else:
-                    logger.info('Esperando la próxima imagen a ser descargada. Manteniéndose en espera para descargar la próxima imagen disponible.')
-            else:
-                logger.info(f'Aún no hay archivos en el remoto para descargar para la hora {hour} del día {current_datetime.strftime("%Y-%m-%d")}, esperando la próxima imagen.')
-                print(f'Aún no hay archivos en el remoto para descargar para la hora {hour} del día {current_datetime.strftime("%Y-%m-%d")}, esperando la próxima imagen.')
-                retry_count += 1
-                if retry_count >= max_retries:
-                    logger.warning(f'Se alcanzó el número máximo de intentos ({max_retries}) sin éxito. Aumentando el tiempo de espera y continuando.')
-                    time.sleep(min(retry_timeout * 2, max_wait_time))
-                    retry_count = 0
-                    continue
-            
-            help.writeJson(db_file, download_db)
-            time.sleep(timeout)
-            elapsed_time += timeout
+            if procesador.procesar_archivo(image_name, memory=content):
+                ledger.add(f, year, day, hour)
+                return True
+            error = 'el procesador no pudo generar las imágenes'
+        except Exception as e:
+            error = str(e)
+        attempts = ledger.addFailure(f)
+        if attempts < stream_max_attempts:
+            logger.error(f'Error al procesar el archivo {image_name} (intento {attempts}), se reintentará: {error}')
+        else:
+            logger.error(f'Error al procesar el archivo {image_name} (intento {attempts}), se abandona y queda '
+                         f'registrado sin imágenes: {error}')
+            ledger.add(f, year, day, hour)
+        return False
+    finally:
+        with in_flight_lock:
+            in_flight.discard(f)
+
+def wait_processing():
+    """
+    Espera a que el hilo del procesador termine los archivos recibidos hasta ahora (modo en memoria).
+
+    El pool de procesamiento tiene un único hilo y atiende los pedidos en orden, por lo que una
+    tarea vacía encolada ahora termina después de todas las anteriores.
 
-            if elapsed_time > 600:
-                logger.warning(f'Se alcanzó el tiempo máximo de espera para la hora {hour}, pero aún no se descargaron todas las imágenes. Continuando en espera...')
-                elapsed_time = 0
+    Returns:
+        None
+    """
+    if process_executor is not None:
+        process_executor.submit(lambda: None).result()
+
+def hour_state(hour_datetime):
+    """
+    Arma el estado de descarga de una hora: sus fechas y un listado por flujo de cada regla.
+
+    Args:
+        hour_datetime (datetime.datetime): Fecha y hora a descargar.
+
+    Returns:
+        dict: `datetime`, `start` (inicio de la hora), `year`, `day`, `hour` y `listings`, con una
+        tupla (regla, directorio remoto, flujo, prefijo) por flujo.
+    """
+    year, day, hour = hour_datetime.strftime("%Y"), hour_datetime.strftime("%j"), hour_datetime.strftime("%H")
+    listings = []
+    for rule in rules:
+        remotePath = help.getRemotePath(rule.bucket, rule.product, hour_datetime)[0]
+        listings += [(rule, remotePath, stream, rule.prefix(stream, year, day, hour)) for stream in rule.streams]
+    return {'datetime': hour_datetime, 'start': hour_datetime.replace(minute=0, second=0, microsecond=0),
+            'year': year, 'day': day, 'hour': hour, 'listings': listings}
+
+def missing_streams(state):
+    """
+    Devuelve los flujos de una hora con menos archivos registrados que los esperados.
+
+    Args:
+        state (dict): Estado de la hora (ver `hour_state`).
 
+    Returns:
+        list: Las tuplas (regla, directorio remoto, flujo, prefijo) incompletas.
+    """
+    return [item for item in state['listings']
+            if ledger.countHour(state['year'], state['day'], state['hour'], item[2]) < item[0].filesPerHour]
+
+def download_hour(state, pollers, executor):
+    """
+    Hace una pasada de sondeo sobre los flujos incompletos de una hora y descarga los archivos pendientes.
+
+    Se piden todas las claves ya listadas de cada flujo que todavía no figuran en el registro, no solo
+    las que devolvió este sondeo: una descarga fallida se reintenta en la pasada siguiente.
+
+    Args:
+        state (dict): Estado de la hora (ver `hour_state`).
+        pollers (dict): Sondeo de cada regla, indexado por `id(regla)`.
+        executor (ThreadPoolExecutor): Pool de descargas.
+
+    Returns:
+        int: Cantidad de archivos enviados a descargar.
+    """
+    # Las reglas están ordenadas por prioridad: sus archivos entran antes a la cola del pool
+    files = []
+    for rule, remotePath, stream, prefix in missing_streams(state):
+        poller = pollers[id(rule)]
+        poller.poll(remotePath, prefix)
+        files += [(rule, f) for f in poller.listing.keys(remotePath, prefix) if not ledger.isDownloaded(f)]
+    futures = [executor.submit(download_file, f, temp_path, rule.inbox, state['year'], state['day'], state['hour'])
+               for rule, f in files]
+    for future in as_completed(futures):
+        try:
+            future.result()
         except Exception as e:
-            logger.error('Error inesperado durante la descarga: ' + str(e))
-            print(f'Error inesperado durante la descarga: {str(e)}')
+            logger.error('Error durante la descarga de un archivo: ' + str(e))
+            print(f'Error durante la descarga de un archivo: ' + str(e))
+    return len(files)
+
+def forget_hour(state, pollers):
+    """
+    Descarta el estado de sondeo y el caché de listados de una hora.
+
+    Returns:
+        None
+    """
+    for rule, remotePath, stream, prefix in state['listings']:
+        pollers[id(rule)].forget(remotePath, prefix)
+
+def revisit_hours(revisit, pollers, executor, now=None):
+    """
+    Vuelve a sondear las horas que se saltearon con escaneos faltantes, con un back-off exponencial.
+
+    Un escaneo publicado tarde (una demora habitual de S3) se descarga en alguna de las pasadas
+    siguientes en lugar de perderse. Cada hora se revisa como máximo `revisit_passes` veces; la
+    espera entre pasadas empieza en `revisit_backoff` segundos y se duplica en cada una.
+
+    Args:
+        revisit (list): Horas pendientes (estado de `hour_state` con `passes`, `delay` y `due`); se modifica en el lugar.
+        pollers (dict): Sondeo de cada regla, indexado por `id(regla)`.
+        executor (ThreadPoolExecutor): Pool de descargas.
+        now (float, optional): Instante actual de `time.monotonic()`.
+
+    Returns:
+        float o None: Segundos hasta la próxima pasada pendiente, o None si no quedan horas por revisar.
+    """
+    now = time.monotonic() if now is None else now
+    for state in list(revisit):
+        if state['due'] > now:
+            continue
+        download_hour(state, pollers, executor)
+        state['passes'] -= 1
+        if not missing_streams(state):
+            logger.info(f'La hora {state["datetime"].strftime("%Y-%m-%d %H")} se completó al volver a sondearla.')
+        elif state['passes'] <= 0:
+            logger.error(f'La hora {state["datetime"].strftime("%Y-%m-%d %H")} quedó incompleta después de volver a sondearla.')
+        else:
+            state['delay'] *= 2
+            state['due'] = now + state['delay']
+            continue
+        revisit.remove(state)
+        forget_hour(state, pollers)
+    return min((state['due'] - now for state in revisit), default=None)
+
+def backfill(start_datetime, end_datetime):
+    """
+    Descarga en paralelo todas las horas de un rango histórico.
+
+    El rango se enumera completo al inicio: las horas se listan de forma concurrente y cada
+    archivo encontrado se envía a un único pool de descargas, por lo que varias horas y días se
+    descargan a la vez. La concurrencia (`backfill_workers`) y el ancho de banda
+    (`backfill_max_bandwidth`, en MB/s) se limitan de forma global. Las horas con escaneos faltantes
+    se informan sin esperar a que aparezcan. Al terminar, los archivos listados que no quedaron en el
+    registro (por un error transitorio de S3) se vuelven a descargar hasta `backfill_retries` veces;
+    en el modo en memoria, después de que el procesador termine los archivos ya descargados.
+
+    Args:
+        start_datetime (datetime.datetime): Fecha y hora de inicio.
+        end_datetime (datetime.datetime): Fecha y hora de fin.
+
+    Returns:
+        list: Horas con menos archivos que los esperados.
+    """
+    global limiter, meter
+    hours = help.hourRange(start_datetime, end_datetime)
+    workers = data.get('backfill_workers', 8)
+    bandwidth = data.get('backfill_max_bandwidth', None)
+    limiter = help.BandwidthLimiter(bandwidth * 2 ** 20) if bandwidth else None
+    if engine is not None:
+        engine.limiter = limiter
+    meter = help.ThroughputMeter()
+    report_every = data.get('backfill_report_every', 50)
+    listing = help.ListingCache(fs)
+    expected = sum(rule.filesPerHour * len(rule.streams) for rule in rules)
+    logger.info(f'Backfill de {len(hours)} horas entre {hours[0] if hours else start_datetime} y {end_datetime} '
+                f'con {workers} descargas en paralelo' + (f' y un límite de {bandwidth} MB/s' if bandwidth else ''))
+
+    def list_hour(hour_datetime):
+        year, day, hour = hour_datetime.strftime("%Y"), hour_datetime.strftime("%j"), hour_datetime.strftime("%H")
+        files = []
+        for rule in rules:
+            remotePath = help.getRemotePath(rule.bucket, rule.product, hour_datetime)[0]
+            for stream in rule.streams:
+                prefix = rule.prefix(stream, year, day, hour)
+                files += [(rule, f) for f in listing.refresh(remotePath, prefix)]
+                listing.expire(remotePath, prefix)
+        return hour_datetime, year, day, hour, files
+
+    def submit(items):
+        # Las reglas ya están ordenadas por prioridad: sus archivos entran antes a la cola del pool
+        return [download_executor.submit(download_file, f, temp_path, rule.inbox, year, day, hour)
+                for rule, f, year, day, hour in items if not ledger.isDownloaded(f)]
+
+    def wait_all(futures):
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error('Error durante la descarga de un archivo: ' + str(e))
+            if done % report_every == 0:
+                logger.info(f'Backfill: {done}/{len(futures)} archivos procesados, {meter.summary()}')
+        # En el modo en memoria un archivo se registra recién al procesarse: sin esperar, los reintentos
+        # volverían a pedir archivos que todavía están en la cola del procesador
+        wait_processing()
+
+    missing = []
+    listed = []
+    futures = []
+    with ThreadPoolExecutor(max_workers=min(workers, 8)) as list_executor, \
+            ThreadPoolExecutor(max_workers=workers) as download_executor:
+        for result in as_completed([list_executor.submit(list_hour, hour_datetime) for hour_datetime in hours]):
+            try:
+                hour_datetime, year, day, hour, files = result.result()
+            except Exception as e:
+                logger.error('Error al listar una hora del backfill: ' + str(e))
+                continue
+            if len(files) < expected:
+                logger.warning(f'La hora {hour_datetime} tiene {len(files)} de {expected} archivos en el repositorio.')
+                missing.append(hour_datetime)
+            items = [(rule, f, year, day, hour) for rule, f in files]
+            listed += items
+            futures += submit(items)
+        wait_all(futures)
+
+        # Los archivos que no quedaron en el registro se vuelven a pedir: el backfill no se repite solo
+        retries = data.get('backfill_retries', 3)
+        for attempt in range(1, retries + 1):
+            pending = [item for item in listed if not ledger.isDownloaded(item[1])]
+            if not pending:
+                break
+            logger.warning(f'Backfill: reintento {attempt} de {retries} para {len(pending)} archivos que no se descargaron.')
+            wait_all(submit(pending))
+
+    failed = [item[1] for item in listed if not ledger.isDownloaded(item[1])]
+    if failed:
+        logger.error(f'Backfill: {len(failed)} archivos no se pudieron descargar: ' + ', '.join(f.split('/')[-1] for f in failed))
+    logger.info(f'Backfill completado: {meter.summary()}. Horas incompletas: {len(missing)}')
+    print(f'Backfill completado: {meter.summary()}')
+    return sorted(missing)
+
+def run(hand_off_queue=None, procesador_module=None, stop_event=None):
+    """
+    Ejecuta el ciclo de descarga continuo (o hasta la fecha de fin configurada).
+
+    Args:
+        hand_off_queue (queue.Queue, optional): Cola donde se entrega la ruta de cada archivo descargado
+            al inbox; la usa el orquestador de `run_all.py` en lugar de que el procesador vigile el directorio.
+        procesador_module (module, optional): Módulo del procesador ya cargado, para el modo en memoria;
+            si no se indica y `stream_to_processor` está activo, se carga `Procesador/main.py`.
+        stop_event (threading.Event, optional): Evento para detener la descarga; las esperas entre
+            sondeos se interrumpen al activarlo y los recursos se liberan antes de volver.
+
+    Returns:
+        None
+    """
+    global logger, ledger, fs, procesador, archive_executor, process_executor, hand_off, engine, shutdown_event
+    # s3fs (y con él aiobotocore) solo se importa al ejecutar la descarga
+    import s3fs
+
+    logging.basicConfig(level=logging.DEBUG)
+    if data is None:
+        loadConfig()
+    hand_off = hand_off_queue
+    # Sin orquestador nadie activa el evento: las esperas equivalen a time.sleep
+    stop_event = shutdown_event = stop_event or threading.Event()
+
+    # Verificar y crear carpetas necesarias
+    for path in [image_path, temp_path, db_path, log_path] + [rule.inbox for rule in rules] + ([archive_path] if stream_to_processor else []):
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    # Configuración del archivo de logging
+    logger, logfile = help.createLogger(__file__, log_path)
+    download_executor = None
+    try:
+
+        if download_mode == 'crop' and not crop_extent:
+            logger.error("El modo de descarga 'crop' requiere definir 'crop_extent' en setup.json")
+            raise ValueError("Falta 'crop_extent' en setup.json")
+        logger.info(f'Modo de descarga: {download_mode}')
+
+        # Modo en memoria: el procesador se carga en este mismo proceso y recibe los bytes descargados
+        procesador = None
+        if stream_to_processor:
+            procesador_dir = os.path.join(main_path, '..', 'Procesador')
+            if procesador_dir not in sys.path:
+                sys.path.insert(0, procesador_dir)
+            procesador = procesador_module
+            if procesador is None:
+                spec = importlib.util.spec_from_file_location('procesador_main', os.path.join(procesador_dir, 'main.py'))
+                procesador = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(procesador)
+            archive_executor = ThreadPoolExecutor(max_workers=1)  # Escritura del archivo en disco fuera del camino crítico
+            # Un único hilo de procesamiento: matplotlib no es seguro entre hilos y las descargas no esperan al dibujo
+            process_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='procesador')
+            logger.info(f'Modo en memoria activado, los NetCDF se archivan en {archive_path}')
+
+        # Configuro las credenciales anónimas para acceder al servidor de imágenes
+        logger.info('Configurando las credenciales de acceso al repositorio remoto')
+        fs = s3fs.S3FileSystem(anon=True)
+
+        # Verificar conexión a S3 (un bucket por satélite configurado)
+        while not stop_event.is_set():
+            try:
+                for bucket in sorted(set(rule.bucket for rule in rules)):
+                    fs.ls(bucket)
+                logger.info('Conexión a S3 exitosa, reanudando descargas')
+                break
+            except Exception as e:
+                logger.error('Error en la conexión a S3: ' + str(e))
+                stop_event.wait(60)
+        if stop_event.is_set():
+            logger.info('Descarga detenida antes de conectarse a S3.')
+            return
+
+        # Abrir el registro de descargas y migrar la antigua base de datos JSON si existe
+        ledger_file = os.path.join(db_path, 'download_db.sqlite')
+        logger.info('Abriendo el registro de archivos descargados')
+        ledger = help.DownloadLedger(ledger_file)
+        try:
+            migrated = ledger.migrateJson(os.path.join(db_path, 'download_db.json'))
+            if migrated:
+                logger.info(f'Se migraron {migrated} registros desde download_db.json')
+        except json.JSONDecodeError:
+            logger.error('El archivo download_db.json estaba vacío o corrupto, se omite la migración.')
+
+        # Definir la fecha y hora inicial para la descarga
+        last_time = get_last_downloaded_time()
+        if last_time:
+            logger.info(f'Continuando desde la última fecha y hora descargada: {last_time}')
+        else:
+            logger.info('No se encontró ninguna descarga previa. Iniciando desde el principio.')
+
+        # Convertir la fecha y hora de inicio
+        start_datetime = datetime.datetime.strptime(f"{dates[0]} {start_hour}", "%Y-%m-%d %H:%M")
+
+        # Convertir la fecha y hora de fin si está disponible
+        if end_date and end_hour:
+            end_datetime = datetime.datetime.strptime(f"{end_date} {end_hour}", "%Y-%m-%d %H:%M") if end_hour else datetime.datetime.strptime(f"{end_date} 23:59", "%Y-%m-%d %H:%M")
+        else:
+            end_datetime = None
+
+        # Motor asíncrono: una única sesión HTTP de s3fs reutilizada por todas las descargas del proceso
+        if data.get('download_engine', 'async') == 'async':
+            engine = help.AsyncDownloader(concurrency=data.get('backfill_workers', 8) if data.get('backfill', False) else max_workers,
+                                          chunkSize=data.get('download_chunk_size', 2 ** 23))
+            logger.info(f'Motor de descarga asíncrono con {engine.concurrency} transferencias simultáneas')
+
+        # Modo backfill: todo el rango configurado se descarga en paralelo y el proceso termina
+        if data.get('backfill', False):
+            backfill(start_datetime, end_datetime or help.utcNow())
+            return
+
+        logger.info('Reglas de descarga: ' + ', '.join(repr(rule) for rule in rules))
+
+        # Caché de listados por prefijo: solo se piden a S3 las claves nuevas de cada flujo
+        listing = help.ListingCache(fs, keyFilter=lambda key: any(rule.matches(key) for rule in rules),
+                                    maxAge=data.get('listing_max_age', 3 * 3600))
+
+        # Sondeo guiado por el calendario de escaneos de cada regla: duerme hasta la publicación estimada de cada escaneo
+        pollers = {id(rule): help.ScanPoller(fs, listing=listing,
+                                             cadenceMinutes=rule.cadenceMinutes,
+                                             publicationLag=rule.publicationLag,
+                                             pollInterval=data.get('poll_interval', 5),
+                                             margin=data.get('poll_margin', 30))
+                   for rule in rules}
+
+        # Pool de descargas persistente: no se recrea en cada sondeo
+        download_executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        # Bucle principal para cada fecha y hora
+        current_datetime = last_time + datetime.timedelta(hours=1) if last_time else start_datetime
+        # Horas salteadas con escaneos faltantes: se vuelven a sondear con back-off en lugar de descartarse
+        revisit = []
+        revisit_passes = data.get('revisit_passes', 6)
+        revisit_backoff = data.get('revisit_backoff', 60)
+
+        while not stop_event.is_set():
+            # Verificar si se ha alcanzado la fecha y hora de fin
+            if end_datetime and current_datetime > end_datetime:
+                # Antes de terminar se agotan las pasadas de las horas salteadas
+                while revisit and not stop_event.is_set():
+                    logger.info(f'Quedan {len(revisit)} horas incompletas por volver a sondear.')
+                    stop_event.wait(max(revisit_hours(revisit, pollers, download_executor) or 0, 0))
+                logger.info('Se ha alcanzado la fecha y hora de fin. Proceso de descarga completado.')
+                print('Proceso de descarga completado.')
+                break
+            else:
+                logger.info('Descarga iniciada en modo continuo. Manteniéndose en espera para descargas futuras.')
+                print('Manteniéndose en espera para futuras descargas.')
+
+            state = hour_state(current_datetime)
+            hour = state['hour']
+            while missing_streams(state) and not stop_event.is_set():
+                try:
+                    next_revisit = revisit_hours(revisit, pollers, download_executor)
+                    logger.info(f'Obteniendo archivos nuevos del repositorio remoto para la fecha {current_datetime.strftime("%Y-%m-%d")}, hora {hour}')
+                    found = download_hour(state, pollers, download_executor)
+                    logger.info(f'Se encontraron {found} archivos pendientes en el repositorio para la hora {hour}')
+
+                    if not missing_streams(state):
+                        logger.info('Todas las imágenes para la hora {} han sido descargadas.'.format(hour))
+                        break
 
-    current_datetime += datetime.timedelta(hours=1)
+                    waits = [pollers[id(rule)].waitTime(remotePath, prefix, state['start']) for rule, remotePath, stream, prefix in missing_streams(state)]
+                    waits = [wait for wait in waits if wait is not None]
+                    if not waits:
+                        logger.warning(f'Faltan escaneos de la hora {hour} del día {current_datetime.strftime("%Y-%m-%d")} que ya deberían estar publicados. '
+                                       f'Se volverá a sondear hasta {revisit_passes} veces; continuando con la hora siguiente.')
+                        revisit.append(dict(state, passes=revisit_passes, delay=revisit_backoff, due=time.monotonic() + revisit_backoff))
+                        break
+                    wait = min(waits + ([max(next_revisit, 0)] if next_revisit is not None else []))
+                    logger.info(f'Próximo sondeo en {wait:.0f} s ({sum(poller.requests for poller in pollers.values())} consultas a S3)')
+                    stop_event.wait(wait)
 
-print("\n" + "="*40 + "\nDESCARGA COMPLETADA\n" + "="*40)
+                except Exception as e:
+                    logger.error('Error inesperado durante la descarga: ' + str(e))
+                    print(f'Error inesperado durante la descarga: {str(e)}')
+                    stop_event.wait(timeout)
 
+            # Una hora salteada conserva su estado de sondeo hasta que se complete o se agoten sus pasadas
+            if not any(item['datetime'] == current_datetime for item in revisit):
+                forget_hour(state, pollers)
+            current_datetime += datetime.timedelta(hours=1)
 
+        if stop_event.is_set():
+            logger.info('Descarga detenida.')
+            return
+        print("\n" + "="*40 + "\nDESCARGA COMPLETADA\n" + "="*40)
+    finally:
+        # El supervisor de run_all.py reinicia la etapa en el mismo proceso: no deben quedar hilos, sesiones ni manejadores abiertos
+        if download_executor is not None:
+            download_executor.shutdown(cancel_futures=True)
+        if process_executor is not None:
+            process_executor.shutdown()
+            archive_executor.shutdown()
+            process_executor = archive_executor = None
+        if engine is not None:
+            engine.close()
+            engine = None
+        if ledger is not None:
+            ledger.close()
+            ledger = None
+        logger.removeHandler(logfile)
+        logfile.close()
 
+if __name__ == "__main__":
+    run()
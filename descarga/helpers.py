@@ -1,7 +1,38 @@
+import asyncio
 import json
 import datetime
+import hashlib
 import logging
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import threading
 import time
+from collections import deque
+import numpy as np
+
+# Variables auxiliares que se copian al recortar un archivo ABI-L1b (calibración y proyección)
+CROP_AUX_VARIABLES = ['band_id', 'band_wavelength', 'planck_fk1', 'planck_fk2', 'planck_bc1', 'planck_bc2',
+                      'kappa0', 'esun', 'earth_sun_distance_anomaly_in_AU', 'goes_imager_projection',
+                      'geospatial_lat_lon_extent', 'nominal_satellite_subpoint_lat', 'nominal_satellite_subpoint_lon', 't']
+
+# Inicio del escaneo en los nombres ABI: ..._sYYYYJJJHHMMSSs_...
+SCAN_START_PATTERN = re.compile(r'_s(\d{4})(\d{3})(\d{2})(\d{2})(\d{2})')
+
+# Escaneos por hora de cada sector (F: disco completo, C: CONUS, M: mesoescala) según el modo de escaneo ABI
+SCANS_PER_HOUR = {3: {'F': 4, 'C': 12, 'M': 60}, 4: {'F': 12}, 6: {'F': 6, 'C': 12, 'M': 60}}
+
+# Retraso típico entre el inicio del escaneo y su publicación, en segundos, por sector
+PUBLICATION_LAG = {'F': 600, 'C': 300, 'M': 60}
+
+# Directorio del procesador, cuya navegación de la grilla fija y tabla de satélites se comparten con el descargador
+PROCESADOR_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Procesador'))
+
+# Atributos internos de HDF5/netCDF4 que no deben copiarse al archivo recortado
+HDF5_INTERNAL_ATTRS = ['DIMENSION_LIST', 'REFERENCE_LIST', 'CLASS', 'NAME', '_Netcdf4Dimid',
+                       '_Netcdf4Coordinates', '_FillValue', '_NCProperties', '_nc3_strict']
 
 def writeJson(filepath, dictionary):
     """
@@ -31,6 +62,22 @@ def readJson(filepath):
         data = json.load(fp)
     return data
 
+def writeBytes(filepath, content):
+    """
+    Escribe un contenido binario en disco de forma atómica (archivo temporal y renombrado).
+
+    Args:
+        filepath (str): La ruta del archivo a escribir.
+        content (bytes): El contenido a escribir.
+
+    Returns:
+        None
+    """
+    part_file = filepath + '.part'
+    with open(part_file, 'wb') as fp:
+        fp.write(content)
+    os.replace(part_file, filepath)
+
 def getRemotePath(rootPath, product, datetimeIn):
     """
     Genera una ruta remota basada en la fecha y hora proporcionadas.
@@ -55,6 +102,10 @@ def createLogger(attachedFile, logPath):
     """
     Crea un logger para registrar eventos en un archivo de registro.
 
+    Es idempotente: si el logger ya escribe en el mismo archivo se reutiliza su manejador, y los
+    manejadores de archivo anteriores se cierran, de modo que reiniciar la etapa en el mismo
+    proceso no duplica cada línea del registro.
+
     Args:
         attachedFile (str): Nombre del archivo o módulo asociado con el logger.
         logPath (str): Ruta donde se guardará el archivo de registro.
@@ -66,6 +117,12 @@ def createLogger(attachedFile, logPath):
     logger.setLevel(logging.DEBUG)
     log_name = datetime.date.today().strftime('%Y%m%d_%H%M%S') + '_logfile.log'
     logfile_name = logPath + log_name
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.FileHandler):
+            if handler.baseFilename == os.path.abspath(logfile_name):
+                return logger, handler
+            logger.removeHandler(handler)
+            handler.close()
     logfile = logging.FileHandler(logfile_name)
     logfile.setLevel(logging.DEBUG)
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
@@ -75,3 +132,1288 @@ def createLogger(attachedFile, logPath):
     return logger, logfile
 
 
+class DownloadLedger:
+    """
+    Registro transaccional de los archivos descargados, respaldado por SQLite en modo WAL.
+
+    Reemplaza al antiguo `download_db.json`: cada descarga se inserta como una fila en lugar
+    de reescribir el archivo completo, y se mantiene un conteo por hora indexado para
+    consultar rápidamente la última hora completa. Las escrituras están protegidas por un
+    lock, por lo que la misma instancia puede compartirse entre los hilos de descarga.
+    """
+
+    def __init__(self, db_file):
+        """
+        Abre (o crea) la base de datos de descargas.
+
+        Args:
+            db_file (str): Ruta del archivo SQLite.
+        """
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS downloads ('
+                           'key TEXT PRIMARY KEY, year TEXT NOT NULL, day TEXT NOT NULL, '
+                           'hour TEXT NOT NULL, downloaded_at REAL NOT NULL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS hours ('
+                           'year TEXT NOT NULL, day TEXT NOT NULL, hour TEXT NOT NULL, '
+                           'files INTEGER NOT NULL, PRIMARY KEY (year, day, hour))')
+        # Conteo por flujo (producto, sector, modo y banda) para las reglas de descarga
+        self._conn.execute('CREATE TABLE IF NOT EXISTS stream_hours ('
+                           'stream TEXT NOT NULL, year TEXT NOT NULL, day TEXT NOT NULL, hour TEXT NOT NULL, '
+                           'files INTEGER NOT NULL, PRIMARY KEY (stream, year, day, hour))')
+        # Intentos fallidos de procesamiento en el modo en memoria, para abandonar los archivos que siempre fallan
+        self._conn.execute('CREATE TABLE IF NOT EXISTS failures ('
+                           'key TEXT PRIMARY KEY, attempts INTEGER NOT NULL, failed_at REAL NOT NULL)')
+        if 'stream' not in [row[1] for row in self._conn.execute('PRAGMA table_info(downloads)')]:
+            self._conn.execute("ALTER TABLE downloads ADD COLUMN stream TEXT NOT NULL DEFAULT ''")
+        self._migrateStreams()
+        # Conjunto en memoria para responder "¿ya se descargó?" en O(1)
+        self._keys = set(row[0] for row in self._conn.execute('SELECT key FROM downloads'))
+
+    def _migrateStreams(self):
+        """
+        Completa el flujo de los registros anteriores a la columna `stream` (o sin el satélite) a
+        partir del nombre del archivo y rearma el conteo por flujo y hora.
+
+        Returns:
+            None
+        """
+        rows = self._conn.execute("SELECT key FROM downloads WHERE stream NOT LIKE '%\\_G__' ESCAPE '\\'").fetchall()
+        rows = [(streamFromKey(key), key) for key, in rows]
+        rows = [row for row in rows if row[0]]
+        if not rows:
+            return
+        self._conn.execute('BEGIN IMMEDIATE')
+        self._conn.executemany('UPDATE downloads SET stream = ? WHERE key = ?', rows)
+        self._conn.execute('DELETE FROM stream_hours')
+        self._conn.execute('INSERT INTO stream_hours (stream, year, day, hour, files) '
+                           'SELECT stream, year, day, hour, COUNT(*) FROM downloads GROUP BY stream, year, day, hour')
+        self._conn.execute('COMMIT')
+
+    def __len__(self):
+        return len(self._keys)
+
+    def isDownloaded(self, key):
+        """
+        Indica si un archivo remoto ya fue descargado.
+
+        Args:
+            key (str): La ruta del archivo remoto.
+
+        Returns:
+            bool: True si el archivo ya está registrado.
+        """
+        return key in self._keys
+
+    def add(self, key, year, day, hour):
+        """
+        Registra un archivo descargado dentro de una transacción.
+
+        Args:
+            key (str): La ruta del archivo remoto.
+            year (str): Año de la descarga.
+            day (str): Día del año de la descarga.
+            hour (str): Hora de la descarga.
+
+        Returns:
+            bool: True si el archivo se registró, False si ya estaba registrado.
+        """
+        return self.addMany([(key, year, day, hour)]) == 1
+
+    def addMany(self, entries):
+        """
+        Registra varios archivos descargados en una única transacción.
+
+        Args:
+            entries (iterable): Tuplas (key, year, day, hour).
+
+        Returns:
+            int: Cantidad de archivos nuevos registrados.
+        """
+        added = 0
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for key, year, day, hour in entries:
+                    if key in self._keys:
+                        continue
+                    stream = streamFromKey(key)
+                    self._conn.execute('INSERT INTO downloads (key, year, day, hour, downloaded_at, stream) VALUES (?, ?, ?, ?, ?, ?)',
+                                       (key, year, day, hour, time.time(), stream))
+                    self._conn.execute('INSERT INTO hours (year, day, hour, files) VALUES (?, ?, ?, 1) '
+                                       'ON CONFLICT (year, day, hour) DO UPDATE SET files = files + 1',
+                                       (year, day, hour))
+                    self._conn.execute('INSERT INTO stream_hours (stream, year, day, hour, files) VALUES (?, ?, ?, ?, 1) '
+                                       'ON CONFLICT (stream, year, day, hour) DO UPDATE SET files = files + 1',
+                                       (stream, year, day, hour))
+                    self._keys.add(key)
+                    added += 1
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                self._keys = set(row[0] for row in self._conn.execute('SELECT key FROM downloads'))
+                raise
+        return added
+
+    def addFailure(self, key):
+        """
+        Suma un intento fallido de procesamiento de un archivo.
+
+        Args:
+            key (str): La ruta del archivo remoto.
+
+        Returns:
+            int: Cantidad de intentos fallidos del archivo, incluido este.
+        """
+        with self._lock:
+            self._conn.execute('INSERT INTO failures (key, attempts, failed_at) VALUES (?, 1, ?) '
+                               'ON CONFLICT (key) DO UPDATE SET attempts = attempts + 1, failed_at = excluded.failed_at',
+                               (key, time.time()))
+            return self._conn.execute('SELECT attempts FROM failures WHERE key = ?', (key,)).fetchone()[0]
+
+    def countHour(self, year, day, hour, stream=None):
+        """
+        Devuelve la cantidad de archivos descargados para una hora.
+
+        Args:
+            year (str): Año.
+            day (str): Día del año.
+            hour (str): Hora.
+            stream (str, optional): Flujo (ver `streamFromKey`); por defecto se cuentan todos los archivos.
+
+        Returns:
+            int: Cantidad de archivos registrados para esa hora.
+        """
+        with self._lock:
+            if stream is None:
+                row = self._conn.execute('SELECT files FROM hours WHERE year = ? AND day = ? AND hour = ?',
+                                         (year, day, hour)).fetchone()
+            else:
+                row = self._conn.execute('SELECT files FROM stream_hours WHERE stream = ? AND year = ? AND day = ? AND hour = ?',
+                                         (stream, year, day, hour)).fetchone()
+        return row[0] if row else 0
+
+    def getLastCompleteHour(self, files_per_hour, stream=None):
+        """
+        Obtiene la última hora que tiene todos sus archivos descargados.
+
+        Args:
+            files_per_hour (int): Cantidad de archivos que completan una hora.
+            stream (str, optional): Flujo (ver `streamFromKey`); por defecto se cuentan todos los archivos.
+
+        Returns:
+            datetime.datetime o None: La última hora completa, o None si no hay registros.
+        """
+        with self._lock:
+            if stream is None:
+                row = self._conn.execute('SELECT year, day, hour FROM hours WHERE files >= ? '
+                                         'ORDER BY year DESC, day DESC, hour DESC LIMIT 1',
+                                         (files_per_hour,)).fetchone()
+            else:
+                row = self._conn.execute('SELECT year, day, hour FROM stream_hours WHERE stream = ? AND files >= ? '
+                                         'ORDER BY year DESC, day DESC, hour DESC LIMIT 1',
+                                         (stream, files_per_hour)).fetchone()
+        if row is None:
+            return None
+        return datetime.datetime.strptime(''.join(row), "%Y%j%H")
+
+    def migrateJson(self, json_file):
+        """
+        Importa por única vez el antiguo `download_db.json` y lo renombra a `.migrated`.
+
+        Args:
+            json_file (str): Ruta del archivo JSON con la estructura year/day/hour.
+
+        Returns:
+            int: Cantidad de archivos importados (0 si no había nada para migrar).
+
+        Raises:
+            json.JSONDecodeError: Si el archivo JSON está corrupto.
+        """
+        if not os.path.exists(json_file):
+            return 0
+        download_db = readJson(json_file)
+        entries = [(key, year, day, hour)
+                   for year, days in download_db.items()
+                   for day, hours in days.items()
+                   for hour, keys in hours.items()
+                   for key in keys]
+        added = self.addMany(entries)
+        os.replace(json_file, json_file + '.migrated')
+        return added
+
+    def close(self):
+        """
+        Cierra la conexión con la base de datos.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._conn.close()
+
+
+def utcNow():
+    """
+    Devuelve la fecha y hora actual en UTC, sin zona horaria (igual que las fechas de los nombres ABI).
+
+    Returns:
+        datetime.datetime: Fecha y hora actual en UTC.
+    """
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def scanStartFromName(name):
+    """
+    Obtiene el inicio del escaneo a partir del nombre de un archivo ABI.
+
+    Args:
+        name (str): Nombre o ruta del archivo.
+
+    Returns:
+        datetime.datetime o None: Inicio del escaneo, o None si el nombre no lo contiene.
+    """
+    match = SCAN_START_PATTERN.search(name.split('/')[-1])
+    if match is None:
+        return None
+    return datetime.datetime.strptime(''.join(match.groups()), '%Y%j%H%M%S')
+
+def scanSlot(datetimeIn, cadenceMinutes=10):
+    """
+    Devuelve el turno del calendario de escaneos al que pertenece una fecha.
+
+    Args:
+        datetimeIn (datetime.datetime): Fecha y hora (por ejemplo, el inicio de un escaneo).
+        cadenceMinutes (int, optional): Minutos entre escaneos de disco completo (10 en el modo 6).
+
+    Returns:
+        datetime.datetime: Inicio nominal del turno.
+    """
+    return datetimeIn.replace(minute=datetimeIn.minute - datetimeIn.minute % cadenceMinutes, second=0, microsecond=0)
+
+def listNewKeys(fs, path, prefix='', startAfter=None):
+    """
+    Lista los objetos remotos de un directorio que empiezan con un prefijo, a partir de una clave.
+
+    Usa `list_objects_v2` con `Prefix` y `StartAfter`, por lo que S3 devuelve solo las claves
+    nuevas en lugar del directorio completo.
+
+    Args:
+        fs (s3fs.S3FileSystem): Sistema de archivos remoto.
+        path (str): Directorio remoto (por ejemplo 's3://noaa-goes16/ABI-L1b-RadF/2024/331/12/').
+        prefix (str, optional): Prefijo del nombre de los archivos.
+        startAfter (str, optional): Última clave ya vista, en el formato devuelto por esta función.
+
+    Returns:
+        list: Rutas 'bucket/clave' en orden lexicográfico, igual que `fs.ls`.
+    """
+    bucket, key_prefix = path.split('://')[-1].split('/', 1)
+    kwargs = {'Bucket': bucket, 'Prefix': key_prefix + prefix}
+    if startAfter:
+        kwargs['StartAfter'] = startAfter.split('/', 1)[1]
+    keys = []
+    while True:
+        response = fs.call_s3('list_objects_v2', **kwargs)
+        keys.extend(bucket + '/' + obj['Key'] for obj in response.get('Contents', []))
+        if not response.get('IsTruncated'):
+            return keys
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+def streamFromKey(key):
+    """
+    Obtiene el flujo de un archivo ABI: producto con sector, modo de escaneo, banda y satélite.
+
+    Args:
+        key (str): Nombre o ruta del archivo (por ejemplo '.../OR_ABI-L1b-RadF-M6C13_G16_s...nc').
+
+    Returns:
+        str: El flujo (por ejemplo 'ABI-L1b-RadF-M6C13_G16'), o '' si el nombre no sigue la convención.
+    """
+    parts = key.split('/')[-1].split('_')
+    return parts[1] + '_' + parts[2] if len(parts) > 3 and parts[0] == 'OR' else ''
+
+
+class DownloadRule:
+    """
+    Regla de descarga de un producto ABI para una banda, un modo de escaneo y un satélite.
+
+    A partir del sector del producto (última letra: F, C o M) y del modo de escaneo calcula los
+    flujos de archivos esperados (los productos de mesoescala tienen dos, M1 y M2), el prefijo de
+    cada flujo para una hora, la cantidad de archivos por hora y la cadencia entre escaneos. Los
+    flujos incluyen el satélite, de modo que el mismo producto de GOES-Este y GOES-Oeste se
+    registra y se sondea por separado. Solo los productos radiométricos (ABI-L1b) tienen la
+    variable `Rad`: es la única que se verifica al validar sus archivos y la única que se recorta.
+    """
+
+    def __init__(self, product, band=None, mode=6, priority=0, inbox=None, publicationLag=None, satellite='G16'):
+        """
+        Args:
+            product (str): Producto, con el sector (por ejemplo 'ABI-L1b-RadF' o 'ABI-L2-ACHAF').
+            band (int, optional): Banda; None para productos sin banda.
+            mode (int, optional): Modo de escaneo ABI (3, 4 o 6).
+            priority (int, optional): Prioridad de descarga; los valores menores se descargan primero.
+            inbox (str, optional): Directorio donde se entregan los archivos.
+            publicationLag (float, optional): Retraso de publicación inicial en segundos; por defecto según el sector.
+            satellite (str, optional): Satélite ('G16', 'G17', 'G18' o 'G19').
+
+        Raises:
+            ValueError: Si el satélite no es conocido o el sector no se escanea en el modo indicado.
+        """
+        # Misma tabla de satélites que el procesador
+        satellites = _navigation().SATELLITES
+        if satellite not in satellites:
+            raise ValueError(f'Satélite desconocido: {satellite} (opciones: {", ".join(satellites)})')
+        self.satellite = satellite
+        self.bucket = f's3://{satellites[satellite]["bucket"]}/'
+        self.product = product
+        self.band = int(band) if band is not None else None
+        self.mode = int(mode)
+        self.priority = priority
+        self.inbox = inbox
+        self.sector = product[-1]
+        self.radiance = '-L1b-' in product
+        self.variables = ('Rad',) if self.radiance else ()
+        self.filesPerHour = SCANS_PER_HOUR.get(self.mode, {}).get(self.sector)
+        if self.filesPerHour is None:
+            raise ValueError(f'El sector {self.sector} de {product} no se escanea en el modo {self.mode}')
+        self.cadenceMinutes = 60 // self.filesPerHour
+        if publicationLag is None:
+            # Los productos de nivel 2 se publican después de los radiométricos de los que se derivan
+            publicationLag = PUBLICATION_LAG.get(self.sector, 600) + (120 if '-L2-' in product else 0)
+        self.publicationLag = publicationLag
+        suffix = f'-M{self.mode}' + (f'C{self.band:02d}' if self.band is not None else '')
+        sectors = [product + '1', product + '2'] if self.sector == 'M' else [product]
+        self.streams = [f'{name}{suffix}_{satellite}' for name in sectors]
+
+    def __repr__(self):
+        return f'DownloadRule({", ".join(self.streams)}, prioridad={self.priority})'
+
+    def prefix(self, stream, year, day, hour):
+        """
+        Arma el prefijo de los archivos de un flujo para una hora.
+
+        Args:
+            stream (str): Uno de los flujos de la regla (incluye el satélite).
+            year (str): Año.
+            day (str): Día del año.
+            hour (str): Hora.
+
+        Returns:
+            str: Prefijo de los nombres de archivo.
+        """
+        return f'OR_{stream}_s{year}{day}{hour}'
+
+    def matches(self, key):
+        """
+        Indica si un archivo pertenece a la regla.
+
+        Args:
+            key (str): Nombre o ruta del archivo.
+
+        Returns:
+            bool: True si el flujo del archivo es uno de los de la regla.
+        """
+        return streamFromKey(key) in self.streams
+
+def buildRules(data, defaultInbox, basePath=''):
+    """
+    Arma las reglas de descarga a partir de la configuración.
+
+    La lista `products` de `setup.json` define, por producto, las bandas (`bands`), el modo de
+    escaneo (`mode`), la prioridad (`priority`), el directorio de entrega (`inbox`) y el retraso de
+    publicación (`publication_lag`). Sin `products` se usa una única entrada con `product` y `bands`.
+    Cada entrada se descarga de los satélites de su `satellites` (o `satellite`), por defecto los
+    de la configuración general o 'G16'. Sin `inbox`, la banda 13 del disco completo (la que usa el
+    procesador, de cualquier satélite) va a `defaultInbox` y los demás flujos a un subdirectorio propio.
+
+    Args:
+        data (dict): Configuración leída de `setup.json`.
+        defaultInbox (str): Directorio de entrada del procesador.
+        basePath (str, optional): Directorio respecto del cual se resuelven los `inbox` relativos.
+
+    Returns:
+        list: Reglas de descarga ordenadas por prioridad.
+
+    Raises:
+        ValueError: Si algún satélite no es conocido.
+    """
+    entries = data.get('products') or [{'product': data['product'], 'bands': data.get('bands')}]
+    defaultSatellites = data.get('satellites') or [data.get('satellite', 'G16')]
+    rules = []
+    for entry in entries:
+        product = entry['product']
+        satellites = entry.get('satellites') or ([entry['satellite']] if entry.get('satellite') else defaultSatellites)
+        for satellite, band in [(satellite, band) for satellite in satellites for band in entry.get('bands') or [None]]:
+            inbox = os.path.join(basePath, entry['inbox']) if entry.get('inbox') else None
+            if inbox is None:
+                if product == 'ABI-L1b-RadF' and band is not None and int(band) == 13:
+                    inbox = defaultInbox
+                else:
+                    inbox = os.path.join(defaultInbox, product + (f'-C{int(band):02d}' if band is not None else ''))
+            rules.append(DownloadRule(product, band, mode=entry.get('mode', data.get('scan_mode', 6)),
+                                      priority=entry.get('priority', 0), inbox=inbox,
+                                      publicationLag=entry.get('publication_lag', data.get('publication_lag')),
+                                      satellite=satellite))
+    return sorted(rules, key=lambda rule: rule.priority)
+
+
+class ListingCache:
+    """
+    Caché de listados remotos por directorio y prefijo.
+
+    Para cada prefijo recuerda la última clave vista y las claves ya ingresadas, de modo que cada
+    actualización solo le pide a S3 las claves posteriores (`StartAfter`). El filtro por banda o
+    producto se aplica una única vez, al ingresar las claves. Los prefijos se descartan de forma
+    explícita al completarse una hora, o automáticamente si no se consultan durante `maxAge` segundos.
+    """
+
+    def __init__(self, fs, keyFilter=None, maxAge=3 * 3600):
+        """
+        Args:
+            fs (s3fs.S3FileSystem): Sistema de archivos remoto.
+            keyFilter (callable, optional): Función que decide si una clave se conserva (por ejemplo, `DownloadRule.matches`).
+            maxAge (float, optional): Segundos sin consultas tras los que se descarta un prefijo.
+        """
+        self.fs = fs
+        self.keyFilter = keyFilter
+        self.maxAge = maxAge
+        self.requests = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def refresh(self, path, prefix=''):
+        """
+        Ingresa las claves publicadas desde la última actualización de un prefijo.
+
+        Args:
+            path (str): Directorio remoto.
+            prefix (str, optional): Prefijo del nombre de los archivos.
+
+        Returns:
+            list: Rutas nuevas que pasan el filtro, en orden lexicográfico.
+        """
+        listing = path + prefix
+        with self._lock:
+            entry = self._entries.get(listing)
+            start_after = entry['last'] if entry else None
+        keys = listNewKeys(self.fs, path, prefix, start_after)
+        new_keys = [key for key in keys if self.keyFilter is None or self.keyFilter(key)]
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            entry = self._entries.setdefault(listing, {'last': None, 'keys': [], 'used': now})
+            if keys and (entry['last'] is None or keys[-1] > entry['last']):
+                entry['last'] = keys[-1]
+            known = set(entry['keys'])
+            new_keys = [key for key in new_keys if key not in known]
+            entry['keys'].extend(new_keys)
+            entry['used'] = now
+            self._expireStale(now)
+        return new_keys
+
+    def keys(self, path, prefix=''):
+        """
+        Devuelve todas las claves ingresadas de un prefijo, sin consultar S3.
+
+        Args:
+            path (str): Directorio remoto.
+            prefix (str, optional): Prefijo del nombre de los archivos.
+
+        Returns:
+            list: Rutas ingresadas (vacía si el prefijo no está en caché).
+        """
+        with self._lock:
+            entry = self._entries.get(path + prefix)
+            return list(entry['keys']) if entry else []
+
+    def expire(self, path, prefix=''):
+        """
+        Descarta un prefijo, por ejemplo al completarse su hora.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries.pop(path + prefix, None)
+
+    def _expireStale(self, now):
+        """
+        Descarta los prefijos que no se consultan desde hace más de `maxAge` segundos (se llama con el lock tomado).
+
+        Returns:
+            None
+        """
+        if self.maxAge is None:
+            return
+        stale = [listing for listing, entry in self._entries.items() if now - entry['used'] > self.maxAge]
+        for listing in stale:
+            del self._entries[listing]
+
+
+class ScanPoller:
+    """
+    Sondeo del repositorio remoto guiado por el calendario de escaneos ABI.
+
+    Los escaneos de disco completo del modo 6 comienzan cada 10 minutos y se publican con un
+    retraso bastante estable. En lugar de listar la hora completa cada `timeout` segundos, el
+    sondeo calcula el próximo escaneo esperado, duerme hasta poco antes de su publicación
+    estimada y recién entonces consulta con un intervalo corto, pidiendo solo las claves
+    posteriores a la última vista. El retraso de publicación se aprende de las observaciones.
+    """
+
+    def __init__(self, fs, cadenceMinutes=10, publicationLag=600, pollInterval=5, margin=30, history=36, listing=None):
+        """
+        Args:
+            fs (s3fs.S3FileSystem): Sistema de archivos remoto.
+            cadenceMinutes (int, optional): Minutos entre escaneos.
+            publicationLag (float, optional): Retraso inicial entre el inicio del escaneo y su publicación, en segundos.
+            pollInterval (float, optional): Intervalo de sondeo una vez alcanzada la publicación estimada, en segundos.
+            margin (float, optional): Anticipación con la que se empieza a sondear, en segundos.
+            history (int, optional): Cantidad de retrasos observados que se recuerdan.
+            listing (ListingCache, optional): Caché de listados a usar; por defecto uno sin filtro.
+        """
+        self.fs = fs
+        self.listing = listing or ListingCache(fs)
+        self.cadenceMinutes = cadenceMinutes
+        self.publicationLag = publicationLag
+        self.pollInterval = pollInterval
+        self.margin = margin
+        self._lags = deque(maxlen=history)
+        self._lastPoll = {}
+        self._seen = {}
+
+    @property
+    def requests(self):
+        """Cantidad de consultas de listado realizadas."""
+        return self.listing.requests
+
+    def expectedLag(self):
+        """
+        Devuelve el retraso de publicación esperado.
+
+        Returns:
+            float: Primer cuartil de los retrasos observados, o el retraso inicial si todavía no hay observaciones.
+        """
+        if not self._lags:
+            return self.publicationLag
+        return sorted(self._lags)[len(self._lags) // 4]
+
+    def poll(self, path, prefix='', now=None):
+        """
+        Consulta las claves publicadas desde el último sondeo del mismo directorio y prefijo.
+
+        Args:
+            path (str): Directorio remoto.
+            prefix (str, optional): Prefijo del nombre de los archivos.
+            now (datetime.datetime, optional): Fecha y hora actual en UTC.
+
+        Returns:
+            list: Rutas de los archivos nuevos.
+        """
+        listing = path + prefix
+        now = now or utcNow()
+        previous = self._lastPoll.get(listing)
+        keys = self.listing.refresh(path, prefix)
+        self._lastPoll[listing] = now
+        seen = self._seen.setdefault(listing, set())
+        for key in keys:
+            scan_start = scanStartFromName(key)
+            if scan_start is None:
+                continue
+            seen.add(scanSlot(scan_start, self.cadenceMinutes))
+            # Solo se aprende de escaneos que aparecieron mientras se sondeaba el directorio
+            lag = (now - scan_start).total_seconds()
+            if previous is not None and (now - previous).total_seconds() <= self.expectedLag() and 0 < lag < 3 * self.cadenceMinutes * 60:
+                self._lags.append(lag)
+        return keys
+
+    def waitTime(self, path, prefix, hourStart, now=None):
+        """
+        Calcula cuánto esperar hasta el próximo sondeo útil de una hora.
+
+        Args:
+            path (str): Directorio remoto.
+            prefix (str): Prefijo del nombre de los archivos.
+            hourStart (datetime.datetime): Inicio de la hora que se está descargando.
+            now (datetime.datetime, optional): Fecha y hora actual en UTC.
+
+        Returns:
+            float o None: Segundos de espera, o None si ya no se espera ningún escaneo más para la hora
+            (los que faltan superaron su publicación estimada en más de un turno).
+        """
+        now = now or utcNow()
+        seen = self._seen.get(path + prefix, set())
+        lag = datetime.timedelta(seconds=self.expectedLag())
+        cadence = datetime.timedelta(minutes=self.cadenceMinutes)
+        pending = [slot for slot in (hourStart + k * cadence for k in range(60 // self.cadenceMinutes))
+                   if slot not in seen and slot + lag + cadence > now]
+        if not pending:
+            return None
+        wake = min(pending) + lag - datetime.timedelta(seconds=self.margin)
+        return max((wake - now).total_seconds(), self.pollInterval)
+
+    def forget(self, path, prefix=''):
+        """
+        Descarta el estado de un directorio y prefijo (por ejemplo, al completar una hora).
+
+        Returns:
+            None
+        """
+        listing = path + prefix
+        self.listing.expire(path, prefix)
+        self._lastPoll.pop(listing, None)
+        self._seen.pop(listing, None)
+
+
+def hourRange(startDatetime, endDatetime):
+    """
+    Enumera las horas de un rango de fechas, inclusive.
+
+    Args:
+        startDatetime (datetime.datetime): Fecha y hora de inicio.
+        endDatetime (datetime.datetime): Fecha y hora de fin.
+
+    Returns:
+        list: Inicio de cada hora del rango.
+    """
+    current = startDatetime.replace(minute=0, second=0, microsecond=0)
+    hours = []
+    while current <= endDatetime:
+        hours.append(current)
+        current += datetime.timedelta(hours=1)
+    return hours
+
+
+class BandwidthLimiter:
+    """
+    Límite global de ancho de banda compartido entre los hilos de descarga (balde de fichas).
+
+    Cada hilo descuenta los bytes que recibe; si el balde queda en negativo, duerme el tiempo
+    necesario para que la tasa promedio no supere el límite.
+    """
+
+    def __init__(self, bytesPerSecond, burst=None):
+        """
+        Args:
+            bytesPerSecond (float): Tasa máxima en bytes por segundo.
+            burst (float, optional): Bytes que pueden transferirse de golpe; por defecto, un segundo de tasa.
+        """
+        self.rate = float(bytesPerSecond)
+        self.capacity = float(burst or bytesPerSecond)
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes):
+        """
+        Descuenta bytes transferidos sin esperar (para usar desde código asíncrono).
+
+        Args:
+            nbytes (int): Bytes transferidos.
+
+        Returns:
+            float: Segundos que hay que esperar para respetar la tasa.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate) - nbytes
+            self._stamp = now
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def consume(self, nbytes):
+        """
+        Descuenta bytes transferidos y espera si se superó la tasa.
+
+        Args:
+            nbytes (int): Bytes transferidos.
+
+        Returns:
+            float: Segundos de espera.
+        """
+        wait = self.reserve(nbytes)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class ThroughputMeter:
+    """
+    Contador de archivos y bytes descargados para informar el rendimiento.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, nbytes):
+        """
+        Registra un archivo descargado.
+
+        Args:
+            nbytes (int): Tamaño del archivo en bytes.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.files += 1
+            self.bytes += nbytes
+
+    def rates(self):
+        """
+        Devuelve el rendimiento promedio desde la creación del contador.
+
+        Returns:
+            tuple: (archivos por segundo, MB por segundo).
+        """
+        elapsed = max(time.monotonic() - self._start, 1e-9)
+        with self._lock:
+            return self.files / elapsed, self.bytes / 2 ** 20 / elapsed
+
+    def summary(self):
+        """
+        Arma un resumen legible del rendimiento.
+
+        Returns:
+            str: Archivos, MB, tiempo transcurrido y tasas.
+        """
+        files_s, mb_s = self.rates()
+        return (f'{self.files} archivos, {self.bytes / 2 ** 20:.1f} MB en {time.monotonic() - self._start:.0f} s '
+                f'({files_s:.2f} archivos/s, {mb_s:.1f} MB/s)')
+
+class ResumableFile:
+    """
+    Archivo parcial reanudable para las descargas por rangos.
+
+    Los bytes se escriben en `<destino>.part` y el tamaño y el ETag del objeto remoto se guardan
+    en `<destino>.part.json`. Si la descarga se interrumpe, el siguiente intento continúa desde el
+    último byte escrito, siempre que el objeto remoto no haya cambiado. Al terminar se verifica el
+    tamaño y, si el ETag es el MD5 del objeto (subidas de una sola parte), también el contenido,
+    antes de renombrar el archivo a su destino.
+    """
+
+    def __init__(self, localFile, size, etag=None):
+        """
+        Args:
+            localFile (str): Ruta final del archivo.
+            size (int): Tamaño del objeto remoto en bytes.
+            etag (str, optional): ETag del objeto remoto.
+        """
+        self.localFile = localFile
+        self.partFile = localFile + '.part'
+        self.metaFile = self.partFile + '.json'
+        self.size = size
+        self.etag = etag.strip('"') if etag else None
+        # El ETag de una subida multiparte ('<md5>-<partes>') no es el MD5 del contenido
+        self._md5 = hashlib.md5() if self.etag and '-' not in self.etag else None
+        self.resumed = self._resume()
+        self.offset = self.resumed
+        self._fp = open(self.partFile, 'r+b' if self.offset else 'wb')
+        self._fp.seek(self.offset)
+        self._fp.truncate()
+
+    def _resume(self):
+        """
+        Busca un archivo parcial del mismo objeto y devuelve desde qué byte continuar.
+
+        Returns:
+            int: Bytes ya descargados (0 si no hay un parcial válido).
+        """
+        meta = {'size': self.size, 'etag': self.etag}
+        if os.path.exists(self.partFile) and os.path.exists(self.metaFile):
+            try:
+                previous = readJson(self.metaFile)
+            except (OSError, ValueError):
+                previous = None
+            if previous == meta:
+                offset = min(os.path.getsize(self.partFile), self.size)
+                if self._md5 is not None:
+                    with open(self.partFile, 'rb') as fp:
+                        remaining = offset
+                        while remaining:
+                            block = fp.read(min(remaining, 2 ** 23))
+                            self._md5.update(block)
+                            remaining -= len(block)
+                return offset
+        writeJson(self.metaFile, meta)
+        return 0
+
+    def write(self, chunk):
+        """
+        Agrega un bloque recibido.
+
+        Args:
+            chunk (bytes): Bytes del rango siguiente.
+
+        Returns:
+            None
+        """
+        self._fp.write(chunk)
+        if self._md5 is not None:
+            self._md5.update(chunk)
+        self.offset += len(chunk)
+
+    def close(self):
+        """
+        Cierra el archivo parcial, conservándolo para reanudar.
+
+        Returns:
+            None
+        """
+        if not self._fp.closed:
+            self._fp.close()
+
+    def commit(self):
+        """
+        Verifica tamaño y checksum y mueve el archivo parcial a su destino.
+
+        Returns:
+            None
+
+        Raises:
+            IOError: Si el tamaño o el checksum no coinciden; el parcial se descarta.
+        """
+        self.close()
+        error = None
+        if self.offset != self.size or os.path.getsize(self.partFile) != self.size:
+            error = f'tamaño {os.path.getsize(self.partFile)} distinto del remoto {self.size}'
+        elif self._md5 is not None and self._md5.hexdigest() != self.etag:
+            error = f'MD5 {self._md5.hexdigest()} distinto del ETag {self.etag}'
+        if error:
+            self.discard()
+            raise IOError(f'Descarga corrupta de {os.path.basename(self.localFile)}: {error}')
+        os.replace(self.partFile, self.localFile)
+        os.remove(self.metaFile)
+
+    def discard(self):
+        """
+        Elimina el archivo parcial y sus metadatos.
+
+        Returns:
+            None
+        """
+        self.close()
+        for path in (self.partFile, self.metaFile):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def downloadThrottled(fs, remoteFile, localFile, limiter=None, chunkSize=2 ** 23):
+    """
+    Descarga un archivo remoto por rangos, reanudable y verificado, respetando un límite de ancho de banda.
+
+    Args:
+        fs (fsspec.AbstractFileSystem): Sistema de archivos remoto.
+        remoteFile (str): La ruta del archivo remoto.
+        localFile (str): La ruta local donde se escribe.
+        limiter (BandwidthLimiter, optional): Límite compartido de ancho de banda.
+        chunkSize (int, optional): Tamaño de cada rango en bytes.
+
+    Returns:
+        int: Bytes transferidos en este intento (sin contar los reanudados).
+
+    Raises:
+        IOError: Si la descarga se corta o no pasa la verificación de tamaño y checksum.
+    """
+    info = fs.info(remoteFile)
+    with ResumableFile(localFile, info['size'], info.get('ETag')) as part:
+        while part.offset < part.size:
+            chunk = fs.cat_file(remoteFile, start=part.offset, end=min(part.offset + chunkSize, part.size))
+            if not chunk:
+                raise IOError(f'Descarga interrumpida en el byte {part.offset} de {part.size}: {remoteFile}')
+            if limiter is not None:
+                limiter.consume(len(chunk))
+            part.write(chunk)
+    part.commit()
+    return part.size - part.resumed
+
+def _isNetCDFMagic(magic):
+    """
+    Indica si los primeros bytes corresponden a un archivo HDF5 (NetCDF4) o NetCDF clásico.
+
+    Args:
+        magic (bytes): Los primeros 8 bytes del archivo.
+
+    Returns:
+        bool: True si la firma es de un NetCDF.
+    """
+    return magic == b'\x89HDF\r\n\x1a\n' or magic[:3] == b'CDF'
+
+def validateNetCDF(filepath, variables=('Rad',)):
+    """
+    Verifica que un archivo sea un NetCDF legible con las variables esperadas.
+
+    Args:
+        filepath (str): Ruta del archivo.
+        variables (tuple, optional): Variables que deben existir.
+
+    Returns:
+        bool: True si la cabecera se abre y contiene las variables.
+    """
+    with open(filepath, 'rb') as fp:
+        magic = fp.read(8)
+    if not _isNetCDFMagic(magic):
+        return False
+    from netCDF4 import Dataset
+    try:
+        with Dataset(filepath, 'r') as nc:
+            return all(name in nc.variables for name in variables)
+    except OSError:
+        return False
+
+def validateNetCDFBytes(content, variables=('Rad',)):
+    """
+    Igual que `validateNetCDF`, para un NetCDF descargado a memoria.
+
+    Args:
+        content (bytes): Contenido del archivo.
+        variables (tuple, optional): Variables que deben existir.
+
+    Returns:
+        bool: True si la cabecera se abre y contiene las variables.
+    """
+    if not _isNetCDFMagic(bytes(content[:8])):
+        return False
+    from netCDF4 import Dataset
+    try:
+        with Dataset('validacion.nc', 'r', memory=content) as nc:
+            return all(name in nc.variables for name in variables)
+    except OSError:
+        return False
+
+def moveAtomic(src, dst):
+    """
+    Mueve un archivo de forma que en el destino nunca aparezca a medio copiar.
+
+    Args:
+        src (str): Ruta de origen.
+        dst (str): Ruta de destino.
+
+    Returns:
+        None
+    """
+    try:
+        os.replace(src, dst)
+    except OSError:
+        # Distinto sistema de archivos: se copia a un temporal junto al destino y se renombra
+        tmp = dst + '.part'
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+        os.remove(src)
+
+class AsyncDownloader:
+    """
+    Motor de descarga asíncrono sobre s3fs, con una única sesión HTTP para toda la vida del proceso.
+
+    Un event loop corre en un hilo propio y mantiene el pool de conexiones de s3fs/aiobotocore.
+    Los hilos de descarga llaman a `download`, que agenda la corrutina en ese loop y espera su
+    resultado. Un semáforo acota las transferencias simultáneas y cada objeto se pide por rangos
+    de `chunkSize` bytes que se escriben en disco a medida que llegan.
+    """
+
+    def __init__(self, fs=None, concurrency=8, chunkSize=2 ** 23, limiter=None):
+        """
+        Args:
+            fs (s3fs.S3FileSystem, optional): Sistema de archivos asíncrono; por defecto uno anónimo creado en el loop del motor.
+            concurrency (int, optional): Cantidad máxima de transferencias simultáneas.
+            chunkSize (int, optional): Tamaño de cada rango pedido, en bytes.
+            limiter (BandwidthLimiter, optional): Límite global de ancho de banda.
+        """
+        self.fs = fs
+        self.concurrency = max(int(concurrency), 1)
+        self.chunkSize = chunkSize
+        self.limiter = limiter
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='s3-async', daemon=True)
+        self._thread.start()
+        self._session = self._run(self._open())
+
+    def _run(self, coroutine):
+        """
+        Ejecuta una corrutina en el loop del motor y espera su resultado.
+
+        Returns:
+            El resultado de la corrutina.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _open(self):
+        """
+        Crea el semáforo y la sesión de s3fs dentro del loop del motor.
+
+        Returns:
+            El cliente de aiobotocore de la sesión.
+        """
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        if self.fs is None:
+            import s3fs
+            self.fs = s3fs.S3FileSystem(anon=True, asynchronous=True, loop=asyncio.get_running_loop())
+        return await self.fs.set_session()
+
+    def download(self, remoteFile, localFile):
+        """
+        Descarga un archivo remoto a disco por bloques.
+
+        Args:
+            remoteFile (str): La ruta del archivo remoto.
+            localFile (str): La ruta local donde se escribe.
+
+        Returns:
+            dict: Tiempos de la descarga: 'bytes' transferidos, 'resumed' (bytes reanudados de un intento anterior),
+            'seconds', 'first_byte' (segundos hasta el primer bloque) y 'mb_s'.
+
+        Raises:
+            IOError: Si la descarga se corta o no pasa la verificación de tamaño y checksum.
+        """
+        return self._run(self._download(remoteFile, localFile))
+
+    async def _download(self, remoteFile, localFile):
+        """
+        Corrutina de `download`.
+
+        Returns:
+            dict: Tiempos de la descarga.
+        """
+        async with self._semaphore:
+            start = time.monotonic()
+            info = await self.fs._info(remoteFile)
+            first_byte = None
+            with ResumableFile(localFile, info['size'], info.get('ETag')) as part:
+                while part.offset < part.size:
+                    chunk = await self.fs._cat_file(remoteFile, start=part.offset, end=min(part.offset + self.chunkSize, part.size))
+                    if not chunk:
+                        raise IOError(f'Descarga interrumpida en el byte {part.offset} de {part.size}: {remoteFile}')
+                    if first_byte is None:
+                        first_byte = time.monotonic() - start
+                    if self.limiter is not None:
+                        await asyncio.sleep(self.limiter.reserve(len(chunk)))
+                    part.write(chunk)
+            part.commit()
+            elapsed = time.monotonic() - start
+            transferred = part.size - part.resumed
+            return {'bytes': transferred, 'resumed': part.resumed, 'seconds': elapsed, 'first_byte': first_byte or 0.0,
+                    'mb_s': transferred / 2 ** 20 / max(elapsed, 1e-9)}
+
+    def close(self):
+        """
+        Cierra la sesión HTTP y detiene el loop del motor.
+
+        Returns:
+            None
+        """
+        if not self._loop.is_running():
+            return
+        if hasattr(self._session, '__aexit__'):
+            try:
+                self._run(self._session.__aexit__(None, None, None))
+            except Exception as e:
+                logging.warning(f'No se pudo cerrar la sesión de S3: {e}')
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+def _navigation():
+    """
+    Importa la navegación de la grilla fija del procesador (`Procesador/src/navigation.py`).
+
+    El recorte remoto usa la misma implementación que la ventana del procesador, para que ambas
+    etapas calculen exactamente los mismos índices, y las reglas de descarga usan su tabla de
+    satélites (`SATELLITES`).
+
+    Returns:
+        module: El módulo `src.navigation`.
+    """
+    if PROCESADOR_DIR not in sys.path:
+        sys.path.insert(0, PROCESADOR_DIR)
+    from src import navigation
+    return navigation
+
+def _attrValue(value):
+    """
+    Normaliza un atributo leído con h5py para poder escribirlo con netCDF4.
+
+    Args:
+        value: Valor del atributo HDF5.
+
+    Returns:
+        El valor con las cadenas de bytes decodificadas.
+    """
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if isinstance(value, np.ndarray) and value.dtype.kind in ('S', 'O'):
+        return ','.join(v.decode('utf-8') if isinstance(v, bytes) else str(v) for v in value.ravel())
+    return value
+
+def _copyAttrs(h5obj, ncobj):
+    """
+    Copia los atributos de un objeto HDF5 a un objeto netCDF4, omitiendo los internos.
+
+    Args:
+        h5obj: Grupo o dataset de h5py.
+        ncobj: Dataset o variable de netCDF4.
+
+    Returns:
+        None
+    """
+    for name, value in h5obj.attrs.items():
+        if name not in HDF5_INTERNAL_ATTRS:
+            ncobj.setncattr(name, _attrValue(value))
+
+def _scaledCoordinate(dataset):
+    """
+    Lee una variable de coordenadas (x o y) aplicando scale_factor y add_offset.
+
+    Args:
+        dataset (h5py.Dataset): Dataset de coordenadas.
+
+    Returns:
+        ndarray: Coordenadas en radianes.
+    """
+    raw = dataset[:].astype(np.float64)
+    scale = float(np.ravel(dataset.attrs.get('scale_factor', 1.0))[0])
+    offset = float(np.ravel(dataset.attrs.get('add_offset', 0.0))[0])
+    return raw * scale + offset
+
+def _nativeDtype(dtype):
+    """
+    Devuelve el dtype con el orden de bytes nativo, como lo espera netCDF4 al crear variables.
+
+    Args:
+        dtype (numpy.dtype): Tipo de dato leído con h5py.
+
+    Returns:
+        numpy.dtype: Tipo de dato con orden de bytes nativo.
+    """
+    return dtype.newbyteorder('=')
+
+def _writeCrop(h5, nc, extent, margin):
+    """
+    Copia a un Dataset netCDF4 la ventana de un archivo ABI-L1b abierto con h5py.
+
+    Args:
+        h5 (h5py.File): Archivo de origen.
+        nc (Dataset): Dataset de destino, abierto en modo escritura.
+        extent (list): [lon_W, lon_E, lat_S, lat_N] en grados.
+        margin (int): Píxeles extra a agregar en cada borde del recorte.
+
+    Returns:
+        tuple: (row0, row1, col0, col1) de la ventana recortada dentro del disco completo.
+
+    Raises:
+        ValueError: Si el archivo no tiene la variable `Rad` (productos que no son ABI-L1b).
+    """
+    if 'Rad' not in h5:
+        raise ValueError('El recorte solo admite archivos ABI-L1b con la variable Rad')
+    projection = {k: _attrValue(v) for k, v in h5['goes_imager_projection'].attrs.items()}
+    projection = {k: np.ravel(v)[0] if isinstance(v, np.ndarray) else v for k, v in projection.items()}
+    x = _scaledCoordinate(h5['x'])
+    y = _scaledCoordinate(h5['y'])
+    row0, row1, col0, col1 = _navigation().GetScanWindow(extent, projection, x, y, margin)
+
+    _copyAttrs(h5, nc)
+    nc.setncattr('crop_offset_x', col0)
+    nc.setncattr('crop_offset_y', row0)
+    nc.createDimension('y', row1 - row0)
+    nc.createDimension('x', col1 - col0)
+
+    for name, window in [('y', slice(row0, row1)), ('x', slice(col0, col1))]:
+        var = nc.createVariable(name, _nativeDtype(h5[name].dtype), (name,))
+        var.set_auto_maskandscale(False)
+        _copyAttrs(h5[name], var)
+        var[:] = h5[name][window]
+
+    rad = h5['Rad']
+    var = nc.createVariable('Rad', _nativeDtype(rad.dtype), ('y', 'x'), zlib=True, complevel=1, shuffle=True,
+                            fill_value=rad.attrs.get('_FillValue', [None])[0])
+    var.set_auto_maskandscale(False)
+    _copyAttrs(rad, var)
+    var[:] = rad[row0:row1, col0:col1]
+
+    for name in CROP_AUX_VARIABLES:
+        if name not in h5:
+            continue
+        ds = h5[name]
+        dims = ()
+        if ds.ndim == 1:
+            try:
+                dim_name = ds.dims[0][0].name.lstrip('/')
+            except (IndexError, RuntimeError):
+                dim_name = name + '_dim'
+            if dim_name not in nc.dimensions:
+                nc.createDimension(dim_name, ds.shape[0])
+            dims = (dim_name,)
+        fill_value = ds.attrs['_FillValue'][0] if '_FillValue' in ds.attrs else None
+        var = nc.createVariable(name, _nativeDtype(ds.dtype), dims, fill_value=fill_value)
+        var.set_auto_maskandscale(False)
+        _copyAttrs(ds, var)
+        var[...] = ds[()]
+
+    return row0, row1, col0, col1
+
+def cropRemoteFile(fs, remote_file, local_file, extent, margin=16, block_size=2 ** 18):
+    """
+    Descarga únicamente la región de interés de un archivo ABI-L1b remoto.
+
+    El objeto remoto se abre a través de fsspec/s3fs con lecturas por rangos de bytes, por lo que
+    h5py solo transfiere los chunks de `Rad` que intersectan la ventana, más las variables de
+    calibración y proyección. El resultado es un NetCDF compacto con los mismos nombres de
+    variables y atributos que el original, y los atributos globales `crop_offset_x` y
+    `crop_offset_y` con la posición del recorte dentro del disco completo.
+
+    Args:
+        fs (fsspec.AbstractFileSystem): Sistema de archivos remoto (por ejemplo s3fs.S3FileSystem).
+        remote_file (str): La ruta del archivo remoto.
+        local_file (str): La ruta del NetCDF recortado a escribir.
+        extent (list): [lon_W, lon_E, lat_S, lat_N] en grados.
+        margin (int, optional): Píxeles extra a agregar en cada borde del recorte.
+        block_size (int, optional): Tamaño de bloque de las lecturas por rango, en bytes.
+
+    Returns:
+        tuple: (row0, row1, col0, col1) de la ventana recortada dentro del disco completo.
+    """
+    # h5py y netCDF4 solo se necesitan en el modo 'crop': se importan al usarlos
+    import h5py
+    from netCDF4 import Dataset
+    with fs.open(remote_file, 'rb', block_size=block_size, cache_type='blockcache') as fobj, \
+            h5py.File(fobj, 'r') as h5, Dataset(local_file, 'w', format='NETCDF4') as nc:
+        return _writeCrop(h5, nc, extent, margin)
+
+def cropRemoteBytes(fs, remote_file, extent, margin=16, block_size=2 ** 18):
+    """
+    Igual que `cropRemoteFile`, pero arma el NetCDF recortado en memoria.
+
+    Args:
+        fs (fsspec.AbstractFileSystem): Sistema de archivos remoto.
+        remote_file (str): La ruta del archivo remoto.
+        extent (list): [lon_W, lon_E, lat_S, lat_N] en grados.
+        margin (int, optional): Píxeles extra a agregar en cada borde del recorte.
+        block_size (int, optional): Tamaño de bloque de las lecturas por rango, en bytes.
+
+    Returns:
+        tuple: El contenido del NetCDF recortado (bytes) y la ventana (row0, row1, col0, col1).
+    """
+    import h5py
+    from netCDF4 import Dataset
+    with fs.open(remote_file, 'rb', block_size=block_size, cache_type='blockcache') as fobj, \
+            h5py.File(fobj, 'r') as h5:
+        nc = Dataset(remote_file.split('/')[-1], 'w', format='NETCDF4', memory=2 ** 20)
+        try:
+            window = _writeCrop(h5, nc, extent, margin)
+        finally:
+            memory = nc.close()
+    return bytes(memory), window
@@ -1,67 +1,81 @@
-import subprocess
-import concurrent.futures 
-import time
+import logging
+import os
+import queue
+import sys
+import threading
 
-# Función para ejecutar el script de descarga
-def ejecutar_descarga():
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+def cargar_etapas():
     """
-    Ejecuta el script de descarga 'goes16Download.py' utilizando subprocess.
-    
-    Si ocurre un error durante la ejecución, se imprime un mensaje de error.
+    Importa el descargador y el procesador en este mismo intérprete.
+
+    El procesador se importa con su nombre de módulo (`main`) para que los procesos del pool
+    (contexto `spawn`) puedan volver a importarlo.
 
     Returns:
-        None
+        tuple: Los módulos del descargador y del procesador.
     """
-    try:
-        subprocess.run(['python', 'descarga/goes16Download.py'], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error durante la descarga: {e}")
+    sys.path.insert(0, os.path.join(base_dir, 'Procesador'))
+    sys.path.insert(0, os.path.join(base_dir, 'descarga'))
+    import goes16Download as descarga
+    import main as procesador
+    return descarga, procesador
 
-# Función para ejecutar el script de procesamiento
-def ejecutar_procesamiento():
+def supervisar(nombre, etapa, stop_event, reiniciar_al_terminar=True, espera=60):
     """
-    Ejecuta el script de procesamiento 'main.py' en un bucle continuo, esperando 60 segundos entre cada ejecución.
-    
-    Si ocurre un error durante la ejecución, se imprime un mensaje de error.
+    Ejecuta una etapa y la reinicia si falla, sin reiniciar el intérprete ni perder los cachés.
+
+    Args:
+        nombre (str): Nombre de la etapa para los mensajes.
+        etapa (callable): Función que ejecuta la etapa.
+        stop_event (threading.Event): Evento para detener la supervisión.
+        reiniciar_al_terminar (bool, optional): Si es False, una etapa que termina sin errores no se reinicia.
+        espera (float, optional): Segundos de espera antes de reiniciar.
 
     Returns:
         None
     """
-    while True:  # Bucle continuo
+    while not stop_event.is_set():
         try:
-            subprocess.run(['python', 'Procesador/main.py'], check=True)
-            time.sleep(60)  # Espera de 60 segundos antes de la siguiente ejecución
-        except subprocess.CalledProcessError as e:
-            print(f"Error durante el procesamiento: {e}")
+            etapa()
+            if not reiniciar_al_terminar:
+                logging.info(f"La etapa de {nombre} finalizó.")
+                return
+            if stop_event.is_set():
+                return
+            logging.warning(f"La etapa de {nombre} terminó, se reinicia en {espera} segundos.")
+        except Exception:
+            logging.exception(f"Error durante la etapa de {nombre}, se reinicia en {espera} segundos.")
+        stop_event.wait(espera)
 
 if __name__ == "__main__":
     """
-    Punto de entrada principal del script. Ejecuta la descarga y el procesamiento de imágenes concurrentemente.
-    
-    Utiliza ThreadPoolExecutor para ejecutar ambas funciones en paralelo.
-    """
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        # Ejecutar la descarga y el procesamiento concurrentemente
-        future_descarga = executor.submit(ejecutar_descarga)
-        future_procesamiento = executor.submit(ejecutar_procesamiento)
-
-        # Esperar a que ambas tareas se completen
-        concurrent.futures.wait([future_descarga, future_procesamiento])
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    Punto de entrada principal del script. Ejecuta la descarga y el procesamiento de imágenes concurrentemente,
+    en un único proceso de larga duración.
 
+    Cada etapa corre en un hilo supervisado que la reinicia ante un error. El descargador entrega
+    la ruta de cada archivo nuevo al procesador a través de una cola, en lugar de que el
+    procesador vigile el directorio de entrada.
+    """
+    descarga, procesador = cargar_etapas()
+    stop_event = threading.Event()
+    hand_off = queue.Queue(maxsize=procesador.configurar().get('processing_queue_size', 64))
+
+    hilo_procesamiento = threading.Thread(target=supervisar, name='procesamiento',
+                                          args=('procesamiento', lambda: procesador.run(hand_off, stop_event), stop_event))
+    hilo_descarga = threading.Thread(target=supervisar, name='descarga',
+                                     args=('descarga', lambda: descarga.run(hand_off, procesador, stop_event), stop_event, False))
+    hilo_procesamiento.start()
+    hilo_descarga.start()
+    try:
+        while hilo_procesamiento.is_alive():
+            hilo_procesamiento.join(1)
+    except KeyboardInterrupt:
+        logging.info("Deteniendo el orquestador.")
+        stop_event.set()
+        # Ambas etapas liberan sus recursos (pools, registro, log) antes de terminar
+        hilo_descarga.join()
+        hilo_procesamiento.join()
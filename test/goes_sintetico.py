@@ -0,0 +1,73 @@
+import subprocess
+import sys
+import numpy as np
+from netCDF4 import Dataset
+
+
+def crear_archivo_goes(path, n=543, band=13, shuffle=False):
+    """
+    Crea un archivo NetCDF sintético con la estructura de un ABI-L1b-RadF de GOES-16.
+
+    La grilla fija cubre el disco completo con `n` x `n` píxeles, por lo que el tamaño
+    por defecto equivale a una resolución de 20 km en el nadir.
+
+    Args:
+        path (str): Ruta del archivo a crear.
+        n (int, optional): Cantidad de filas y columnas del disco completo.
+        band (int, optional): Número de banda a declarar en `band_id`.
+        shuffle (bool, optional): Si es True `Rad` se comprime con el filtro shuffle, como en los archivos de NOAA.
+
+    Returns:
+        str: La ruta del archivo creado.
+    """
+    nc = Dataset(path, 'w', format='NETCDF4')
+    nc.spatial_resolution = f'{int(round(10848 / n))}km at nadir'
+    nc.platform_ID = 'G16'
+    nc.time_coverage_start = '2024-11-26T23:00:20.7Z'
+    nc.createDimension('y', n)
+    nc.createDimension('x', n)
+    nc.createDimension('band', 1)
+
+    half = 0.151844
+    step = 2 * half / n
+    for name, scale, offset in [('x', step, -half + step / 2), ('y', -step, half - step / 2)]:
+        var = nc.createVariable(name, 'i2', (name,))
+        var.set_auto_maskandscale(False)
+        var.scale_factor = np.float32(scale)
+        var.add_offset = np.float32(offset)
+        var[:] = np.arange(n, dtype='i2')
+
+    rad = nc.createVariable('Rad', 'i2', ('y', 'x'), zlib=True, shuffle=shuffle, chunksizes=(64, 64), fill_value=np.int16(4095))
+    rad.set_auto_maskandscale(False)
+    rad.scale_factor = np.float32(0.04)
+    rad.add_offset = np.float32(-1.6)
+    rad._Unsigned = 'true'
+    rad[:] = (np.arange(n * n) % 4000).reshape(n, n).astype('i2')
+
+    proj = nc.createVariable('goes_imager_projection', 'i4')
+    proj.grid_mapping_name = 'geostationary'
+    proj.semi_major_axis = 6378137.0
+    proj.semi_minor_axis = 6356752.31414
+    proj.perspective_point_height = 35786023.0
+    proj.longitude_of_projection_origin = -75.0
+    proj.sweep_angle_axis = 'x'
+
+    band_id = nc.createVariable('band_id', 'i1', ('band',))
+    band_id[:] = band
+    for name, value in [('planck_fk1', 10803.3), ('planck_fk2', 1392.74), ('planck_bc1', 0.0755), ('planck_bc2', 0.99975)]:
+        var = nc.createVariable(name, 'f4')
+        var.assignValue(value)
+    nc.close()
+    return path
+
+
+def medir_importacion(modulo, directorio):
+    """Importa un módulo en un intérprete nuevo con `-X importtime` y devuelve su tiempo total (s) y los módulos cargados."""
+    salida = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {modulo}'], cwd=directorio,
+                            capture_output=True, text=True, check=True).stderr
+    tiempos = {}
+    for linea in salida.splitlines():
+        if linea.startswith('import time:') and '|' in linea and 'cumulative' not in linea:
+            _, acumulado, nombre = linea.split('|')
+            tiempos[nombre.strip()] = int(acumulado) / 1e6
+    return tiempos[modulo], set(tiempos)
@@ -1,16 +1,89 @@
 import unittest
 from unittest.mock import patch, MagicMock
+from concurrent.futures import ThreadPoolExecutor
 import sys
 import os
 import shutil  # Importar shutil para eliminar carpetas y su contenido
+import asyncio
+import hashlib
+import sqlite3
+import logging
+import threading
+import queue
+import time
 import s3fs
+import fsspec
 import datetime
+import numpy as np
+from netCDF4 import Dataset
 
 # Asegurar que el proyecto raíz esté en el PYTHONPATH para importar módulos
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 # Importar los módulos necesarios
-from descarga.helpers import getRemotePath, writeJson, readJson
+from descarga.helpers import getRemotePath, writeJson, readJson, DownloadLedger, cropRemoteFile, cropRemoteBytes, ScanPoller, ListingCache, \
+    hourRange, BandwidthLimiter, ThroughputMeter, downloadThrottled, AsyncDownloader, \
+    validateNetCDF, DownloadRule, buildRules, createLogger, _navigation
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from goes_sintetico import crear_archivo_goes, medir_importacion
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'descarga')))
+import goes16Download as descarga
+
+
+class S3Simulado:
+    """Responde `list_objects_v2` sobre una lista de claves publicadas, con `Prefix`, `StartAfter` y paginación."""
+    def __init__(self, claves, pagina=2):
+        self.claves = claves
+        self.pagina = pagina
+
+    def call_s3(self, metodo, Bucket, Prefix, StartAfter='', ContinuationToken=None, **kwargs):
+        claves = sorted(k for k in self.claves if k.startswith(Prefix) and k > (ContinuationToken or StartAfter))
+        pagina = claves[:self.pagina]
+        respuesta = {'Contents': [{'Key': k} for k in pagina], 'IsTruncated': len(claves) > self.pagina}
+        if respuesta['IsTruncated']:
+            respuesta['NextContinuationToken'] = pagina[-1]
+        return respuesta
+
+
+class S3AsincronoSimulado:
+    """Sistema de archivos asíncrono en memoria con la interfaz de s3fs que usa `AsyncDownloader`."""
+    def __init__(self, objetos):
+        self.objetos = objetos
+        self.sesiones = 0
+        self.rangos = 0
+
+    async def set_session(self):
+        self.sesiones += 1
+        return None
+
+    async def _info(self, path):
+        return {'size': len(self.objetos[path])}
+
+    async def _cat_file(self, path, start=None, end=None):
+        self.rangos += 1
+        await asyncio.sleep(0)
+        return self.objetos[path][start:end]
+
+
+class FSConCortes:
+    """Envuelve un sistema de archivos local: agrega el ETag (MD5) y corta la conexión tras `cortar_en` rangos."""
+    def __init__(self, cortar_en=None, etag=None):
+        self.fs = fsspec.filesystem("file")
+        self.cortar_en = cortar_en
+        self.etag = etag
+        self.rangos = 0
+
+    def info(self, path):
+        info = dict(self.fs.info(path))
+        with open(path, "rb") as f:
+            info["ETag"] = '"%s"' % (self.etag or hashlib.md5(f.read()).hexdigest())
+        return info
+
+    def cat_file(self, path, start=None, end=None):
+        if self.cortar_en is not None and self.rangos >= self.cortar_en:
+            raise ConnectionError("Conexión interrumpida")
+        self.rangos += 1
+        return self.fs.cat_file(path, start=start, end=end)
 
 
 class TestDescarga(unittest.TestCase):
@@ -23,6 +96,7 @@ class TestDescarga(unittest.TestCase):
         cls.temp_path = "test_temp/"
         cls.final_path = "test_images/"
         cls.test_json = "test_db.json"
+        cls.test_ledger = "test_db.sqlite"
 
         # Crear carpetas necesarias
         os.makedirs(cls.temp_path, exist_ok=True)
@@ -38,6 +112,11 @@ class TestDescarga(unittest.TestCase):
             shutil.rmtree(cls.final_path)  # Elimina la carpeta y su contenido
         if os.path.exists(cls.test_json):
             os.remove(cls.test_json)  # Elimina el archivo JSON
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(cls.test_ledger + suffix):
+                os.remove(cls.test_ledger + suffix)
+        if os.path.exists(cls.test_json + '.migrated'):
+            os.remove(cls.test_json + '.migrated')
 
     def test_connection_s3(self):
         """Prueba de conexión al bucket S3."""
@@ -48,6 +127,428 @@ class TestDescarga(unittest.TestCase):
         except Exception as e:
             self.fail(f"\033[91m✗ Fallo al conectar con el repositorio S3: {str(e)}\033[0m")
 
+    def test_download_ledger(self):
+        """Prueba el registro de descargas y la migración desde el JSON."""
+        key = "noaa-goes16/ABI-L1b-RadF/2024/331/23/OR_ABI-L1b-RadF-M6C13_G16_s20243312300207.nc"
+        writeJson(self.test_json, {"2024": {"331": {"22": [f"k{i}" for i in range(6)], "23": [key]}}})
+
+        ledger = DownloadLedger(self.test_ledger)
+        self.assertEqual(ledger.migrateJson(self.test_json), 7)
+        self.assertFalse(os.path.exists(self.test_json))
+        self.assertTrue(ledger.isDownloaded(key))
+        self.assertFalse(ledger.add(key, "2024", "331", "23"))
+        self.assertEqual(ledger.countHour("2024", "331", "23"), 1)
+        self.assertEqual(ledger.getLastCompleteHour(6), datetime.datetime(2024, 11, 26, 22, 0))
+        ledger.close()
+
+        # Los registros persisten al reabrir la base de datos
+        ledger = DownloadLedger(self.test_ledger)
+        self.assertEqual(len(ledger), 7)
+        self.assertEqual(ledger.countHour("2024", "331", "22"), 6)
+        ledger.close()
+        print("\033[92m✓ Registro de descargas correcto\033[0m")
+
+    def test_crop_remote_file(self):
+        """Prueba la descarga de solo la región de interés mediante lecturas por rangos."""
+        full_file = crear_archivo_goes(os.path.join(self.temp_path, "full.nc"))
+        crop_file = os.path.join(self.final_path, "crop.nc")
+        row0, row1, col0, col1 = cropRemoteFile(fsspec.filesystem("file"), full_file, crop_file, [-74.0, -52.0, -56.0, -21.0])
+
+        with Dataset(full_file) as full, Dataset(crop_file) as crop:
+            self.assertEqual((crop.crop_offset_y, crop.crop_offset_x), (row0, col0))
+            self.assertEqual(crop["Rad"].shape, (row1 - row0, col1 - col0))
+            self.assertLess(crop["Rad"].size, full["Rad"].size / 10)
+            np.testing.assert_array_equal(crop["Rad"][:], full["Rad"][row0:row1, col0:col1])
+            np.testing.assert_allclose(crop["x"][:], full["x"][col0:col1])
+            self.assertEqual(int(crop["band_id"][0]), 13)
+            self.assertEqual(crop["goes_imager_projection"].perspective_point_height, 35786023.0)
+            # El recorte usa la misma navegación que el procesador: su ventana más el margen de 16 píxeles
+            _, indices = _navigation().ComputeCropWindow(full, -74.0, -52.0, -56.0, -21.0)
+            self.assertEqual(indices, [col0 + 16, col1 - 16, row0 + 16, row1 - 16])
+
+        # El mismo recorte armado en memoria se abre sin pasar por el disco
+        content, window = cropRemoteBytes(fsspec.filesystem("file"), full_file, [-74.0, -52.0, -56.0, -21.0])
+        self.assertEqual(window, (row0, row1, col0, col1))
+        with Dataset("crop.nc", memory=content) as crop:
+            self.assertEqual(crop["Rad"].shape, (row1 - row0, col1 - col0))
+        print("\033[92m✓ Recorte remoto correcto\033[0m")
+
+    def test_scan_poller(self):
+        """Prueba el sondeo incremental guiado por el calendario de escaneos."""
+        hora = datetime.datetime(2024, 11, 26, 23, 0)
+        ruta = "s3://noaa-goes16/ABI-L1b-RadF/2024/331/23/"
+        prefijo = "OR_ABI-L1b-RadF-M6C13_G16_s2024331"
+        clave = lambda minuto: f"ABI-L1b-RadF/2024/331/23/{prefijo}23{minuto:02d}20{minuto}_e.nc"
+        s3 = S3Simulado([clave(0), clave(10), clave(20), "ABI-L1b-RadF/2024/331/23/OR_ABI-L1b-RadF-M6C07_G16_s20243312300205_e.nc"])
+        poller = ScanPoller(s3, publicationLag=600, pollInterval=5, margin=30)
+
+        # Solo se listan las claves de la banda y, en el siguiente sondeo, solo las nuevas
+        nuevos = poller.poll(ruta, prefijo, now=hora + datetime.timedelta(minutes=30, seconds=40))
+        self.assertEqual(nuevos, ["noaa-goes16/" + clave(m) for m in (0, 10, 20)])
+        self.assertEqual(poller.poll(ruta, prefijo, now=hora + datetime.timedelta(minutes=30, seconds=45)), [])
+
+        # El escaneo de las 23:30 se espera a las 23:40 menos el margen
+        espera = poller.waitTime(ruta, prefijo, hora, now=hora + datetime.timedelta(minutes=30, seconds=45))
+        self.assertEqual(espera, 525)
+
+        # Aparece durante el sondeo corto: se aprende el retraso observado
+        s3.claves.append(clave(30))
+        self.assertEqual(poller.poll(ruta, prefijo, now=hora + datetime.timedelta(minutes=39, seconds=40)), ["noaa-goes16/" + clave(30)])
+        self.assertAlmostEqual(poller.expectedLag(), 560)
+
+        # Si los escaneos que faltan superaron su publicación estimada en más de un turno, no se espera más
+        self.assertIsNone(poller.waitTime(ruta, prefijo, hora, now=hora + datetime.timedelta(hours=1, minutes=20)))
+        self.assertEqual(poller.requests, 3)
+        print("\033[92m✓ Sondeo guiado por el calendario correcto\033[0m")
+
+    def test_listing_cache(self):
+        """Prueba el caché de listados: claves nuevas por prefijo, filtro por banda y vencimiento."""
+        ruta = "s3://noaa-goes16/ABI-L1b-RadF/2024/331/23/"
+        base = "ABI-L1b-RadF/2024/331/23/OR_ABI-L1b-RadF-M6C"
+        s3 = S3Simulado([base + "07_G16_s20243312300205_e.nc", base + "13_G16_s20243312300205_e.nc"])
+        cache = ListingCache(s3, keyFilter=DownloadRule("ABI-L1b-RadF", 13).matches)
+
+        self.assertEqual(cache.refresh(ruta, "OR_ABI"), ["noaa-goes16/" + base + "13_G16_s20243312300205_e.nc"])
+        s3.claves += [base + "07_G16_s20243312310205_e.nc", base + "13_G16_s20243312310205_e.nc"]
+        self.assertEqual(cache.refresh(ruta, "OR_ABI"), ["noaa-goes16/" + base + "13_G16_s20243312310205_e.nc"])
+        self.assertEqual(len(cache.keys(ruta, "OR_ABI")), 2)
+        self.assertEqual(cache.requests, 2)
+
+        # Al vencer el prefijo se vuelve a listar desde el principio
+        cache.expire(ruta, "OR_ABI")
+        self.assertEqual(cache.keys(ruta, "OR_ABI"), [])
+        self.assertEqual(len(cache.refresh(ruta, "OR_ABI")), 2)
+        print("\033[92m✓ Caché de listados correcto\033[0m")
+
+    def test_backfill_helpers(self):
+        """Prueba la enumeración de horas, el límite de ancho de banda y el contador de rendimiento."""
+        horas = hourRange(datetime.datetime(2024, 11, 30, 22, 15), datetime.datetime(2024, 12, 1, 1, 0))
+        self.assertEqual(horas[0], datetime.datetime(2024, 11, 30, 22, 0))
+        self.assertEqual(len(horas), 4)
+
+        # 3 MB a 2 MB/s con un balde de 1 MB: al menos un segundo de espera
+        origen = os.path.join(self.temp_path, "origen.bin")
+        with open(origen, "wb") as f:
+            f.write(os.urandom(3 * 2 ** 20))
+        limite = BandwidthLimiter(2 * 2 ** 20, burst=2 ** 20)
+        medidor = ThroughputMeter()
+        inicio = time.monotonic()
+        copiado = downloadThrottled(fsspec.filesystem("file"), origen, os.path.join(self.temp_path, "copia.bin"), limite, chunkSize=2 ** 19)
+        medidor.add(copiado)
+        self.assertGreaterEqual(time.monotonic() - inicio, 0.9)
+        self.assertEqual(copiado, 3 * 2 ** 20)
+        self.assertEqual(medidor.files, 1)
+        self.assertIn("MB/s", medidor.summary())
+        print("\033[92m✓ Herramientas de backfill correctas\033[0m")
+
+    def test_async_downloader(self):
+        """Prueba el motor asíncrono: una sesión para todas las descargas, bloques por rango y tiempos por archivo."""
+        objetos = {f"noaa-goes16/archivo_{i}.nc": os.urandom(2500 + i) for i in range(4)}
+        s3 = S3AsincronoSimulado(objetos)
+        motor = AsyncDownloader(fs=s3, concurrency=2, chunkSize=1000)
+        try:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                tiempos = list(executor.map(lambda remoto: motor.download(remoto, os.path.join(self.temp_path, remoto.split('/')[-1])), objetos))
+        finally:
+            motor.close()
+        for remoto, contenido in objetos.items():
+            with open(os.path.join(self.temp_path, remoto.split('/')[-1]), "rb") as f:
+                self.assertEqual(f.read(), contenido)
+        self.assertEqual([t["bytes"] for t in tiempos], [len(c) for c in objetos.values()])
+        self.assertEqual(s3.sesiones, 1)
+        self.assertEqual(s3.rangos, 12)
+        print("\033[92m✓ Motor de descarga asíncrono correcto\033[0m")
+
+    def test_resumable_download(self):
+        """Prueba la descarga reanudable: continúa desde el parcial, verifica el ETag y valida la cabecera NetCDF."""
+        remoto = crear_archivo_goes(os.path.join(self.temp_path, "remoto.nc"))
+        local = os.path.join(self.final_path, "local.nc")
+        bloque = 2 ** 14
+        total = os.path.getsize(remoto)
+
+        # Un corte a mitad de la descarga deja el parcial, y el siguiente intento solo pide lo que falta
+        with self.assertRaises(ConnectionError):
+            downloadThrottled(FSConCortes(cortar_en=3), remoto, local, chunkSize=bloque)
+        self.assertEqual(os.path.getsize(local + ".part"), 3 * bloque)
+        fs = FSConCortes()
+        transferido = downloadThrottled(fs, remoto, local, chunkSize=bloque)
+        self.assertEqual(transferido, total - 3 * bloque)
+        self.assertFalse(os.path.exists(local + ".part"))
+        with open(remoto, "rb") as a, open(local, "rb") as b:
+            self.assertEqual(a.read(), b.read())
+        self.assertTrue(validateNetCDF(local))
+
+        # Un ETag que no coincide descarta el parcial
+        with self.assertRaises(IOError):
+            downloadThrottled(FSConCortes(etag="0" * 32), remoto, local + "2", chunkSize=bloque)
+        self.assertFalse(os.path.exists(local + "2.part"))
+
+        # Un NetCDF truncado no pasa la validación
+        truncado = os.path.join(self.final_path, "truncado.nc")
+        with open(remoto, "rb") as a, open(truncado, "wb") as b:
+            b.write(a.read(total // 2))
+        self.assertFalse(validateNetCDF(truncado))
+        print("\033[92m✓ Descarga reanudable y verificada correcta\033[0m")
+
+    def test_download_rules(self):
+        """Prueba las reglas por producto, banda y satélite y el conteo por flujo del registro de descargas."""
+        reglas = buildRules({"products": [
+            {"product": "ABI-L1b-RadF", "bands": [13, 7], "priority": 0},
+            {"product": "ABI-L1b-RadM", "bands": [13], "priority": 2},
+            {"product": "ABI-L2-ACHAF", "priority": 1, "inbox": "acha"}]}, "/inbox", "/descarga")
+        self.assertEqual([r.streams for r in reglas], [["ABI-L1b-RadF-M6C13_G16"], ["ABI-L1b-RadF-M6C07_G16"], ["ABI-L2-ACHAF-M6_G16"],
+                                                        ["ABI-L1b-RadM1-M6C13_G16", "ABI-L1b-RadM2-M6C13_G16"]])
+        self.assertEqual([r.inbox for r in reglas], ["/inbox", "/inbox/ABI-L1b-RadF-C07", "/descarga/acha", "/inbox/ABI-L1b-RadM-C13"])
+        self.assertEqual([(r.filesPerHour, r.cadenceMinutes) for r in reglas], [(6, 10), (6, 10), (6, 10), (60, 1)])
+        self.assertEqual(reglas[0].prefix("ABI-L1b-RadF-M6C13_G16", "2024", "331", "23"), "OR_ABI-L1b-RadF-M6C13_G16_s202433123")
+        self.assertTrue(reglas[3].matches("OR_ABI-L1b-RadM2-M6C13_G16_s20243312301000_e.nc"))
+        self.assertFalse(reglas[0].matches("OR_ABI-L1b-RadF-M6C07_G16_s20243312300205_e.nc"))
+        with self.assertRaises(ValueError):
+            DownloadRule("ABI-L1b-RadC", 13, mode=4)
+
+        # GOES-Este y GOES-Oeste en la misma instalación: un flujo y un bucket por satélite
+        reglas = buildRules({"product": "ABI-L1b-RadF", "bands": [13], "satellites": ["G19", "G18"]}, "/inbox")
+        self.assertEqual([(r.bucket, r.inbox) for r in reglas], [("s3://noaa-goes19/", "/inbox"), ("s3://noaa-goes18/", "/inbox")])
+        self.assertTrue(reglas[0].matches("OR_ABI-L1b-RadF-M6C13_G19_s20251001200205_e.nc"))
+        self.assertFalse(reglas[0].matches("OR_ABI-L1b-RadF-M6C13_G18_s20251001200205_e.nc"))
+        with self.assertRaises(ValueError):
+            DownloadRule("ABI-L1b-RadF", 13, satellite="G15")
+
+        # Un registro anterior a la columna `stream` se migra a partir del nombre de los archivos
+        registro = os.path.join(self.temp_path, "registro_anterior.sqlite")
+        conn = sqlite3.connect(registro)
+        conn.execute("CREATE TABLE downloads (key TEXT PRIMARY KEY, year TEXT NOT NULL, day TEXT NOT NULL, "
+                     "hour TEXT NOT NULL, downloaded_at REAL NOT NULL)")
+        conn.execute("INSERT INTO downloads VALUES ('noaa-goes16/OR_ABI-L1b-RadF-M6C13_G16_s20243312300205_e.nc', '2024', '331', '23', 0)")
+        conn.commit()
+        conn.close()
+        ledger = DownloadLedger(registro)
+        ledger.add("noaa-goes16/OR_ABI-L1b-RadF-M6C07_G16_s20243312300205_e.nc", "2024", "331", "23")
+        self.assertEqual(ledger.countHour("2024", "331", "23", "ABI-L1b-RadF-M6C13_G16"), 1)
+        self.assertEqual(ledger.countHour("2024", "331", "23", "ABI-L1b-RadF-M6C07_G16"), 1)
+        self.assertEqual(ledger.countHour("2024", "331", "23", "ABI-L2-ACHAF-M6_G16"), 0)
+        self.assertIsNone(ledger.getLastCompleteHour(6, "ABI-L1b-RadF-M6C13_G16"))
+        ledger.close()
+        print("\033[92m✓ Reglas de descarga correctas\033[0m")
+
+    def test_revisit_hours(self):
+        """Prueba que una hora salteada con un escaneo demorado se vuelva a sondear con back-off hasta completarse."""
+        ruta = "ABI-L1b-RadF/2024/331/23/OR_ABI-L1b-RadF-M6C13_G16_s2024331"
+        clave = lambda minuto: f"{ruta}23{minuto:02d}205_e.nc"
+        s3 = S3Simulado([clave(m) for m in (0, 10, 20, 30, 40)])
+        regla = DownloadRule("ABI-L1b-RadF", 13)
+        ledger = DownloadLedger(os.path.join(self.temp_path, "revisit.sqlite"))
+        descargar = lambda f, temp, inbox, year, day, hour: ledger.add(f, year, day, hour)
+        with ThreadPoolExecutor(max_workers=1) as executor, \
+                patch.multiple(descarga, logger=MagicMock(), ledger=ledger, rules=[regla], download_file=descargar):
+            estado = descarga.hour_state(datetime.datetime(2024, 11, 26, 23, 0))
+            pollers = {id(regla): ScanPoller(s3)}
+            self.assertEqual(descarga.download_hour(estado, pollers, executor), 5)
+            pendientes = [dict(estado, passes=3, delay=60, due=0)]
+
+            # Sin novedades se duplica la espera; el escaneo demorado se descarga en la pasada siguiente
+            self.assertEqual(descarga.revisit_hours(pendientes, pollers, executor, now=10), 120)
+            s3.claves.append(clave(50))
+            self.assertEqual(descarga.revisit_hours(pendientes, pollers, executor, now=50), 80)
+            self.assertIsNone(descarga.revisit_hours(pendientes, pollers, executor, now=130))
+            self.assertEqual(pendientes, [])
+            self.assertEqual(ledger.countHour("2024", "331", "23"), 6)
+        ledger.close()
+        print("\033[92m✓ Nuevo sondeo de horas incompletas correcto\033[0m")
+
+    def test_download_retry(self):
+        """Prueba que un archivo ya listado cuya descarga falló se vuelva a pedir en el sondeo siguiente."""
+        clave = "ABI-L1b-RadF/2024/331/23/OR_ABI-L1b-RadF-M6C13_G16_s20243312300205_e.nc"
+        s3 = S3Simulado([clave])
+        regla = DownloadRule("ABI-L1b-RadF", 13)
+        ledger = DownloadLedger(os.path.join(self.temp_path, "retry.sqlite"))
+        intentos = []
+
+        def descargar(f, temp, inbox, year, day, hour):
+            intentos.append(f)
+            if len(intentos) == 1:
+                raise ConnectionError("Fallo de S3")
+            ledger.add(f, year, day, hour)
+
+        with ThreadPoolExecutor(max_workers=1) as executor, \
+                patch.multiple(descarga, logger=MagicMock(), ledger=ledger, rules=[regla], download_file=descargar):
+            estado = descarga.hour_state(datetime.datetime(2024, 11, 26, 23, 0))
+            pollers = {id(regla): ScanPoller(s3)}
+            self.assertEqual(descarga.download_hour(estado, pollers, executor), 1)
+            self.assertFalse(ledger.isDownloaded("noaa-goes16/" + clave))
+            self.assertEqual(descarga.download_hour(estado, pollers, executor), 1)
+            self.assertTrue(ledger.isDownloaded("noaa-goes16/" + clave))
+            self.assertEqual(descarga.download_hour(estado, pollers, executor), 0)
+        self.assertEqual(intentos, ["noaa-goes16/" + clave] * 2)
+        ledger.close()
+        print("\033[92m✓ Reintento de descargas fallidas correcto\033[0m")
+
+    def test_download_l2(self):
+        """Prueba que un producto de nivel 2 se valide sin `Rad`, se descargue completo y no se entregue al procesador."""
+        clave = "noaa-goes16/ABI-L2-ACHAF/2024/331/23/OR_ABI-L2-ACHAF-M6_G16_s20243312300205_e.nc"
+        reglas = buildRules({"products": [{"product": "ABI-L1b-RadF", "bands": [13]},
+                                          {"product": "ABI-L2-ACHAF", "inbox": "acha"}]}, self.final_path, self.temp_path)
+        self.assertEqual([r.variables for r in reglas], [("Rad",), ()])
+        ledger = DownloadLedger(os.path.join(self.temp_path, "l2.sqlite"))
+        entregas = queue.Queue()
+        os.makedirs(reglas[1].inbox, exist_ok=True)
+
+        def descargar(fs, f, local, limiter):
+            with Dataset(local, "w") as nc:
+                nc.createDimension("y", 4)
+                nc.createVariable("HT", "f4", ("y",))
+
+        with patch.multiple(descarga, logger=MagicMock(), ledger=ledger, rules=reglas, procesador=None, engine=None,
+                            limiter=None, meter=None, hand_off=entregas, download_mode="crop", image_path=self.final_path), \
+                patch.object(descarga.help, "downloadThrottled", side_effect=descargar), \
+                patch.object(descarga.help, "cropRemoteFile") as recortar:
+            descarga.download_file(clave, self.temp_path, reglas[1].inbox, "2024", "331", "23")
+        recortar.assert_not_called()
+        self.assertTrue(ledger.isDownloaded(clave))
+        self.assertTrue(os.path.exists(os.path.join(reglas[1].inbox, clave.split("/")[-1])))
+        self.assertTrue(entregas.empty())
+        ledger.close()
+        print("\033[92m✓ Descarga de productos de nivel 2 correcta\033[0m")
+
+    def test_backfill_retry(self):
+        """Prueba que el backfill vuelva a descargar los archivos que fallaron por un error transitorio."""
+        ruta = "ABI-L1b-RadF/2024/331/{hora}/OR_ABI-L1b-RadF-M6C13_G16_s2024331{hora}{minuto:02d}205_e.nc"
+        claves = [ruta.format(hora=h, minuto=m) for h in (22, 23) for m in range(0, 60, 10)]
+        s3 = S3Simulado(claves, pagina=4)
+        regla = DownloadRule("ABI-L1b-RadF", 13)
+        ledger = DownloadLedger(os.path.join(self.temp_path, "backfill.sqlite"))
+        intentos = []
+
+        def descargar(f, temp, inbox, year, day, hour):
+            intentos.append(f)
+            if f.endswith(claves[3]) and intentos.count(f) == 1:
+                raise ConnectionError("Fallo de S3")
+            ledger.add(f, year, day, hour)
+
+        with patch.multiple(descarga, logger=MagicMock(), ledger=ledger, rules=[regla], download_file=descargar, fs=s3,
+                            engine=None, limiter=None, meter=None, data={"backfill_workers": 2}):
+            faltantes = descarga.backfill(datetime.datetime(2024, 11, 26, 22, 0), datetime.datetime(2024, 11, 26, 23, 0))
+        self.assertEqual(faltantes, [])
+        self.assertEqual(len(ledger), 12)
+        self.assertEqual(len(intentos), 13)
+        ledger.close()
+
+        # Modo en memoria: los archivos se registran al procesarse y los que siguen en cola no se reintentan
+        ledger = DownloadLedger(os.path.join(self.temp_path, "backfill_stream.sqlite"))
+        intentos.clear()
+
+        def procesar(f, year, day, hour):
+            time.sleep(0.01)
+            ledger.add(f, year, day, hour)
+
+        with ThreadPoolExecutor(max_workers=1) as proceso:
+            with patch.multiple(descarga, logger=MagicMock(), ledger=ledger, rules=[regla], fs=s3, engine=None, limiter=None,
+                                meter=None, data={"backfill_workers": 2}, process_executor=proceso,
+                                download_file=lambda f, temp, inbox, year, day, hour: (intentos.append(f),
+                                                                                       proceso.submit(procesar, f, year, day, hour))):
+                faltantes = descarga.backfill(datetime.datetime(2024, 11, 26, 22, 0), datetime.datetime(2024, 11, 26, 23, 0))
+        self.assertEqual(faltantes, [])
+        self.assertEqual(len(ledger), 12)
+        self.assertEqual(len(intentos), 12)
+        ledger.close()
+        print("\033[92m✓ Reintentos del backfill correctos\033[0m")
+
+    def test_stream_file(self):
+        """Prueba el modo en memoria: el archivo se procesa fuera del hilo de descarga y se registra recién al terminar."""
+        clave = "noaa-goes16/ABI-L1b-RadF/2024/331/23/OR_ABI-L1b-RadF-M6C13_G16_s20243312300207_e.nc"
+        ledger = DownloadLedger(os.path.join(self.temp_path, "stream.sqlite"))
+        fs = MagicMock()
+        with open(crear_archivo_goes(os.path.join(self.temp_path, "stream.nc"), n=64), "rb") as fp:
+            fs.cat.return_value = fp.read()
+        hilos = []
+
+        def procesar_archivo(nombre, memory=None):
+            hilos.append(threading.current_thread().name)
+            if len(hilos) == 1:
+                raise RuntimeError("Fallo del procesador")
+            return True
+
+        procesador = MagicMock()
+        procesador.procesar_archivo.side_effect = procesar_archivo
+        with ThreadPoolExecutor(max_workers=1) as archivo, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix='procesador') as proceso, \
+                patch.multiple(descarga, logger=MagicMock(), ledger=ledger, fs=fs, procesador=procesador, meter=None,
+                               archive_executor=archivo, process_executor=proceso, download_mode='full', archive_path=self.temp_path,
+                               rules=[DownloadRule("ABI-L1b-RadF", 13)], stream_max_attempts=2):
+            # Un fallo del procesamiento deja el archivo fuera del registro y el siguiente intento lo registra
+            for registrado in (False, True):
+                descarga.stream_file(clave, clave.split('/')[-1], "2024", "331", "23")
+                proceso.submit(lambda: None).result()
+                self.assertEqual(ledger.isDownloaded(clave), registrado)
+            self.assertEqual(fs.cat.call_count, 2)
+            self.assertTrue(all(nombre.startswith('procesador') for nombre in hilos))
+
+            # Un archivo que el procesador siempre rechaza se abandona tras `stream_max_attempts` intentos
+            otra = clave.replace("s20243312300207", "s20243312310207")
+            procesador.procesar_archivo.side_effect = None
+            procesador.procesar_archivo.return_value = False
+            for registrado in (False, True):
+                descarga.stream_file(otra, otra.split('/')[-1], "2024", "331", "23")
+                proceso.submit(lambda: None).result()
+                self.assertEqual(ledger.isDownloaded(otra), registrado)
+
+            # Un buffer truncado no llega al procesador
+            fs.cat.return_value = fs.cat.return_value[:1000]
+            tercera = clave.replace("s20243312300207", "s20243312320207")
+            descarga.stream_file(tercera, tercera.split('/')[-1], "2024", "331", "23")
+            proceso.submit(lambda: None).result()
+        self.assertEqual(procesador.procesar_archivo.call_count, 4)
+        self.assertFalse(ledger.isDownloaded(tercera))
+        ledger.close()
+        print("\033[92m✓ Modo en memoria correcto\033[0m")
+
+    def test_run_libera_recursos(self):
+        """Prueba que un error del ciclo de descarga o la detención liberen el motor, el registro y el manejador del log."""
+        directorio = os.path.abspath(os.path.join(self.temp_path, "run", "descarga"))
+        os.makedirs(directorio, exist_ok=True)
+        writeJson(os.path.join(directorio, "setup.json"), {"db_path": "db/", "log_path": "log/", "timeout": 1, "dates": ["2024-11-26"],
+                                                            "product": "ABI-L1b-RadF", "bands": [13]})
+        motor = MagicMock()
+        with patch.multiple(descarga, main_path=directorio, setup_file=os.path.join(directorio, "setup.json"), data=None), \
+                patch.object(s3fs, "S3FileSystem"), patch.object(descarga.help, "AsyncDownloader", return_value=motor), \
+                patch.object(descarga.help, "ListingCache", side_effect=RuntimeError("Fallo del ciclo")):
+            for _ in range(2):
+                with self.assertRaises(RuntimeError):
+                    descarga.run()
+            self.assertEqual(motor.close.call_count, 2)
+            self.assertIsNone(descarga.ledger)
+            self.assertFalse([h for h in descarga.logger.handlers if isinstance(h, logging.FileHandler)])
+
+            # Detenido por el orquestador mientras espera reintentar la conexión: vuelve sin esperar y libera el log
+            detener = threading.Event()
+
+            def conectar(bucket):
+                detener.set()
+                raise ConnectionError("Sin conexión")
+
+            with patch.object(s3fs, "S3FileSystem", return_value=MagicMock(ls=conectar)):
+                inicio = time.monotonic()
+                descarga.run(stop_event=detener)
+            self.assertLess(time.monotonic() - inicio, 30)
+            self.assertFalse([h for h in descarga.logger.handlers if isinstance(h, logging.FileHandler)])
+
+        # Crear el logger dos veces no duplica el manejador del archivo
+        log_dir = os.path.join(directorio, "log") + "/"
+        logger, manejador = createLogger("prueba_logger", log_dir)
+        self.assertIs(createLogger("prueba_logger", log_dir)[1], manejador)
+        self.assertEqual(len(logger.handlers), 1)
+        logger.removeHandler(manejador)
+        manejador.close()
+        print("\033[92m✓ Liberación de recursos del descargador correcta\033[0m")
+
+    def test_importacion_rapida(self):
+        """Prueba que importar el descargador no lea setup.json, no cargue s3fs ni se conecte a S3."""
+        directorio = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'descarga'))
+        tiempo, modulos = medir_importacion('goes16Download', directorio)
+        self.assertFalse(modulos & {'s3fs', 'h5py', 'netCDF4', 'matplotlib'})
+        self.assertLess(tiempo, 1.5)
+        print(f"\033[92m✓ Importación del descargador en {tiempo:.2f} s\033[0m")
+
 
 if __name__ == "__main__":
     print("\nEjecutando pruebas para la lógica de descarga...\n")
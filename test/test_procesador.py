@@ -1,7 +1,54 @@
 import unittest
 import os
+import sys
 import shutil
 import glob
+import time
+from unittest.mock import patch
+from datetime import datetime
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import cartopy.crs as ccrs
+from PIL import Image
+from netCDF4 import Dataset
+
+# Asegurar que el procesador y los datos sintéticos estén en el PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Procesador')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from src import helpers as goeshelp
+from src import navigation
+from src import resample
+from src import basemap
+from src import render
+from src import calibration
+from src import animation
+from src import regions
+from src.archive import ScanArchive, OpenArchive
+from src.pool import ProcessingPool
+from src.processed import ProcessedIndex
+from goes_sintetico import crear_archivo_goes, medir_importacion
+
+
+# Configuración mínima de la figura, equivalente a la de SMN_dict.conf
+CONF_PRUEBA = {
+    'figure_length_inches': 6, 'figure_high_inches': 7, 'figure_resolution_dpi': 100,
+    'line_width_inches_for_coast': 0.3, 'line_width_inches_for_nation_limits': 0.3,
+    'line_width_inches_for_province_limits': 0.2,
+}
+
+
+
+def mapa_sin_shapefiles(confData, extent):
+    """Reemplaza a GetPlotObject sin depender de los shapefiles ni de Natural Earth."""
+    ax = plt.axes(projection=ccrs.PlateCarree())
+    ax.set_extent([extent[0], extent[1], extent[2] - 1.0, extent[3]], ccrs.PlateCarree())
+    ax.gridlines(xlocs=np.arange(-90.0, -35.0, 10), ylocs=np.arange(-55.5, -5.5, 10), linestyle='--',
+                 color='black', draw_labels=True, linewidth=0.3)
+    ax.plot([-70.0, -55.0], [-50.0, -25.0], transform=ccrs.PlateCarree(), color='black', linewidth=0.5)
+    return ax
 
 
 class TestProcesador(unittest.TestCase):
@@ -16,6 +63,10 @@ class TestProcesador(unittest.TestCase):
         os.makedirs(cls.test_workdir, exist_ok=True)
         os.makedirs(cls.test_inbox, exist_ok=True)
 
+        # Los cachés de navegación se escriben en el directorio de prueba
+        navigation.CACHE_DIR = os.path.join(cls.test_workdir, "cache")
+        cls.test_nc = crear_archivo_goes(os.path.join(cls.test_inbox, "OR_ABI-L1b-RadF-M6C13_G16_s20243312300207.nc"))
+
     @classmethod
     def tearDownClass(cls):
         """Limpieza después de las pruebas."""
@@ -72,6 +123,400 @@ class TestProcesador(unittest.TestCase):
         self.assertTrue(os.path.exists(self.test_gif_path), "No se generó el archivo GIF.")
         print("\033[92m✓ Actualización de GIF correcta\033[0m")
 
+    def test_get_cropped_image(self):
+        """Prueba la navegación analítica y el caché de ventanas de recorte."""
+        extent = (-74.0, -52.0, -56.0, -21.0)
+        with Dataset(self.test_nc) as nc:
+            img_extent, img_indexes = goeshelp.GetCroppedImage(nc, *extent)
+            min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx = img_indexes
+
+            # Todo el borde del extent cae dentro de la ventana recortada
+            lons = np.array([extent[0], extent[1], extent[0], extent[1]])
+            lats = np.array([extent[2], extent[2], extent[3], extent[3]])
+            sx, sy = navigation.LatLonToScanAngle(lats, lons, navigation.GetProjectionParameters(nc))
+            x = nc["x"][min_lon_idx:max_lon_idx]
+            y = nc["y"][min_lat_idx:max_lat_idx]
+            self.assertTrue(np.all((sx >= x.min()) & (sx <= x.max())))
+            self.assertTrue(np.all((sy >= y.min()) & (sy <= y.max())))
+            self.assertLess(img_extent[0], img_extent[1])
+            self.assertLess(img_extent[2], img_extent[3])
+
+            # La segunda vez se resuelve desde memoria y luego desde el caché en disco
+            self.assertEqual(goeshelp.GetCroppedImage(nc, *extent), (img_extent, img_indexes))
+            navigation._window_cache.clear()
+            navigation._disk_cache = None
+            self.assertEqual(goeshelp.GetCroppedImage(nc, *extent), (img_extent, img_indexes))
+        self.assertTrue(os.path.exists(os.path.join(navigation.CACHE_DIR, "navigation.json")))
+
+        # Un error de la navegación analítica no se oculta detrás de las grillas de referencia
+        with Dataset(self.test_nc) as nc, patch.object(navigation, "GetCropWindow", side_effect=AttributeError("error")):
+            self.assertTrue(navigation.HasProjectionParameters(nc))
+            with self.assertRaises(AttributeError):
+                goeshelp.GetCroppedImage(nc, *extent)
+        print("\033[92m✓ Navegación y recorte correctos\033[0m")
+
+    def test_reproject(self):
+        """Prueba la reproyección con el mapa de índices precalculado."""
+        extent = [-74.0, -52.0, -56.0, -21.0]
+        with Dataset(self.test_nc) as nc:
+            _, img_indexes = goeshelp.GetCroppedImage(nc, *extent)
+            min_lon_idx, max_lon_idx, min_lat_idx, max_lat_idx = img_indexes
+            index_map = resample.GetIndexMap(nc, img_indexes, extent, 0.5)
+            self.assertEqual(index_map.shape, resample.GetTargetGrid(extent, 0.5))
+            self.assertIs(resample.GetIndexMap(nc, img_indexes, extent, 0.5), index_map)
+
+            # Cada píxel de salida toma el valor del píxel de la grilla fija más cercano
+            rows, cols = np.indices((max_lat_idx - min_lat_idx, max_lon_idx - min_lon_idx))
+            image = (rows * 1000 + cols).astype(np.float64)
+            image_grid = resample.Reproject(image, index_map, np.nan)
+            lat, lon = -21.0 - 0.5 * 10.5, -74.0 + 0.5 * 3.5
+            sx, sy = navigation.LatLonToScanAngle(lat, lon, navigation.GetProjectionParameters(nc))
+            x = nc["x"][min_lon_idx:max_lon_idx]
+            y = nc["y"][min_lat_idx:max_lat_idx]
+            expected = np.abs(y - sy).argmin() * 1000 + np.abs(x - sx).argmin()
+            self.assertEqual(image_grid[10, 3], expected)
+            self.assertFalse(np.isnan(image_grid).all())
+        print("\033[92m✓ Reproyección por mapa de índices correcta\033[0m")
+
+    def test_regions(self):
+        """Prueba que cada región sea una vista del recorte de la unión, leído una única vez."""
+        conf = {'argentina_lon_W': -74.0, 'argentina_lon_E': -52.0, 'argentina_lat_S': -56.0, 'argentina_lat_N': -21.0,
+                'delta_lat_N_for_graph': 1.0,
+                'regions': [{'name': 'Argentina'}, {'name': 'Cordoba', 'extent': [-66.0, -61.0, -35.0, -29.0]}]}
+        regiones = regions.GetRegions(conf)
+        self.assertEqual([r['name'] for r in regiones], ['Argentina', 'Cordoba'])
+        self.assertEqual(regiones[0]['grid_extent'], [-74.0, -52.0, -56.0, -20.0])
+        union = regions.UnionExtent([r['grid_extent'] for r in regiones])
+        self.assertEqual(union, [-74.0, -52.0, -56.0, -20.0])
+
+        with Dataset(self.test_nc) as nc:
+            _, union_indexes = goeshelp.GetCroppedImage(nc, *union)
+            counts = calibration.ReadCounts(nc, union_indexes)
+            _, img_indexes = goeshelp.GetCroppedImage(nc, *regiones[1]['grid_extent'])
+            vista, indexes = regions.SliceWindow(counts, union_indexes, img_indexes)
+            self.assertEqual(indexes, img_indexes)
+            self.assertTrue(np.shares_memory(vista, counts))
+            np.testing.assert_array_equal(vista, calibration.ReadCounts(nc, img_indexes))
+        print("\033[92m✓ Regiones a partir de una única lectura correctas\033[0m")
+
+    def test_scan_archive(self):
+        """Prueba el archivo histórico en cubos diarios y su lectura como un único arreglo."""
+        directorio = os.path.join(self.test_workdir, "archivo")
+        x, y = np.linspace(-0.1, 0.1, 40), np.linspace(0.1, -0.1, 30)
+        proyeccion = {"semi_major_axis": 6378137.0, "perspective_point_height": 35786023.0}
+        temperatura = np.random.RandomState(2).uniform(-90, 30, (30, 40)).astype(np.float32)
+        temperatura[0, :5] = np.nan
+        clases = np.random.RandomState(3).randint(0, 4, (30, 40)).astype(np.uint8)
+
+        archivo = ScanArchive(directorio, chunk_time=2, chunk_space=16)
+        fechas = [datetime(2024, 11, 26, 23, 50), datetime(2024, 11, 27, 0, 0), datetime(2024, 11, 27, 0, 10)]
+        # Los escaneos llegan fuera de orden (pool de procesos, reprocesamiento) y se guardan en orden cronológico
+        for i in (2, 0, 1):
+            archivo.Append("G16", fechas[i], [10, 50, 20, 50], proyeccion, x, y, temperatura + i, clases + i)
+        # Un escaneo reprocesado reemplaza al archivado
+        archivo.Append("G16", fechas[1], [10, 50, 20, 50], proyeccion, x, y, temperatura - 1, clases)
+        # Si la ventana cambia a mitad del día, los escaneos siguientes van a un segundo cubo del mismo día
+        ruta = archivo.Append("G16", fechas[2], [0, 40, 20, 50], proyeccion, x, y, temperatura, clases)
+        self.assertEqual(os.path.basename(ruta), "IROL_G16_20241127_w0-40-20-50.nc")
+        archivo.Close()
+
+        with OpenArchive(directorio, "G16", window=[10, 50, 20, 50]) as ds:
+            self.assertEqual(ds["BT"].shape, (3, 30, 40))
+            self.assertTrue(np.all(np.diff(ds["time"][:]) > 0))
+            np.testing.assert_allclose(ds["BT"][2, 5:25, 10:30], temperatura[5:25, 10:30] + 2, atol=0.006)
+            np.testing.assert_array_equal(ds["class"][2], clases + 2)
+            bt = ds["BT"][:, 5:25, 10:30]
+            np.testing.assert_allclose(bt[1], temperatura[5:25, 10:30] - 1, atol=0.006)
+            self.assertTrue(np.ma.getmaskarray(ds["BT"][2, 0, :5]).all())
+            np.testing.assert_array_equal(ds["class"][0], clases)
+        with OpenArchive(directorio, "G16", start=datetime(2024, 11, 27, 12), window=[10, 50, 20, 50]) as ds:
+            self.assertEqual(len(ds["time"]), 2)
+        # Por defecto se abren los cubos con la ventana más reciente
+        with OpenArchive(directorio, "G16") as ds:
+            self.assertEqual(len(ds["time"]), 1)
+        print("\033[92m✓ Archivo histórico en cubos diarios correcto\033[0m")
+
+    def test_reprocesar(self):
+        """Prueba que el reprocesamiento omita los archivos con imágenes al día y arme la animación al final."""
+        import main
+        workdir = os.path.join(self.test_workdir, "reproceso")
+        os.makedirs(workdir, exist_ok=True)
+        conf = dict(CONF_PRUEBA, render_backend='numpy', processed_db='procesados.sqlite', animation_max_frames=4,
+                    regions=[{'name': 'Argentina', 'extent': [-76.0, -52.0, -56.0, -21.0]}])
+        with patch.multiple(main, confData=conf, workdir=workdir, inboxdir=self.test_inbox, animaciones={},
+                            gif_path=os.path.join(workdir, 'conae.gif'), json_file_path=self.test_nc), \
+                patch.object(basemap, 'GetPlotObject', mapa_sin_shapefiles):
+            archivos = main.buscar_archivos(desde=datetime(2024, 11, 26), hasta=datetime(2024, 11, 26, 23, 59))
+            self.assertEqual(archivos, [self.test_nc])
+            self.assertEqual(main.buscar_archivos(desde=datetime(2024, 11, 27)), [])
+            self.assertEqual(main.salidas_esperadas(self.test_nc),
+                             [os.path.join(workdir, 'CONAE_PRD_GOES16_ABI_IROL_20241126_230020700_gCArgentina_v001.png')])
+
+            self.assertEqual(main.reprocesar(archivos), {'procesados': 1, 'omitidos': 0, 'errores': 0})
+            self.assertTrue(main.esta_al_dia(self.test_nc))
+            self.assertTrue(os.path.exists(os.path.join(workdir, 'conae.gif')))
+            self.assertEqual(main.reprocesar(archivos), {'procesados': 0, 'omitidos': 1, 'errores': 0})
+            self.assertEqual(main.reprocesar(archivos, forzar=True)['procesados'], 1)
+        print("\033[92m✓ Reprocesamiento por lotes correcto\033[0m")
+
+    def test_basemap_cache(self):
+        """Prueba que componer el mapa base en caché equivale a dibujar todas las capas."""
+        extent = [-76.0, -52.0, -56.0, -21.0]
+        data = np.random.RandomState(0).randint(0, 4, (300, 240)).astype(float)
+        cmap = matplotlib.colors.ListedColormap(['white', 'yellow', 'orange', 'red'])
+        title = 'GOES-16 ABI Canal 13 - Mapa de Topes Nubosos 2024/11/26 23:00:20 UTC'
+
+        with patch.object(basemap, 'GetPlotObject', mapa_sin_shapefiles):
+            fig = plt.figure(figsize=(6, 7))
+            ax = mapa_sin_shapefiles(CONF_PRUEBA, extent)
+            goeshelp.AddColorbar(fig, ax)
+            ax.imshow(data, transform=ccrs.PlateCarree(), extent=extent, cmap=cmap, vmin=-0.5, vmax=3.5,
+                      aspect='auto', interpolation='nearest')
+            goeshelp.AddImageFoot(ax, title, size=8.0)
+            goeshelp.AddLogo(ax)
+            fig.savefig(os.path.join(self.test_workdir, 'capas.png'), dpi=100)
+            plt.close(fig)
+
+            base = basemap.GetBasemap(CONF_PRUEBA, extent)
+            self.assertIs(basemap.GetBasemap(CONF_PRUEBA, extent), base)
+            fig, ax = base.NewFrame()
+            ax.imshow(data, transform=ccrs.PlateCarree(), extent=extent, cmap=cmap, vmin=-0.5, vmax=3.5,
+                      aspect='auto', interpolation='nearest')
+            base.AddTitle(fig, title, size=8.0)
+            fig.savefig(os.path.join(self.test_workdir, 'cache.png'), dpi=100)
+            plt.close(fig)
+
+        expected = np.asarray(Image.open(os.path.join(self.test_workdir, 'capas.png')).convert('RGB'), dtype=int)
+        result = np.asarray(Image.open(os.path.join(self.test_workdir, 'cache.png')).convert('RGB'), dtype=int)
+        self.assertEqual(expected.shape, result.shape)
+        # Solo difieren bordes suavizados compuestos sobre fondo transparente
+        self.assertLess((np.abs(expected - result).max(axis=2) > 8).mean(), 0.005)
+        print("\033[92m✓ Mapa base en caché correcto\033[0m")
+
+    def test_render_numpy(self):
+        """Prueba que el motor sin matplotlib dibuja lo mismo que la figura con el mapa base en caché y que la original."""
+        extent = [-76.0, -52.0, -56.0, -21.0]
+        classes = np.random.RandomState(1).randint(0, 4, (150, 120)).astype(np.uint8)
+        rows, cols = np.mgrid[0:300, 0:240]
+        index_map = ((rows // 2) * 120 + cols // 2).astype(np.int32)
+        index_map[:10] = classes.size  # Centinela: sin dato
+        cmap = matplotlib.colors.ListedColormap(['white', 'yellow', 'orange', 'red'])
+        title = 'GOES-16 ABI Canal 13 - Mapa de Topes Nubosos 2024/11/26 23:00:20 UTC'
+
+        with patch.object(basemap, 'GetPlotObject', mapa_sin_shapefiles):
+            base = basemap.GetBasemap(CONF_PRUEBA, extent)
+        fig, ax = base.NewFrame()
+        ax.imshow(resample.Reproject(classes.astype(float), index_map, np.nan), transform=ccrs.PlateCarree(),
+                  extent=extent, cmap=cmap, vmin=-0.5, vmax=3.5, aspect='auto', interpolation='nearest')
+        base.AddTitle(fig, title, size=8.0)
+        fig.savefig(os.path.join(self.test_workdir, 'matplotlib.png'), dpi=100)
+        plt.close(fig)
+
+        renderer = render.GetRenderer(base, extent, index_map)
+        self.assertIs(render.GetRenderer(base, extent, index_map), renderer)
+        renderer.Render(classes, title, os.path.join(self.test_workdir, 'numpy.png'))
+
+        image = Image.open(os.path.join(self.test_workdir, 'numpy.png'))
+        self.assertEqual(image.mode, 'P')
+        expected = np.asarray(Image.open(os.path.join(self.test_workdir, 'matplotlib.png')).convert('RGB'), dtype=int)
+        result = np.asarray(image.convert('RGB'), dtype=int)
+        self.assertEqual(expected.shape, result.shape)
+        # Difieren el suavizado del título y los bordes de celda que caen justo en el centro de un píxel
+        self.assertLess((np.abs(expected - result).max(axis=2) > 8).mean(), 0.02)
+
+        # La figura original, armada cuadro a cuadro con GetPlotObject (sin `basemap_cache`)
+        fig = plt.figure(clear='True')
+        fig.set_size_inches(CONF_PRUEBA['figure_length_inches'], CONF_PRUEBA['figure_high_inches'])
+        ax = mapa_sin_shapefiles(CONF_PRUEBA, extent)
+        goeshelp.AddColorbar(fig, ax)
+        plt.imshow(resample.Reproject(classes, index_map, 0), transform=ccrs.PlateCarree(), extent=extent, origin='upper',
+                   cmap=cmap, vmin=-0.5, vmax=3.5, aspect='auto', interpolation='nearest')
+        goeshelp.AddTemperatureLegend(ax)
+        goeshelp.AddImageFoot(ax, title, size=8.0)
+        goeshelp.AddLogo(ax)
+        fig.savefig(os.path.join(self.test_workdir, 'original.png'), dpi=CONF_PRUEBA['figure_resolution_dpi'])
+        plt.close(fig)
+        original = np.asarray(Image.open(os.path.join(self.test_workdir, 'original.png')).convert('RGB'), dtype=int)
+        self.assertEqual(original.shape, result.shape)
+        self.assertLess((np.abs(original - result).max(axis=2) > 8).mean(), 0.02)
+
+        # Sin matplotlib instalado los títulos se dibujan con la tipografía por defecto de Pillow
+        with patch.dict(render._fonts, clear=True), patch.object(render.importlib.util, 'find_spec', return_value=None):
+            self.assertIsNone(render.GetFontPath())
+            self.assertGreater(render.GetFont(11).getlength('GOES'), 0)
+        print("\033[92m✓ Motor de dibujo sin matplotlib correcto\033[0m")
+
+    def test_read_raw_window(self):
+        """Prueba la lectura alineada a los chunks con netCDF4 y con lectura directa de chunks en h5py."""
+        self.assertEqual(goeshelp.GetChunkAlignedWindow([70, 200, 10, 130], (64, 64), (543, 543)), [64, 256, 0, 192])
+        self.assertEqual(goeshelp.GetChunkAlignedWindow([500, 543, 500, 543], (64, 64), (543, 543)), [448, 543, 448, 543])
+        archivo = crear_archivo_goes(os.path.join(self.test_workdir, "OR_ABI-L1b-RadF-M6C13_G16_s20243312310207.nc"), shuffle=True)
+        with Dataset(archivo, "a") as nc:
+            nc["Rad"].set_auto_maskandscale(False)
+            nc["Rad"][100, 120] = 4095  # Relleno
+        with Dataset(archivo) as nc:
+            ventana = [70, 540, 10, 300]
+            rad = nc["Rad"]
+            rad.set_auto_maskandscale(False)
+            esperado = rad[10:300, 70:540]
+            rad.set_auto_maskandscale(True)
+            for engine in ('netcdf4', 'h5py'):
+                crudo = goeshelp.ReadRawWindow(nc, ventana, engine=engine, threads=3)
+                np.testing.assert_array_equal(crudo, esperado)
+            valores = goeshelp.ScaleCounts(rad, crudo)
+            self.assertEqual(valores.dtype, np.float32)
+            np.testing.assert_allclose(valores, np.ma.filled(rad[10:300, 70:540].astype(np.float64), np.nan), rtol=1e-5)
+            self.assertTrue(np.isnan(valores[90, 50]))
+
+            # La lectura no cambia el estado de enmascarado y escala de la variable del llamador
+            rad.set_auto_scale(False)
+            goeshelp.ReadRawWindow(nc, ventana)
+            self.assertEqual((rad.mask, rad.scale), (True, False))
+        print("\033[92m✓ Lectura alineada a los chunks correcta\033[0m")
+
+    def test_calibration_lut(self):
+        """Prueba que la tabla conteo -> clase equivale a calibrar y clasificar en punto flotante."""
+        thresholds = (-53, -63, -73, -90)
+        with Dataset(self.test_nc) as nc:
+            img_indexes = [100, 400, 50, 350]
+            image_class = calibration.ClassifyCounts(nc, img_indexes, thresholds)
+            self.assertEqual(image_class.dtype, np.uint8)
+            self.assertIs(calibration.GetLUTs(nc, thresholds), calibration.GetLUTs(nc, thresholds))
+
+            rad = nc.variables['Rad'][50:350, 100:400]
+            image_cal, _ = goeshelp.GetCalibratedImage(nc, rad)
+            image_cal = np.ma.filled(image_cal.astype(float), np.nan)
+            temperature, _ = calibration.GetLUTs(nc, thresholds)
+            bt = temperature[calibration.ReadCounts(nc, img_indexes)]
+            np.testing.assert_allclose(bt, image_cal, atol=1e-3, equal_nan=True)
+
+        expected = np.zeros(image_cal.shape, dtype=np.uint8)
+        expected[(image_cal < -53) & (image_cal >= -63)] = 1
+        expected[(image_cal < -63) & (image_cal >= -73)] = 2
+        expected[(image_cal < -73) & (image_cal >= -90)] = 3
+        np.testing.assert_array_equal(image_class, expected)
+        self.assertTrue(np.all(np.isin([1, 2, 3], image_class)))
+        print("\033[92m✓ Calibración con tabla correcta\033[0m")
+
+    def test_classify_blocks(self):
+        """Prueba que el procesamiento por bloques dé el mismo resultado con menos memoria de trabajo."""
+        import tracemalloc
+        umbrales = (-53, -63, -73, -90)
+        ventana = [0, 543, 0, 543]
+        with Dataset(self.test_nc) as nc:
+            self.assertEqual(calibration.GetBlockRows(nc, ventana, 16, 0.5), 64)
+            self.assertEqual(calibration.GetBlockRows(nc, ventana, 16, None), 543)
+            for use_lut in (True, False):
+                tracemalloc.start()
+                clases, temperatura = calibration.ClassifyWindow(nc, ventana, umbrales, use_lut=use_lut, with_temperature=True)
+                pico_completo = tracemalloc.get_traced_memory()[1]
+                tracemalloc.reset_peak()
+                # Las clases y la temperatura del recorte (1,4 MB) ya superan el presupuesto: se avisa y se usa un chunk de filas
+                with self.assertLogs(level='WARNING'):
+                    por_bloques = calibration.ClassifyWindow(nc, ventana, umbrales, use_lut=use_lut, with_temperature=True,
+                                                             memory_budget_mb=0.5)
+                pico_bloques = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                np.testing.assert_array_equal(por_bloques[0], clases)
+                np.testing.assert_allclose(por_bloques[1], temperatura, atol=1e-3)
+                self.assertLess(pico_bloques, pico_completo)
+            np.testing.assert_array_equal(clases, calibration.ClassifyCounts(nc, ventana, umbrales))
+
+            # Con h5py el archivo se abre una sola vez para todos los bloques
+            import h5py
+            with patch.object(h5py, "File", wraps=h5py.File) as abrir:
+                por_bloques = calibration.ClassifyWindow(nc, ventana, umbrales, engine='h5py', memory_budget_mb=0.5)
+            self.assertEqual(abrir.call_count, 1)
+            np.testing.assert_array_equal(por_bloques[0], clases)
+
+        # Un Dataset en memoria (modo en memoria del descargador) no tiene archivo: se lee con netCDF4
+        with open(self.test_nc, "rb") as fp:
+            contenido = fp.read()
+        with Dataset(os.path.basename(self.test_nc), memory=contenido) as nc:
+            self.assertIsNone(goeshelp.OpenChunkReader(nc))
+            np.testing.assert_array_equal(calibration.ClassifyWindow(nc, ventana, umbrales, engine='h5py')[0], clases)
+        print("\033[92m✓ Procesamiento por bloques correcto\033[0m")
+
+    def test_animation_builder(self):
+        """Prueba la ventana móvil de la animación y la inserción ordenada de cuadros."""
+        gif_path = os.path.join(self.test_workdir, 'ventana.gif')
+        builder = animation.AnimationBuilder(gif_path, frame_duration=0.5, max_frames=3, max_hours=1.0,
+                                             formats=['gif', 'webp'])
+        paths = []
+        for i, minute in enumerate([0, 10, 20, 30, 40]):
+            path = os.path.join(self.test_workdir, f'CONAE_PRD_GOES16_ABI_IROL_20241126_23{minute:02d}20000_gCArgentina_v001.png')
+            Image.new('RGB', (40, 30), (60 * i, 0, 0)).save(path)
+            paths.append(path)
+
+        self.assertEqual(builder.Seed(paths[:2]), 2)
+        # Los cuadros pueden llegar desordenados; uno más antiguo que la ventana se descarta
+        self.assertTrue(builder.AddFrame(paths[4]))
+        self.assertTrue(builder.AddFrame(paths[2]))
+        self.assertFalse(builder.AddFrame(paths[0]))
+        self.assertTrue(builder.Flush(timeout=30))
+        builder.Close()
+
+        self.assertEqual(len(builder), 3)
+        with Image.open(gif_path) as gif:
+            self.assertEqual(gif.n_frames, 3)
+            reds = []
+            for frame in range(gif.n_frames):
+                gif.seek(frame)
+                reds.append(gif.convert('RGB').getpixel((0, 0))[0])
+        self.assertEqual(reds, [60, 120, 240])
+        self.assertTrue(os.path.exists(os.path.join(self.test_workdir, 'ventana.webp')))
+        self.assertEqual(animation.FrameTimeFromName(paths[3]).minute, 30)
+        print("\033[92m✓ Animación con ventana móvil correcta\033[0m")
+
+    def test_processing_pool(self):
+        """Prueba la cola acotada del pool de procesos: deduplicación, contrapresión y resultados."""
+        resultados = {}
+        pool = ProcessingPool(time.sleep, workers=1, queue_size=1,
+                              on_result=lambda path, res: resultados.setdefault(path, res))
+        self.assertTrue(pool.Submit(1.0))
+        self.assertFalse(pool.Submit(1.0))  # Ya está pendiente
+        aceptados = [1.0] + [d for d in (0.5, 0.6, 0.7, 0.8) if pool.Submit(d, timeout=0.2)]
+        # Capacidad: un archivo en proceso, uno en el despachador y uno en la cola
+        self.assertLess(len(aceptados), 5)
+        self.assertTrue(pool.Join(timeout=60))
+        pool.Close()
+        self.assertEqual(sorted(resultados), sorted(aceptados))
+        print("\033[92m✓ Pool de procesamiento correcto\033[0m")
+
+    def test_processed_index(self):
+        """Prueba el registro de archivos procesados y el orden de recuperación."""
+        db_file = os.path.join(self.test_workdir, 'processed.sqlite')
+        paths = []
+        for hour in ['21', '23', '22']:
+            path = os.path.join(self.test_workdir, f'OR_ABI-L1b-RadF-M6C13_G16_s2024331{hour}00207_e1_c1.nc')
+            with open(path, 'wb') as f:
+                f.write(b'CDF')
+            paths.append(path)
+
+        indice = ProcessedIndex(db_file)
+        self.assertEqual(indice.Pending(paths), [paths[1], paths[2], paths[0]])  # Más reciente primero
+        self.assertTrue(indice.Add(paths[1], 'imagen.png'))
+        self.assertFalse(indice.Add(paths[1]))
+        indice.Close()
+
+        indice = ProcessedIndex(db_file)
+        self.assertTrue(indice.IsProcessed(paths[1]))
+        self.assertEqual(indice.Pending(paths), [paths[2], paths[0]])
+        # Un archivo reemplazado con otro contenido vuelve a quedar pendiente
+        with open(paths[1], 'wb') as f:
+            f.write(b'CDF otro contenido')
+        self.assertFalse(indice.IsProcessed(paths[1]))
+        indice.Close()
+        print("\033[92m✓ Registro de archivos procesados correcto\033[0m")
+
+    def test_importacion_rapida(self):
+        """Prueba que importar el procesador no cargue las dependencias pesadas (ni Pillow) ni lea la configuración."""
+        directorio = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Procesador'))
+        tiempo, modulos = medir_importacion('main', directorio)
+        self.assertFalse(modulos & {'matplotlib', 'cartopy', 'netCDF4', 's3fs', 'h5py', 'PIL'})
+        self.assertLess(tiempo, 1.5)
+        print(f"\033[92m✓ Importación del procesador en {tiempo:.2f} s\033[0m")
+
 
 if __name__ == "__main__":
     print("\nEjecutando pruebas para la lógica del procesador...\n")